@@ -1,9 +1,13 @@
 import frappe
 from frappe import _
 
-def handle_cors():
+# Response headers the frontend reads (conditional GETs, keyset pagination)
+EXPOSED_HEADERS = "ETag, X-Next-Cursor"
+
+
+def handle_cors(response=None):
     """Thêm CORS headers vào response"""
-    if not frappe.request or not frappe.response:
+    if not frappe.request or response is None:
         return
         
     # Kiểm tra nguồn gốc request
@@ -15,7 +19,42 @@ def handle_cors():
     
     # Nếu origin nằm trong danh sách cho phép
     if origin in allowed_origins or "*" in allowed_origins:
-        frappe.response.headers["Access-Control-Allow-Origin"] = origin
-        frappe.response.headers["Access-Control-Allow-Credentials"] = "true"
-        frappe.response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
-        frappe.response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With, X-Frappe-CSRF-Token" 
\ No newline at end of file
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Credentials"] = "true"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS, PATCH"
+        response.headers["Access-Control-Allow-Headers"] = (
+            "Content-Type, Authorization, X-Requested-With, X-Frappe-CSRF-Token, If-None-Match, Idempotency-Key"
+        )
+        # Không có dòng này trình duyệt ẩn ETag / X-Next-Cursor khỏi JavaScript
+        response.headers["Access-Control-Expose-Headers"] = EXPOSED_HEADERS
+
+def set_response_header(key, value):
+    """Ghi nhận header để after_request gắn vào response"""
+    if not getattr(frappe.local, "elearning_response_headers", None):
+        frappe.local.elearning_response_headers = {}
+    frappe.local.elearning_response_headers[key] = value
+
+
+def apply_response_headers(response=None):
+    """Gắn các header đã ghi nhận trong request vào response"""
+    headers = getattr(frappe.local, "elearning_response_headers", None)
+    if not headers or response is None:
+        return
+    for key, value in headers.items():
+        response.headers[key] = value
+
+
+def respond_with_etag(payload, etag):
+    """
+    Trả về payload kèm ETag. Nếu client gửi If-None-Match trùng ETag hiện tại
+    thì trả về 304 không có body để client dùng lại bản đã có.
+    """
+    set_response_header("ETag", etag)
+    set_response_header("Cache-Control", "private, no-cache")
+
+    if_none_match = frappe.get_request_header("If-None-Match") if frappe.request else None
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        frappe.local.response["http_status_code"] = 304
+        return None
+
+    return payload
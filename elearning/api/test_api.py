@@ -2,6 +2,9 @@ import frappe
 from frappe import _
 from frappe.utils import now_datetime, get_datetime
 import json
+from elearning.elearning.utils.idempotency import get_idempotency_key, run_idempotent_submission
+from elearning.elearning.utils.pagination import keyset_condition, get_page_size, get_next_cursor
+from elearning.api.api import set_response_header
 
 @frappe.whitelist(allow_guest=True)
 def start_test_attempt(test_id):
@@ -51,7 +54,27 @@ def start_test_attempt(test_id):
         frappe.throw(_("Failed to create test attempt: {0}").format(str(e)))
 
 @frappe.whitelist(allow_guest=True)
-def submit_test(test_id, test_attempt_id, submission_data):
+def submit_test(test_id, test_attempt_id, submission_data, idempotency_key=None):
+    """Submit a test attempt with answers (idempotent per Idempotency-Key)"""
+    if not test_attempt_id:
+        frappe.throw(_("Test ID and attempt ID are required"))
+
+    # Check ownership before a key can be claimed on the attempt (attempts started here only set owner)
+    attempt = frappe.db.get_value("Test Attempt", test_attempt_id, ["user", "owner"], as_dict=True)
+    if not attempt:
+        frappe.throw(_("Test attempt not found"), frappe.DoesNotExistError)
+    if frappe.session.user == "Guest" or (attempt.user or attempt.owner) != frappe.session.user:
+        frappe.throw(_("You are not permitted to submit this test attempt"), frappe.PermissionError)
+
+    return run_idempotent_submission(
+        test_attempt_id,
+        get_idempotency_key(idempotency_key),
+        lambda: _submit_test(test_id, test_attempt_id, submission_data),
+        {"success": True, "test_attempt_id": test_attempt_id, "status": "Processing", "message": "Test submission is being processed"},
+    )
+
+
+def _submit_test(test_id, test_attempt_id, submission_data):
     """Submit a test attempt with answers"""
     try:
         # Log incoming data for debugging
@@ -527,76 +550,54 @@ def calculate_test_score(test_attempt_id):
         return {"score": 0, "total_points": 0, "raw_score": 0, "is_passed": 0}
     
 @frappe.whitelist(allow_guest=True)
-def get_test_attempts(test_id):
-    """Get all completed test attempts for the current user and specified test"""
+def get_test_attempts(test_id, limit=None, cursor=None):
+    """
+    Get completed test attempts for the current user and specified test.
+    Pass `limit` (and the X-Next-Cursor header value as `cursor`) to page.
+    """
     try:
         if not test_id:
             frappe.throw(_("Test ID is required"))
             
         # Get the current user
         student = frappe.session.user
-        
-        # # Check if user is logged in
-        # if student == "Guest":
-        #     frappe.throw(_("Please log in to view test attempts"))
-        
-        # Log for debugging
-        frappe.logger().info(f"Fetching test attempts for test_id={test_id}, student={student}")
-        
-        # Get all completed attempts for this user and test
-        filters = {
-            "test": test_id,
-            "student": student,
-            "status": "Completed"
-        }
-        
-        # Log the filters we're using
-        frappe.logger().info(f"Using filters: {filters}")
-        
-        attempts = frappe.get_all(
-            "Test Attempt",
-            filters=filters,
-            fields=[
-                "name",
-                "end_time", 
-                "start_time",
-                "final_score", 
-                "is_passed"
-            ],
-            order_by="end_time desc"
+
+        params = {"test": test_id, "user": student}
+        conditions = keyset_condition("end_time", "name", cursor, params)
+        page_size = get_page_size(limit) if (limit or cursor) else None
+        limit_clause = f"LIMIT {page_size + 1}" if page_size else ""
+
+        # Test Attempt links the student through `user`
+        attempts = frappe.db.sql(
+            f"""
+            SELECT name, end_time, final_score, is_passed,
+                   COALESCE(TIMESTAMPDIFF(SECOND, start_time, end_time), 0) AS time_spent
+            FROM `tabTest Attempt`
+            WHERE test = %(test)s AND user = %(user)s AND status = 'Completed' {conditions}
+            ORDER BY end_time DESC, name DESC
+            {limit_clause}
+            """,
+            params,
+            as_dict=True,
         )
-        
-        # Log the raw attempts we got
-        frappe.logger().info(f"Found {len(attempts)} attempts for test {test_id}")
-        
+
+        if page_size:
+            next_cursor = get_next_cursor(attempts, page_size, "end_time")
+            attempts = attempts[:page_size]
+            if next_cursor:
+                set_response_header("X-Next-Cursor", next_cursor)
+
         # Format the data for display
-        formatted_attempts = []
-        for attempt in attempts:
-            # Calculate time spent from start_time and end_time
-            time_spent = 0
-            if attempt.get("start_time") and attempt.get("end_time"):
-                try:
-                    start = get_datetime(attempt.start_time)
-                    end = get_datetime(attempt.end_time)
-                    time_diff = end - start
-                    time_spent = int(time_diff.total_seconds())
-                except Exception as e:
-                    frappe.logger().debug(f"Error calculating time spent: {str(e)}")
-                    time_spent = 0
-                    
-            # Format the attempt data
-            formatted_attempts.append({
+        return [
+            {
                 "id": attempt.name,
                 "date": frappe.utils.format_datetime(attempt.end_time, "medium") if attempt.get("end_time") else "",
                 "score": attempt.get("final_score", 0) or 0,
-                "time_taken": format_time_spent(time_spent),
+                "time_taken": format_time_spent(attempt.time_spent),
                 "is_passed": attempt.get("is_passed", 0) or 0
-            })
-        
-        # Log the formatted attempts we're returning
-        frappe.logger().info(f"Returning {len(formatted_attempts)} formatted attempts")
-        
-        return formatted_attempts
+            }
+            for attempt in attempts
+        ]
         
     except Exception as e:
         frappe.log_error(f"Error getting test attempts: {str(e)}, traceback: {frappe.get_traceback()}")
@@ -614,8 +615,8 @@ def get_test_attempt_result(attempt_id):
         if frappe.session.user != attempt.student and not frappe.has_permission("Test Attempt", "read"):
             frappe.throw(_("You don't have permission to access this test attempt"))
             
-        # Get the test details
-        test = frappe.get_doc("Test", attempt.test)
+        # Get the test details (question_count is stored on Test, no need to load its questions)
+        test = frappe.get_cached_value("Test", attempt.test, ["name", "title", "question_count"], as_dict=True)
         
         # Get all answers for this attempt
         answers = frappe.get_all(
@@ -649,7 +650,7 @@ def get_test_attempt_result(attempt_id):
             "time_taken": format_time_spent(time_spent),
             "final_score": attempt.final_score or 0,
             "is_passed": attempt.is_passed or 0,
-            "total_questions": len(frappe.get_all("Test Question Item", filters={"parent": test.name})),
+            "total_questions": test.question_count or 0,
             "correct_answers": correct_answers
         }
         
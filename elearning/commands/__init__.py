@@ -0,0 +1,118 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("gemini-stub")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=8765, show_default=True, type=int)
+@click.option("--latency", default="fixed:0", show_default=True,
+              help="fixed:MS, uniform:MIN-MAX, normal:MEAN,SD or lognormal:MEDIAN,SIGMA (milliseconds)")
+@click.option("--error-rate", default=0.0, show_default=True, type=float, help="Share of calls answered with --error-status")
+@click.option("--error-status", default=503, show_default=True, type=int)
+@click.option("--chunk-size", default=40, show_default=True, type=int, help="Characters per streamGenerateContent chunk")
+@click.option("--seed", default=None, type=int, help="Seed for latency/error sampling, for reproducible runs")
+@click.option("--record", "record_dir", default=None, help="Forward calls upstream and save the transcripts in this directory")
+@click.option("--upstream", default="https://generativelanguage.googleapis.com", show_default=True)
+@click.option("--replay", "replay_dir", default=None, help="Serve the transcripts saved by --record from this directory")
+def gemini_stub(host, port, latency, error_rate, error_status, chunk_size, seed, record_dir, upstream, replay_dir):
+	"""Run a local Gemini API stub. Point a site at it with
+	`bench --site <site> set-config gemini_base_url http://127.0.0.1:8765/v1beta`."""
+	from elearning.commands.gemini_stub import serve
+
+	if record_dir and replay_dir:
+		raise click.UsageError("--record and --replay are exclusive")
+	mode = f"recording to {record_dir}" if record_dir else f"replaying {replay_dir}" if replay_dir else "synthesizing"
+	click.echo(f"Gemini stub on http://{host}:{port}/v1beta ({mode}, latency {latency}, error rate {error_rate})")
+	stats = serve(
+		host, port, latency=latency, error_rate=error_rate, error_status=error_status, seed=seed, stream_chunk_size=chunk_size,
+		record_dir=record_dir, upstream=upstream, replay_dir=replay_dir
+	)
+	click.echo(f"Served {stats}")
+
+
+@click.command("generate-synthetic-data")
+@click.option("--seed", default=42, show_default=True, type=int)
+@click.option("--users", type=int, help="Students (default 5000)")
+@click.option("--topics", type=int, help="Topics (default 2000)")
+@click.option("--cards-per-topic", help="Count distribution, e.g. 30, uniform:10-50, geometric:30")
+@click.option("--srs-cards-per-user", help="User SRS Progress rows per student (default geometric:200)")
+@click.option("--exam-attempts-per-user", help="User Exam Attempts per student (default geometric:8)")
+@click.option("--cards-per-exam-attempt", help="Flashcards per exam attempt (default uniform:5-20)")
+@click.option("--questions", type=int, help="Question bank size (default 20000)")
+@click.option("--essay-fraction", type=float, help="Share of Essay questions (default 0.15)")
+@click.option("--self-write-fraction", type=float, help="Share of Self Write questions (default 0.25)")
+@click.option("--tests", type=int, help="Tests (default 500)")
+@click.option("--questions-per-test", help="Questions per test (default uniform:10-40)")
+@click.option("--test-attempts-per-user", help="Test Attempts per student (default geometric:5)")
+@click.option("--purge", is_flag=True, help="Delete the synthetic dataset instead of generating one")
+@pass_context
+def generate_synthetic_data(context, seed, purge, **options):
+	"""Bulk insert a production-shaped synthetic dataset for performance testing."""
+	from elearning.commands.synthetic_data import generate_dataset, purge_dataset
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		if purge:
+			purge_dataset(log=click.echo)
+		else:
+			counts = generate_dataset(seed=seed, log=click.echo, **options)
+			click.echo(f"Inserted {sum(counts.values())} rows")
+	finally:
+		frappe.destroy()
+
+
+@click.command("run-benchmarks")
+@click.option("--only", multiple=True, help="Scenario to run (repeatable), default all")
+@click.option("--iterations", default=20, show_default=True, type=int)
+@click.option("--warmup", default=2, show_default=True, type=int)
+@click.option("--cold", is_flag=True, help="Clear the cache before every call")
+@click.option("--user", default=None, help="Synthetic student to run as (default: the one with most attempts)")
+@click.option("--budgets", "budgets_path", default=None, help="Budgets JSON (default: elearning/commands/benchmark_budgets.json)")
+@click.option("--update-budgets", is_flag=True, help="Write the measured query counts and rows read (+25%) as the new budgets")
+@click.option("--with-latency", is_flag=True, help="With --update-budgets, also write p50/p95 (+25%) for this machine")
+@click.option("--output", default=None, help="Also write the results as JSON to this file")
+@pass_context
+def run_benchmarks(context, only, iterations, warmup, cold, user, budgets_path, update_budgets, with_latency, output):
+	"""Benchmark the student endpoints against the synthetic dataset; exits 1 when a budget is exceeded."""
+	import json
+
+	from elearning.commands.benchmark import (
+		BUDGETS_FILE, budgets_from_results, check_budgets, load_budgets, run_benchmarks as run
+	)
+
+	site = get_site(context)
+	frappe.init(site=site)
+	frappe.connect()
+	try:
+		if not frappe.conf.get("gemini_base_url"):
+			raise click.ClickException("Set gemini_base_url to a `bench gemini-stub` server first, benchmarks must not call Gemini")
+		results = run(only=list(only), iterations=iterations, warmup=warmup, cold=cold, user=user, log=click.echo)
+	finally:
+		frappe.destroy()
+
+	if output:
+		with open(output, "w") as f:
+			json.dump(results, f, indent=1)
+
+	budgets_path = budgets_path or BUDGETS_FILE
+	budgets = load_budgets(budgets_path)
+	if update_budgets:
+		with open(budgets_path, "w") as f:
+			json.dump(budgets_from_results(results, budgets, with_latency), f, indent=1)
+			f.write("\n")
+		click.echo(f"Budgets written to {budgets_path}")
+		return
+
+	failures, warnings = check_budgets(results, budgets)
+	if warnings:
+		click.secho("Budgets missing:\n  " + "\n  ".join(warnings), fg="yellow")
+	if failures:
+		click.secho("Budget exceeded:\n  " + "\n  ".join(failures), fg="red")
+		raise SystemExit(1)
+	click.secho("All recorded budgets met" if warnings else "All budgets met", fg="green")
+
+
+commands = [gemini_stub, generate_synthetic_data, run_benchmarks]
@@ -0,0 +1,251 @@
+# elearning/commands/benchmark.py
+import json
+import math
+import os
+import time
+import uuid
+
+import frappe
+
+from elearning.commands.synthetic_data import SYNTHETIC_EMAIL_DOMAIN, SYNTHETIC_PREFIX
+
+# In-process benchmarks of the student-facing endpoints against the dataset
+# of `bench generate-synthetic-data`. Each scenario prepares its arguments
+# outside the timed section, then the endpoint runs with frappe.db.sql
+# wrapped to count queries, rows returned and (MariaDB) rows read by the
+# storage engine. p50/p95 and the worst per-call counts are compared with
+# BUDGETS_FILE; a scenario over budget fails the run. Query and rows-read
+# counts are deterministic for the seed 42 dataset and should be recorded
+# (--update-budgets); until they are, the run warns instead of failing.
+# Latency budgets depend on the machine and stay optional (null).
+#
+# Write endpoints really write (attempts are created and submitted), so run
+# this on a benchmark site only. Essay grading and feedback call Gemini:
+# point gemini_base_url at `bench gemini-stub` first.
+BUDGETS_FILE = os.path.join(os.path.dirname(__file__), "benchmark_budgets.json")
+BUDGET_METRICS = ("p50_ms", "p95_ms", "queries", "rows_read")
+REQUIRED_METRICS = ("queries", "rows_read")
+# --update-budgets records query counts exactly and the other values with this much
+# headroom (rows read moves a little with index statistics)
+BUDGET_HEADROOM = 1.25
+
+
+class QueryCounter:
+    """Counts frappe.db.sql calls (frappe.qb and get_all/get_value go through it too)"""
+
+    def __init__(self):
+        self.queries = 0
+        self.rows_returned = 0
+        self.rows_read = 0
+
+    def __enter__(self):
+        self.original_sql = frappe.db.sql
+        frappe.db.sql = self.sql
+        self.handler_reads_before = self.handler_reads()
+        return self
+
+    def __exit__(self, *exc):
+        frappe.db.sql = self.original_sql
+        if self.handler_reads_before is not None:
+            self.rows_read = self.handler_reads() - self.handler_reads_before
+
+    def sql(self, query, *args, **kwargs):
+        self.queries += 1
+        result = self.original_sql(query, *args, **kwargs)
+        if isinstance(result, (list, tuple)):
+            self.rows_returned += len(result)
+        return result
+
+    def handler_reads(self):
+        """Sum of the session Handler_read_* counters: rows the engine touched, not just returned"""
+        if frappe.db.db_type != "mariadb":
+            return None
+        rows = self.original_sql("show session status like 'Handler_read%%'")
+        return sum(int(value) for _name, value in rows)
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(share * len(ordered)) - 1))]
+
+
+class BenchmarkContext:
+    """A synthetic student with data, plus the topics/tests the scenarios use"""
+
+    def __init__(self, user=None):
+        self.user = user or frappe.db.sql(
+            """select user from `tabTest Attempt` where user like %s
+            group by user order by count(*) desc, user limit 1""",
+            f"%@{SYNTHETIC_EMAIL_DOMAIN}",
+        )[0][0]
+        self.topic = frappe.db.sql(
+            """select topic from `tabUser Exam Attempt` where user = %s
+            group by topic order by count(*) desc, topic limit 1""",
+            self.user,
+        )[0][0]
+        self.tests = frappe.get_all(
+            "Test", filters={"name": ["like", f"{SYNTHETIC_PREFIX}%"], "is_active": 1}, pluck="name", order_by="name asc"
+        )
+        self.graded_attempt = frappe.get_all(
+            "Test Attempt", filters={"user": self.user, "status": ["in", ["Completed", "Graded"]]}, pluck="name",
+            order_by="name asc", limit=1
+        )[0]
+        self.test_index = 0
+        self.exam = None
+        self.exam_card_index = 0
+
+    def next_test(self):
+        """A different test each call, so start/submit don't just resume one attempt"""
+        self.test_index += 1
+        return self.tests[self.test_index % len(self.tests)]
+
+    def fresh_test_attempt(self):
+        from elearning.elearning.doctype.test_attempt.test_attempt import start_or_resume_test_attempt
+        return start_or_resume_test_attempt(self.next_test())
+
+    def exam_answer(self):
+        from elearning.elearning.doctype.user_exam_attempt.user_exam_attempt import start_exam_attempt
+        if not self.exam or self.exam_card_index >= len(self.exam["flashcards"]):
+            self.exam = start_exam_attempt(self.topic)["attempt"]
+            self.exam_card_index = 0
+        flashcard = self.exam["flashcards"][self.exam_card_index]
+        self.exam_card_index += 1
+        # Numeric answers are graded locally, other flashcard types reach the (stub) LLM
+        return {"attempt_name": self.exam["name"], "flashcard_name": flashcard["name"], "user_answer": "0"}
+
+
+def _answers_for(started):
+    """Answers for every question of a started test attempt: first option, "3" or a short essay"""
+    answers = {}
+    for question in started["questions"]:
+        if question["options"]:
+            answer = question["options"][0]["id"]
+        elif question["question_type"] == "Essay":
+            answer = "Chuyển vế: x = 3."
+        else:
+            answer = "3"
+        answers[question["test_question_detail_id"]] = {"userAnswer": answer, "timeSpentSeconds": 30}
+    return answers
+
+
+def _progress_args(ctx):
+    started = ctx.fresh_test_attempt()
+    return {"attempt_id": started["attempt"]["id"], "progress_data": json.dumps({"answers": _answers_for(started)})}
+
+
+def _submit_args(ctx):
+    started = ctx.fresh_test_attempt()
+    return {
+        "attempt_id": started["attempt"]["id"],
+        "submission_data": json.dumps({"answers": _answers_for(started)}),
+        "idempotency_key": uuid.uuid4().hex,
+    }
+
+
+SRS = "elearning.elearning.doctype.user_srs_progress.user_srs_progress"
+EXAM = "elearning.elearning.doctype.user_exam_attempt.user_exam_attempt"
+TEST = "elearning.elearning.doctype.test_attempt.test_attempt"
+
+# name -> (dotted endpoint, ctx -> kwargs prepared outside the timed section)
+SCENARIOS = {
+    "get_srs_review_cards": (f"{SRS}.get_srs_review_cards", lambda ctx: {"topic_name": ctx.topic}),
+    "get_due_srs_summary": (f"{SRS}.get_due_srs_summary", lambda ctx: {}),
+    "start_exam_attempt": (f"{EXAM}.start_exam_attempt", lambda ctx: {"topic_name": ctx.topic}),
+    "submit_exam_answer_and_get_feedback": (f"{EXAM}.submit_exam_answer_and_get_feedback", lambda ctx: ctx.exam_answer()),
+    "start_or_resume_test_attempt": (f"{TEST}.start_or_resume_test_attempt", lambda ctx: {"test_id": ctx.next_test()}),
+    "save_attempt_progress": (f"{TEST}.save_attempt_progress", _progress_args),
+    "submit_test_attempt": (f"{TEST}.submit_test_attempt", _submit_args),
+    "get_attempt_result_details": (f"{TEST}.get_attempt_result_details", lambda ctx: {"attempt_id": ctx.graded_attempt}),
+    "get_user_exam_history": (f"{EXAM}.get_user_exam_history", lambda ctx: {}),
+    "get_exam_attempt_time_by_month": (f"{EXAM}.get_exam_attempt_time_by_month", lambda ctx: {}),
+    "get_user_attempts_for_all_tests": (f"{TEST}.get_user_attempts_for_all_tests", lambda ctx: {}),
+    "get_study_rollup": ("elearning.elearning.doctype.daily_study_rollup.daily_study_rollup.get_study_rollup", lambda ctx: {}),
+    "get_study_streak": ("elearning.elearning.doctype.daily_study_rollup.daily_study_rollup.get_study_streak", lambda ctx: {}),
+    "get_study_time_by_month": ("elearning.elearning.utils.study_analytics.get_study_time_by_month", lambda ctx: {}),
+}
+
+
+def run_scenario(ctx, name, iterations=20, warmup=2, cold=False):
+    method, prepare = SCENARIOS[name]
+    endpoint = frappe.get_attr(method)
+    timings, queries, rows_returned, rows_read = [], [], [], []
+    for iteration in range(warmup + iterations):
+        kwargs = prepare(ctx)
+        frappe.db.commit()
+        if cold:
+            frappe.clear_cache()
+        with QueryCounter() as counter:
+            started = time.perf_counter()
+            endpoint(**kwargs)
+            elapsed = (time.perf_counter() - started) * 1000
+        frappe.db.commit()
+        if iteration >= warmup:
+            timings.append(elapsed)
+            queries.append(counter.queries)
+            rows_returned.append(counter.rows_returned)
+            rows_read.append(counter.rows_read)
+
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 0.5), 2),
+        "p95_ms": round(percentile(timings, 0.95), 2),
+        "queries": max(queries),
+        "rows_returned": max(rows_returned),
+        "rows_read": max(rows_read),
+    }
+
+
+def load_budgets(path=BUDGETS_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def check_budgets(results, budgets):
+    """
+    (failures, warnings): "scenario: metric value > budget" for every exceeded
+    budget, and a warning for every query/rows-read budget not recorded yet.
+    Null latency budgets aren't enforced.
+    """
+    failures, warnings = [], []
+    for name, result in results.items():
+        for metric in BUDGET_METRICS:
+            budget = (budgets.get(name) or {}).get(metric)
+            if budget is None:
+                if metric in REQUIRED_METRICS:
+                    warnings.append(f"{name}: no {metric} budget recorded (run with --update-budgets)")
+            elif result[metric] > budget:
+                failures.append(f"{name}: {metric} {result[metric]} > {budget}")
+    return failures, warnings
+
+
+def budgets_from_results(results, budgets, with_latency=False):
+    """Budgets from measured results; latency is only written with `with_latency`, otherwise kept"""
+    updated = dict(budgets)
+    for name, result in results.items():
+        scenario = dict(updated.get(name) or dict.fromkeys(BUDGET_METRICS))
+        scenario["queries"] = result["queries"]
+        scenario["rows_read"] = math.ceil(result["rows_read"] * BUDGET_HEADROOM)
+        if with_latency:
+            for metric in ("p50_ms", "p95_ms"):
+                scenario[metric] = round(result[metric] * BUDGET_HEADROOM, 1)
+        updated[name] = scenario
+    return updated
+
+
+def run_benchmarks(only=None, iterations=20, warmup=2, cold=False, user=None, log=print):
+    """Run the scenarios as a synthetic student; returns {scenario: metrics}"""
+    unknown = set(only or []) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    ctx = BenchmarkContext(user)
+    frappe.set_user(ctx.user)
+    results = {}
+    for name in only or SCENARIOS:
+        results[name] = run_scenario(ctx, name, iterations, warmup, cold)
+        result = results[name]
+        log(f"{name:40} p50 {result['p50_ms']:>9.1f} ms  p95 {result['p95_ms']:>9.1f} ms  "
+            f"queries {result['queries']:>5}  rows read {result['rows_read']:>8}  returned {result['rows_returned']:>7}")
+    return results
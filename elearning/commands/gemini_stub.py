@@ -0,0 +1,265 @@
+# elearning/commands/gemini_stub.py
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+# Offline stand-in for the subset of the Gemini REST API the app uses:
+#   POST   /v1beta/models/{model}:generateContent
+#   POST   /v1beta/models/{model}:streamGenerateContent?alt=sse
+#   POST   /v1beta/cachedContents, PATCH/DELETE /v1beta/cachedContents/{id}
+# Responses are synthesized from the request's responseSchema, after a
+# sampled latency and with an optional error rate. With `record_dir` calls
+# are forwarded upstream and saved; with `replay_dir` saved transcripts are
+# served instead. cachedContents always stay local: when recording/replaying,
+# a request's cachedContent is inlined (systemInstruction + contents) before
+# it is forwarded and keyed, so transcripts don't depend on cache names.
+# Standard library only, so it runs without a site.
+API_PREFIX = "/v1beta"
+DEFAULT_STREAM_CHUNK_SIZE = 40
+STUB_TEXT = "Phản hồi mẫu từ Gemini stub."
+
+
+def parse_latency(spec):
+    """
+    Latency distribution in ms: "fixed:200", "uniform:100-800",
+    "normal:400,100" (mean,sd) or "lognormal:400,0.5" (median,sigma).
+    Returns a function rng -> seconds.
+    """
+    kind, _sep, args = (spec or "fixed:0").partition(":")
+    if kind == "fixed":
+        value = float(args or 0)
+        return lambda rng: value / 1000
+    if kind == "uniform":
+        low, high = (float(v) for v in args.split("-"))
+        return lambda rng: rng.uniform(low, high) / 1000
+    first, second = (float(v) for v in args.split(","))
+    if kind == "normal":
+        return lambda rng: max(rng.gauss(first, second), 0) / 1000
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(0, second) * first / 1000
+    raise ValueError(f"Unknown latency distribution {spec!r}")
+
+
+def sample_from_schema(schema, key=None):
+    """A schema-valid value for a Gemini responseSchema (STRING/NUMBER/INTEGER/BOOLEAN/ARRAY/OBJECT)"""
+    expected = (schema or {}).get("type", "STRING").upper()
+    if expected == "OBJECT":
+        return {name: sample_from_schema(sub_schema, name) for name, sub_schema in schema.get("properties", {}).items()}
+    if expected == "ARRAY":
+        return [sample_from_schema(schema.get("items", {}), key)]
+    if expected in ("NUMBER", "INTEGER"):
+        return 1
+    if expected == "BOOLEAN":
+        return True
+    if schema.get("enum"):
+        return schema["enum"][0]
+    return f"{STUB_TEXT} ({key})" if key else STUB_TEXT
+
+
+def transcript_key(method, path, query, body):
+    """Stable id of a request; the API key is never part of it"""
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(query) if k != "key"))
+    return hashlib.sha256(f"{method} {path}?{query}\n".encode() + (body or b"")).hexdigest()[:32]
+
+
+class GeminiStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency="fixed:0", error_rate=0.0, error_status=503, seed=None,
+                 stream_chunk_size=DEFAULT_STREAM_CHUNK_SIZE, record_dir=None, upstream=None, replay_dir=None):
+        super().__init__(address, GeminiStubHandler)
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stream_chunk_size = stream_chunk_size
+        self.record_dir = record_dir
+        self.upstream = (upstream or "https://generativelanguage.googleapis.com").rstrip("/")
+        self.replay_dir = replay_dir
+        self.cached_contents = {}
+        self.cached_content_ids = itertools.count(1)
+        self.stats = {"requests": 0, "errors": 0, "replayed": 0, "recorded": 0}
+        for directory in (record_dir, replay_dir):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def draw(self):
+        """(latency seconds, fail?) drawn from the seeded generator, so runs are reproducible"""
+        with self.rng_lock:
+            return self.sample_latency(self.rng), self.rng.random() < self.error_rate
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if os.environ.get("GEMINI_STUB_VERBOSE"):
+            super().log_message(format, *args)
+
+    def do_POST(self):
+        self.handle_call("POST")
+
+    def do_PATCH(self):
+        self.handle_call("PATCH")
+
+    def do_DELETE(self):
+        self.handle_call("DELETE")
+
+    def handle_call(self, method):
+        url = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self.server.stats["requests"] += 1
+
+        if url.path.startswith(f"{API_PREFIX}/cachedContents"):
+            # Not worth recording: names and expiry differ on every run (see inline_cached_content)
+            return self.handle_cached_contents(method, url.path, body)
+
+        if self.server.replay_dir or self.server.record_dir:
+            body = self.inline_cached_content(body)
+        key = transcript_key(method, url.path, url.query, body)
+        if self.server.replay_dir:
+            return self.replay(key)
+        if self.server.record_dir:
+            return self.record(key, method, url, body)
+
+        latency, fail = self.server.draw()
+        time.sleep(latency)
+        if fail:
+            self.server.stats["errors"] += 1
+            return self.send_json(self.server.error_status, {
+                "error": {"code": self.server.error_status, "message": "Injected error (gemini-stub)", "status": "UNAVAILABLE"}
+            })
+
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return self.send_json(400, {"error": {"code": 400, "message": "Invalid JSON payload", "status": "INVALID_ARGUMENT"}})
+        text = self.synthesize_text(payload)
+        if url.path.endswith(":streamGenerateContent"):
+            return self.send_stream(text)
+        if url.path.endswith(":generateContent"):
+            return self.send_json(200, self.candidate(text, final=True))
+        return self.send_json(404, {"error": {"code": 404, "message": f"Unknown path {url.path}", "status": "NOT_FOUND"}})
+
+    def synthesize_text(self, payload):
+        generation_config = payload.get("generationConfig") or {}
+        if generation_config.get("responseSchema"):
+            return json.dumps(sample_from_schema(generation_config["responseSchema"]), ensure_ascii=False)
+        return STUB_TEXT
+
+    def candidate(self, text, final):
+        chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+        if final:
+            chunk["candidates"][0]["finishReason"] = "STOP"
+            chunk["usageMetadata"] = {"promptTokenCount": 0, "candidatesTokenCount": len(text) // 4}
+        return chunk
+
+    def inline_cached_content(self, body):
+        """The request without its cachedContent reference: the cached parts are put back inline"""
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            return body
+        name = payload.pop("cachedContent", None) if isinstance(payload, dict) else None
+        if not name:
+            return body
+        cached = self.server.cached_contents.get(name) or {}
+        for field in ("systemInstruction", "tools", "toolConfig"):
+            if cached.get(field) and field not in payload:
+                payload[field] = cached[field]
+        payload["contents"] = (cached.get("contents") or []) + (payload.get("contents") or [])
+        return json.dumps(payload, ensure_ascii=False, sort_keys=True).encode()
+
+    def handle_cached_contents(self, method, path, body):
+        contents = self.server.cached_contents
+        if method == "POST":
+            name = f"cachedContents/stub-{next(self.server.cached_content_ids)}"
+            contents[name] = json.loads(body or b"{}")
+            return self.send_json(200, dict(contents[name], name=name))
+        name = path[len(API_PREFIX) + 1:]
+        if name not in contents:
+            return self.send_json(404, {"error": {"code": 404, "message": f"{name} not found", "status": "NOT_FOUND"}})
+        if method == "DELETE":
+            del contents[name]
+            return self.send_json(200, {})
+        contents[name].update(json.loads(body or b"{}"))
+        return self.send_json(200, dict(contents[name], name=name))
+
+    def send_json(self, status, data):
+        self.send_raw(status, "application/json; charset=UTF-8", json.dumps(data, ensure_ascii=False).encode())
+
+    def send_raw(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, text):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        size = self.server.stream_chunk_size
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or [""]
+        for index, piece in enumerate(pieces):
+            frame = self.candidate(piece, final=index == len(pieces) - 1)
+            self.wfile.write(f"data: {json.dumps(frame, ensure_ascii=False)}\r\n\r\n".encode())
+            self.wfile.flush()
+        self.close_connection = True
+
+    def transcript_path(self, directory, key):
+        return os.path.join(directory, f"{key}.json")
+
+    def record(self, key, method, url, body):
+        request = urllib.request.Request(
+            f"{self.server.upstream}{url.path}?{url.query}", data=body or None, method=method,
+            headers={"Content-Type": "application/json"}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=300) as response:
+                status, content_type, response_body = response.status, response.headers.get("Content-Type"), response.read()
+        except urllib.error.HTTPError as e:
+            status, content_type, response_body = e.code, e.headers.get("Content-Type"), e.read()
+
+        with open(self.transcript_path(self.server.record_dir, key), "w", encoding="utf-8") as f:
+            json.dump({
+                "request": {"method": method, "path": url.path, "body": body.decode("utf-8", "replace")},
+                "status": status,
+                "content_type": content_type,
+                "body": response_body.decode("utf-8", "replace"),
+            }, f, ensure_ascii=False, indent=1)
+        self.server.stats["recorded"] += 1
+        self.send_raw(status, content_type or "application/json", response_body)
+
+    def replay(self, key):
+        path = self.transcript_path(self.server.replay_dir, key)
+        if not os.path.exists(path):
+            return self.send_json(404, {"error": {"code": 404, "message": f"No recorded transcript {key}", "status": "NOT_FOUND"}})
+        with open(path, encoding="utf-8") as f:
+            transcript = json.load(f)
+        latency, _fail = self.server.draw()
+        time.sleep(latency)
+        self.server.stats["replayed"] += 1
+        self.send_raw(transcript["status"], transcript["content_type"] or "application/json", transcript["body"].encode())
+
+
+def serve(host="127.0.0.1", port=8765, **options):
+    server = GeminiStubServer((host, port), **options)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server.stats
@@ -0,0 +1,398 @@
+# elearning/commands/synthetic_data.py
+import json
+import math
+import random
+import time
+from datetime import timedelta
+
+import frappe
+from frappe.utils import now_datetime
+
+# Production-shaped volume for performance work, written with
+# frappe.db.bulk_insert (no document hooks/validation, 10k rows per INSERT).
+# Every generated name starts with SYNTHETIC_PREFIX (users use
+# SYNTHETIC_EMAIL_DOMAIN), so `purge_dataset` removes exactly what was added.
+# The same seed and options always produce the same dataset.
+SYNTHETIC_PREFIX = "SYN-"
+SYNTHETIC_EMAIL_DOMAIN = "synthetic.elearning.test"
+SYNTHETIC_TOPIC_PREFIX = "[SYN] "
+CHUNK_SIZE = 10_000
+HISTORY_DAYS = 180
+
+FLASHCARD_TYPES = (
+    "Concept/Theorem/Formula", "Fill in the Blank", "Ordering Steps",
+    "What's the Next Step?", "Short Answer/Open-ended", "Identify the Error",
+)
+SELF_ASSESSMENTS = ("Chưa hiểu", "Mơ hồ", "Khá ổn", "Rất rõ")
+SRS_STATUSES = ("new", "learning", "review", "lapsed")
+COGNITIVE_LEVELS = ("NB", "TH", "VD", "VDC")
+
+DEFAULT_OPTIONS = {
+    "users": 5000,
+    "topics": 2000,
+    "cards_per_topic": "uniform:10-50",
+    "steps_per_ordering_card": "uniform:3-6",
+    "srs_cards_per_user": "geometric:200",
+    "exam_attempts_per_user": "geometric:8",
+    "cards_per_exam_attempt": "uniform:5-20",
+    "questions": 20000,
+    "essay_fraction": 0.15,
+    "self_write_fraction": 0.25,
+    "tests": 500,
+    "questions_per_test": "uniform:10-40",
+    "test_attempts_per_user": "geometric:5",
+}
+
+
+def parse_count(spec):
+    """
+    Count distribution: "25" / "fixed:25", "uniform:10-50" or "geometric:MEAN"
+    (long tail, most users do little and a few do a lot). Returns rng -> int.
+    """
+    spec = str(spec)
+    kind, _sep, args = spec.partition(":") if ":" in spec else ("fixed", "", spec)
+    if kind == "fixed":
+        value = int(args)
+        return lambda rng: value
+    if kind == "uniform":
+        low, high = (int(v) for v in args.split("-"))
+        return lambda rng: rng.randint(low, high)
+    if kind == "geometric":
+        # Failures before the first success with p = 1 / (mean + 1) average `mean`
+        p = 1 / (max(float(args), 0) + 1)
+        return lambda rng: 0 if p >= 1 else int(math.log(1 - rng.random()) / math.log(1 - p))
+    raise ValueError(f"Unknown count distribution {spec!r}")
+
+
+class DatasetWriter:
+    """Buffers rows per doctype and flushes them with bulk_insert"""
+
+    def __init__(self, rng, log):
+        self.rng = rng
+        self.log = log
+        self.buffers = {}
+        self.counts = {}
+        self.now = now_datetime()
+
+    def timestamp(self, days_ago_max=HISTORY_DAYS):
+        return self.now - timedelta(seconds=self.rng.randint(0, days_ago_max * 86400))
+
+    def add(self, doctype, row, created=None):
+        created = created or self.now
+        row = dict(row, creation=created, modified=created, owner="Administrator", modified_by="Administrator", docstatus=0)
+        row.setdefault("idx", 0)
+        buffer = self.buffers.setdefault(doctype, [])
+        buffer.append(row)
+        if len(buffer) >= CHUNK_SIZE:
+            self.flush(doctype)
+
+    def child(self, doctype, parent, parenttype, parentfield, idx, row, created=None):
+        self.add(doctype, dict(row, parent=parent, parenttype=parenttype, parentfield=parentfield, idx=idx), created)
+
+    def flush(self, doctype=None):
+        for name in [doctype] if doctype else list(self.buffers):
+            rows = self.buffers.pop(name, [])
+            if not rows:
+                continue
+            # Rows of one doctype may set different optional fields
+            fields = list(dict.fromkeys(field for row in rows for field in row))
+            frappe.db.bulk_insert(name, fields, [[row.get(field) for field in fields] for row in rows], chunk_size=CHUNK_SIZE)
+            frappe.db.commit()
+            self.counts[name] = self.counts.get(name, 0) + len(rows)
+        if not doctype:
+            self.log(", ".join(f"{name}: {count}" for name, count in sorted(self.counts.items())))
+
+
+def _name(kind, number):
+    return f"{SYNTHETIC_PREFIX}{kind}-{number:08d}"
+
+
+def generate_users(writer, options):
+    users = []
+    for i in range(options["users"]):
+        email = f"student{i:06d}@{SYNTHETIC_EMAIL_DOMAIN}"
+        created = writer.timestamp()
+        writer.add("User", {
+            "name": email, "email": email, "first_name": f"Học sinh {i}", "full_name": f"Học sinh {i}",
+            "enabled": 1, "user_type": "Website User", "send_welcome_email": 0,
+        }, created)
+        writer.child("Has Role", email, "User", "roles", 1, {"name": _name("ROLE", i), "role": "Student"}, created)
+        users.append(email)
+    writer.flush()
+    return users
+
+
+def generate_topics_and_flashcards(writer, options):
+    rng = writer.rng
+    cards_per_topic = parse_count(options["cards_per_topic"])
+    steps_per_card = parse_count(options["steps_per_ordering_card"])
+    first_topic = (frappe.db.sql("select max(name) from `tabTopics`")[0][0] or 0) + 1
+
+    cards_by_topic = {}
+    card_number = step_number = 0
+    for offset in range(options["topics"]):
+        topic = first_topic + offset
+        writer.add("Topics", {
+            "name": topic, "topic_name": f"{SYNTHETIC_TOPIC_PREFIX}Chủ đề {offset}", "grade_level": "9",
+            "is_active": 1, "description": f"Chủ đề tổng hợp số {offset}",
+        })
+        cards = cards_by_topic.setdefault(topic, [])
+        for _card in range(cards_per_topic(rng)):
+            card_number += 1
+            name = _name("FLCD", card_number)
+            flashcard_type = rng.choice(FLASHCARD_TYPES)
+            writer.add("Flashcard", {
+                "name": name, "topic": topic, "flashcard_type": flashcard_type,
+                "question": f"<p>Câu hỏi {card_number}: tính \\( {card_number} + x \\) khi x = 2</p>",
+                "answer": f"<p>{card_number + 2}</p>",
+                "explanation": "<p>Thay x = 2 vào biểu thức.</p>",
+            })
+            if flashcard_type == "Ordering Steps":
+                for order in range(1, steps_per_card(rng) + 1):
+                    step_number += 1
+                    writer.child("Ordering Step Item", name, "Flashcard", "ordering_steps_items", order, {
+                        "name": _name("STEP", step_number), "step_content": f"<p>Bước {order}</p>", "correct_order": order,
+                    })
+            cards.append(name)
+    writer.flush()
+    return cards_by_topic
+
+
+def generate_questions_and_tests(writer, options):
+    rng = writer.rng
+    questions_per_test = parse_count(options["questions_per_test"])
+    questions = []
+    option_number = rubric_number = 0
+    for i in range(options["questions"]):
+        name = _name("Q", i)
+        roll = rng.random()
+        if roll < options["essay_fraction"]:
+            question_type = "Essay"
+        elif roll < options["essay_fraction"] + options["self_write_fraction"]:
+            question_type = "Self Write"
+        else:
+            question_type = "Multiple Choice"
+
+        row = {
+            "name": name, "content": f"Câu {i}: giải phương trình $x + {i} = {i + 3}$",
+            "question_type": question_type, "cognitive_level": rng.choice(COGNITIVE_LEVELS), "marks": 1,
+        }
+        rubric_ids = []
+        if question_type == "Self Write":
+            row.update({"answer_key": "3", "compiled_answer_key": json.dumps({"texts": ["3"], "numbers": ["3"], "tolerance": 0.0})})
+        writer.add("Question", row)
+
+        if question_type == "Multiple Choice":
+            correct = rng.randrange(4)
+            for idx in range(4):
+                option_number += 1
+                writer.child("Question Option Item", name, "Question", "options", idx + 1, {
+                    "name": _name("OPT", option_number), "option_text": f"x = {idx + 2}", "is_correct": int(idx == correct),
+                })
+        elif question_type == "Essay":
+            for step in range(1, 4):
+                rubric_number += 1
+                rubric_ids.append(_name("RUB", rubric_number))
+                writer.child("Rubric Item", name, "Question", "rubric_items", step, {
+                    "name": rubric_ids[-1], "step_order": step, "description": f"Bước {step} lập luận đúng", "max_score": 1,
+                })
+        questions.append({"name": name, "type": question_type, "rubric": rubric_ids})
+
+    tests = []
+    item_number = 0
+    for i in range(options["tests"]):
+        name = _name("TEST", i)
+        picked = rng.sample(questions, min(questions_per_test(rng), len(questions)))
+        items = []
+        for idx, question in enumerate(picked, start=1):
+            item_number += 1
+            items.append(dict(question, item=_name("TQI", item_number)))
+            writer.child("Test Question Item", name, "Test", "questions", idx, {
+                "name": items[-1]["item"], "question": question["name"], "points": 1,
+            })
+        writer.add("Test", {
+            "name": name, "title": f"{SYNTHETIC_TOPIC_PREFIX}Đề kiểm tra {i}", "grade_level": "9", "test_type": "Exam",
+            "time_limit_minutes": 45, "passing_score": 50, "question_count": len(items), "is_active": 1,
+        })
+        tests.append({"name": name, "items": items})
+    writer.flush()
+    return tests
+
+
+def generate_srs_progress(writer, options, users, cards_by_topic):
+    rng = writer.rng
+    srs_cards_per_user = parse_count(options["srs_cards_per_user"])
+    all_cards = [card for cards in cards_by_topic.values() for card in cards]
+    number = 0
+    for user in users:
+        for card in rng.sample(all_cards, min(srs_cards_per_user(rng), len(all_cards))):
+            number += 1
+            status = rng.choice(SRS_STATUSES)
+            last_review = writer.timestamp()
+            interval = 0 if status == "new" else round(rng.uniform(0.5, 60), 2)
+            writer.add("User SRS Progress", {
+                "name": _name("USRS", number), "user": user, "flashcard": card, "status": status,
+                "interval_days": interval, "ease_factor": round(rng.uniform(1.3, 2.8), 2),
+                "repetitions": rng.randint(0, 12), "learning_step": rng.randint(0, 2),
+                "last_review_timestamp": None if status == "new" else last_review,
+                "next_review_timestamp": last_review + timedelta(days=interval),
+            }, last_review)
+    writer.flush()
+
+
+def generate_exam_attempts(writer, options, users, cards_by_topic):
+    rng = writer.rng
+    attempts_per_user = parse_count(options["exam_attempts_per_user"])
+    cards_per_attempt = parse_count(options["cards_per_exam_attempt"])
+    topics = [topic for topic, cards in cards_by_topic.items() if cards]
+    attempt_number = detail_number = 0
+    for user in users:
+        for _attempt in range(attempts_per_user(rng)):
+            attempt_number += 1
+            name = _name("UEA", attempt_number)
+            topic = rng.choice(topics)
+            started = writer.timestamp()
+            cards = rng.sample(cards_by_topic[topic], min(cards_per_attempt(rng), len(cards_by_topic[topic])))
+            counts = {"answered": 0, "correct": 0, "skipped": 0, "assessed": 0}
+            for idx, card in enumerate(cards, start=1):
+                detail_number += 1
+                skipped = rng.random() < 0.1
+                correct = not skipped and rng.random() < 0.6
+                assessed = not skipped and rng.random() < 0.7
+                counts["skipped"] += skipped
+                counts["answered"] += not skipped
+                counts["correct"] += correct
+                counts["assessed"] += assessed
+                writer.child("User Exam Attempt Detail", name, "User Exam Attempt", "attempt_details", idx, {
+                    "name": _name("UEAD", detail_number), "flashcard": card, "is_skipped": int(skipped),
+                    "is_correct": int(correct), "is_assessed": int(assessed),
+                    "user_answer": None if skipped else f"Đáp án của học sinh cho {card}",
+                    "ai_feedback_what_was_correct": None if skipped else "Phản hồi tổng hợp.",
+                    "user_self_assessment": rng.choice(SELF_ASSESSMENTS) if assessed else None,
+                }, started)
+            spent = rng.randint(60, 1800)
+            writer.add("User Exam Attempt", {
+                "name": name, "user": user, "topic": topic, "start_time": started,
+                "completion_timestamp": started + timedelta(seconds=spent), "time_spent_seconds": spent,
+                "total_questions": len(cards), "answered_count": counts["answered"], "correct_count": counts["correct"],
+                "skipped_count": counts["skipped"], "assessed_count": counts["assessed"],
+            }, started)
+    writer.flush()
+
+
+def generate_test_attempts(writer, options, users, tests):
+    rng = writer.rng
+    attempts_per_user = parse_count(options["test_attempts_per_user"])
+    attempt_number = answer_number = 0
+    for user in users:
+        for _attempt in range(attempts_per_user(rng)):
+            attempt_number += 1
+            name = _name("TA", attempt_number)
+            test = rng.choice(tests)
+            started = writer.timestamp()
+            score = 0
+            needs_review = has_essay = False
+            for idx, item in enumerate(test["items"], start=1):
+                answer_number += 1
+                correct = rng.random() < 0.6
+                row = {
+                    "name": _name("AAI", answer_number), "question": item["name"], "test_question_item": item["item"],
+                    "user_answer": "3" if correct else "5", "is_correct": int(correct), "points_awarded": int(correct),
+                    "submitted_at": started, "time_spent_seconds": rng.randint(10, 300),
+                }
+                if item["type"] == "Essay":
+                    has_essay = True
+                    ai_score = rng.randint(0, len(item["rubric"]))
+                    row.update({"ai_score": ai_score, "points_awarded": ai_score, "ai_feedback": "Nhận xét tổng hợp."})
+                    needs_review = needs_review or rng.random() < 0.05
+                score += row["points_awarded"]
+                writer.child("Attempt Answer Item", name, "Test Attempt", "answers", idx, row, started)
+            status = "To be graded" if needs_review else "Graded" if has_essay else "Completed"
+            writer.add("Test Attempt", {
+                "name": name, "user": user, "test": test["name"], "start_time": started,
+                "end_time": started + timedelta(minutes=rng.randint(5, 45)), "status": status, "final_score": score,
+                "is_passed": int(bool(test["items"]) and score * 100 / len(test["items"]) >= 50),
+                "summary_status": "Ready" if status != "To be graded" else None,
+            }, started)
+    writer.flush()
+
+
+def generate_dataset(seed=42, log=print, **overrides):
+    """Generate the whole dataset; returns {doctype: rows inserted}"""
+    options = dict(DEFAULT_OPTIONS, **{key: value for key, value in overrides.items() if value is not None})
+    writer = DatasetWriter(random.Random(seed), log)
+    started = time.monotonic()
+
+    log("Users...")
+    users = generate_users(writer, options)
+    log("Topics and flashcards...")
+    cards_by_topic = generate_topics_and_flashcards(writer, options)
+    log("Questions and tests...")
+    tests = generate_questions_and_tests(writer, options)
+    log("SRS progress...")
+    generate_srs_progress(writer, options, users, cards_by_topic)
+    if cards_by_topic:
+        log("Exam attempts...")
+        generate_exam_attempts(writer, options, users, cards_by_topic)
+    if tests:
+        log("Test attempts...")
+        generate_test_attempts(writer, options, users, tests)
+
+    # Cached catalogs, answer keys and test payloads don't know about the new rows
+    frappe.clear_cache()
+    log(f"Done in {time.monotonic() - started:.1f}s")
+    return writer.counts
+
+
+# Child tables first, then their parents
+PURGE_TABLES = (
+    ("Has Role", "parent", f"%@{SYNTHETIC_EMAIL_DOMAIN}"),
+    ("User", "name", f"%@{SYNTHETIC_EMAIL_DOMAIN}"),
+    ("Ordering Step Item", "parent", f"{SYNTHETIC_PREFIX}%"),
+    ("Flashcard", "name", f"{SYNTHETIC_PREFIX}%"),
+    ("Topics", "topic_name", f"{SYNTHETIC_TOPIC_PREFIX}%"),
+    ("Question Option Item", "parent", f"{SYNTHETIC_PREFIX}%"),
+    ("Rubric Item", "parent", f"{SYNTHETIC_PREFIX}%"),
+    ("Question", "name", f"{SYNTHETIC_PREFIX}%"),
+    ("Test Question Item", "parent", f"{SYNTHETIC_PREFIX}%"),
+    ("Test", "name", f"{SYNTHETIC_PREFIX}%"),
+    ("User SRS Progress", "name", f"{SYNTHETIC_PREFIX}%"),
+    ("User Exam Attempt Detail", "parent", f"{SYNTHETIC_PREFIX}%"),
+    ("User Exam Attempt", "name", f"{SYNTHETIC_PREFIX}%"),
+    ("Attempt Answer Item", "parent", f"{SYNTHETIC_PREFIX}%"),
+    ("Test Attempt", "name", f"{SYNTHETIC_PREFIX}%"),
+)
+
+
+# Rows the benchmarks (or synthetic students using the app) create with
+# generated names: matched by the owning synthetic user instead of the prefix.
+# (doctype, join to a `tabTest Attempt`/... row `p` owned by the user), children first
+PURGE_USER_CHILD_TABLES = (
+    ("Rubric Score Item", "`tabAttempt Answer Item` c on c.name = t.attempt_answer_item_link join `tabTest Attempt` p on p.name = c.parent"),
+    ("Answer Image", "`tabAttempt Answer Item` c on c.name = t.parent join `tabTest Attempt` p on p.name = c.parent"),
+    ("Attempt Answer Item", "`tabTest Attempt` p on p.name = t.parent and t.parenttype = 'Test Attempt'"),
+    ("User Exam Attempt Detail", "`tabUser Exam Attempt` p on p.name = t.parent and t.parenttype = 'User Exam Attempt'"),
+)
+PURGE_USER_TABLES = (
+    "Test Attempt", "User Exam Attempt", "Daily Study Rollup", "Flashcard Session",
+    "User SRS Progress", "User Flashcard Setting",
+)
+
+
+def purge_dataset(log=print):
+    """Delete every synthetic row (real data never uses the prefixes or the email domain)"""
+    user_pattern = f"%@{SYNTHETIC_EMAIL_DOMAIN}"
+    for doctype, join in PURGE_USER_CHILD_TABLES:
+        frappe.db.sql(f"delete t from `tab{doctype}` t join {join} where p.user like %s", user_pattern)
+        frappe.db.commit()
+        log(f"Purged {doctype} of synthetic users")
+    for doctype in PURGE_USER_TABLES:
+        frappe.db.sql(f"delete from `tab{doctype}` where user like %s", user_pattern)
+        frappe.db.commit()
+        log(f"Purged {doctype} of synthetic users")
+
+    for doctype, column, pattern in PURGE_TABLES:
+        frappe.db.sql(f"delete from `tab{doctype}` where `{column}` like %s", pattern)
+        frappe.db.commit()
+        log(f"Purged {doctype}")
+    frappe.clear_cache()
@@ -0,0 +1,387 @@
+# Copyright (c) 2026, Minh Quy and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+from frappe.utils import now_datetime, getdate, add_days, add_to_date, get_datetime, cint
+from datetime import date as date_type
+
+WATERMARK_KEY = "daily_study_rollup_watermark"
+DEFAULT_WATERMARK = "2000-01-01 00:00:00"
+# Users whose refresh failed, {user: {family: [dates] | None}}, retried on the next run
+FAILED_USERS_KEY = "daily_study_rollup_failed_users"
+# Rows are stamped `modified` before their transaction commits; re-reading this far
+# behind the watermark picks up the ones that committed after the previous run
+DEFAULT_WATERMARK_LAG_SECONDS = 5 * 60
+
+# Các mức tự đánh giá được tính là "trả lời đúng" trong rollup
+CORRECT_SELF_ASSESSMENTS = ("Khá ổn", "Rất rõ")
+
+FAMILY_ACTIVITY_TYPES = {
+	"flashcard": ("Flashcard Basic", "Flashcard Exam", "Flashcard SRS"),
+	"exam": ("Exam Attempt",),
+	"srs": ("SRS Review",),
+}
+
+
+class DailyStudyRollup(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_unique("Daily Study Rollup", ["user", "date", "activity_type"], constraint_name="unique_user_date_activity")
+
+
+def get_current_user():
+	user = frappe.session.user
+	if user == "Guest":
+		frappe.throw(_("Authentication required."), frappe.AuthenticationError)
+	return user
+
+
+def _day_range(from_date, to_date):
+	"""Half-open datetime range covering [from_date, to_date]"""
+	return f"{getdate(from_date)} 00:00:00", f"{add_days(getdate(to_date), 1)} 00:00:00"
+
+
+def _aggregate_flashcard(user, from_date, to_date):
+	start, end = _day_range(from_date, to_date)
+	rows = frappe.db.sql(
+		"""
+		SELECT DATE(start_time) AS day, mode, SUM(time_spent_seconds) AS seconds
+		FROM `tabFlashcard Session`
+		WHERE user = %s AND start_time >= %s AND start_time < %s
+		GROUP BY DATE(start_time), mode
+		""",
+		(user, start, end),
+		as_dict=True,
+	)
+	return {(row.day, f"Flashcard {row.mode}"): (row.seconds or 0, 0, 0) for row in rows if row.mode}
+
+
+def _aggregate_exam(user, from_date, to_date):
+	start, end = _day_range(from_date, to_date)
+	rows = frappe.db.sql(
+		"""
+		SELECT DATE(uea.creation) AS day,
+			SUM(uea.time_spent_seconds) AS seconds,
+			SUM(COALESCE(details.answered, 0)) AS cards,
+			SUM(COALESCE(details.correct, 0)) AS correct
+		FROM `tabUser Exam Attempt` uea
+		LEFT JOIN (
+			SELECT parent,
+				SUM(IF(user_answer IS NOT NULL AND user_answer != '', 1, 0)) AS answered,
+				SUM(IF(user_self_assessment IN %s, 1, 0)) AS correct
+			FROM `tabUser Exam Attempt Detail`
+			WHERE parenttype = 'User Exam Attempt'
+			GROUP BY parent
+		) details ON details.parent = uea.name
+		WHERE uea.user = %s AND uea.creation >= %s AND uea.creation < %s
+		AND uea.completion_timestamp IS NOT NULL
+		GROUP BY DATE(uea.creation)
+		""",
+		(CORRECT_SELF_ASSESSMENTS, user, start, end),
+		as_dict=True,
+	)
+	return {(row.day, "Exam Attempt"): (row.seconds or 0, row.cards or 0, row.correct or 0) for row in rows}
+
+
+def _aggregate_srs(user, from_date, to_date):
+	start, end = _day_range(from_date, to_date)
+	rows = frappe.db.sql(
+		"""
+		SELECT DATE(last_review_timestamp) AS day,
+			SUM(COALESCE(total_time_spent_seconds, 0)) AS seconds,
+			COUNT(*) AS cards,
+			SUM(IF(status = 'review', 1, 0)) AS correct
+		FROM `tabUser SRS Progress`
+		WHERE user = %s AND last_review_timestamp >= %s AND last_review_timestamp < %s
+		GROUP BY DATE(last_review_timestamp)
+		""",
+		(user, start, end),
+		as_dict=True,
+	)
+	return {(row.day, "SRS Review"): (row.seconds or 0, row.cards or 0, row.correct or 0) for row in rows}
+
+
+AGGREGATORS = {
+	"flashcard": _aggregate_flashcard,
+	"exam": _aggregate_exam,
+	"srs": _aggregate_srs,
+}
+
+
+def rebuild_user_rollups(user, family, from_date, to_date):
+	"""
+	Recompute the rollup rows of one user/activity family for [from_date, to_date].
+	Rows are upserted on (user, date, activity_type); buckets that no longer have
+	source data in the range are removed.
+	"""
+	buckets = AGGREGATORS[family](user, from_date, to_date)
+	run_ts = now_datetime()
+
+	if buckets:
+		values = []
+		params = []
+		for (day, activity_type), (seconds, cards, correct) in buckets.items():
+			values.append("(%s, %s, %s, %s, %s, 0, 0, %s, %s, %s, %s, %s, %s)")
+			params.extend([
+				frappe.generate_hash(length=10), run_ts, run_ts, "Administrator", "Administrator",
+				user, day, activity_type, cint(seconds), cint(cards), cint(correct)
+			])
+		frappe.db.sql(
+			f"""
+			INSERT INTO `tabDaily Study Rollup`
+				(name, creation, modified, owner, modified_by, docstatus, idx,
+				user, date, activity_type, total_seconds, card_count, correct_count)
+			VALUES {", ".join(values)}
+			ON DUPLICATE KEY UPDATE
+				total_seconds = VALUES(total_seconds),
+				card_count = VALUES(card_count),
+				correct_count = VALUES(correct_count),
+				modified = VALUES(modified)
+			""",
+			params,
+		)
+
+	frappe.db.sql(
+		"""
+		DELETE FROM `tabDaily Study Rollup`
+		WHERE user = %s AND date >= %s AND date <= %s
+		AND activity_type IN %s AND modified < %s
+		""",
+		(user, getdate(from_date), getdate(to_date), FAMILY_ACTIVITY_TYPES[family], run_ts),
+	)
+
+
+def refresh_user_day(user, day, family):
+	"""Realtime update for a single day, used by the session/attempt end endpoints"""
+	if not frappe.conf.get("daily_study_rollup_realtime"):
+		return
+	# Runs inside the caller's transaction: a failure must only undo the rollup writes
+	frappe.db.savepoint("daily_study_rollup")
+	try:
+		rebuild_user_rollups(user, family, day, day)
+	except Exception as e:
+		frappe.db.rollback(save_point="daily_study_rollup")
+		# Job định kỳ sẽ bù lại nếu cập nhật tức thời thất bại
+		frappe.logger("daily_study_rollup").error(f"Realtime rollup update failed for {user} on {day}: {e}", exc_info=True)
+
+
+def _collect_changed_buckets(watermark, run_started):
+	"""Return {user: {family: set(dates)}} for source rows modified in (watermark, run_started]"""
+	changed = {}
+
+	def add(rows, family):
+		for row in rows:
+			changed.setdefault(row.user, {}).setdefault(family, set()).add(row.day)
+
+	add(frappe.db.sql(
+		"""
+		SELECT DISTINCT user, DATE(start_time) AS day
+		FROM `tabFlashcard Session`
+		WHERE modified > %s AND modified <= %s AND start_time IS NOT NULL
+		""",
+		(watermark, run_started), as_dict=True), "flashcard")
+
+	add(frappe.db.sql(
+		"""
+		SELECT DISTINCT user, DATE(creation) AS day
+		FROM `tabUser Exam Attempt`
+		WHERE modified > %s AND modified <= %s
+		UNION
+		SELECT DISTINCT uea.user, DATE(uea.creation) AS day
+		FROM `tabUser Exam Attempt Detail` detail
+		JOIN `tabUser Exam Attempt` uea ON uea.name = detail.parent
+		WHERE detail.modified > %s AND detail.modified <= %s
+		""",
+		(watermark, run_started, watermark, run_started), as_dict=True), "exam")
+
+	# Mỗi bản ghi SRS bị ghi đè ở mỗi lần ôn, ngày cũ của nó không còn biết được,
+	# nên với SRS ta dựng lại toàn bộ lịch sử của user (mỗi thẻ chỉ có một dòng).
+	srs_users = frappe.db.sql(
+		"""
+		SELECT DISTINCT user
+		FROM `tabUser SRS Progress`
+		WHERE modified > %s AND modified <= %s
+		""",
+		(watermark, run_started), as_dict=True)
+	for row in srs_users:
+		changed.setdefault(row.user, {})["srs"] = None
+
+	return changed
+
+
+def _srs_date_bounds(user):
+	bounds = frappe.db.sql(
+		"""
+		SELECT MIN(day) AS first_day, MAX(day) AS last_day FROM (
+			SELECT MIN(DATE(last_review_timestamp)) AS day FROM `tabUser SRS Progress` WHERE user = %(user)s
+			UNION ALL
+			SELECT MAX(DATE(last_review_timestamp)) FROM `tabUser SRS Progress` WHERE user = %(user)s
+			UNION ALL
+			SELECT MIN(date) FROM `tabDaily Study Rollup` WHERE user = %(user)s AND activity_type = 'SRS Review'
+			UNION ALL
+			SELECT MAX(date) FROM `tabDaily Study Rollup` WHERE user = %(user)s AND activity_type = 'SRS Review'
+		) bounds
+		""",
+		{"user": user}, as_dict=True)
+	if not bounds or not bounds[0].first_day:
+		return None, None
+	return bounds[0].first_day, bounds[0].last_day
+
+
+def _merge_changed(changed, failed):
+	"""Add the buckets of previously failed users (dates as strings from JSON) to `changed`"""
+	for user, families in failed.items():
+		for family, days in families.items():
+			if family == "srs" or days is None:
+				changed.setdefault(user, {})[family] = None
+			else:
+				existing = changed.setdefault(user, {}).setdefault(family, set())
+				existing.update(getdate(day) for day in days)
+
+
+def refresh_daily_study_rollups():
+	"""
+	Scheduled job: fold every source row modified since the stored watermark
+	(minus a lag margin) into the rollup table, then advance the watermark.
+	A user whose refresh fails is logged and kept for the next run.
+	"""
+	logger = frappe.logger("daily_study_rollup")
+	watermark = frappe.db.get_global(WATERMARK_KEY) or DEFAULT_WATERMARK
+	lag = cint(frappe.conf.get("daily_study_rollup_lag_seconds") or DEFAULT_WATERMARK_LAG_SECONDS)
+	run_started = now_datetime()
+
+	changed = _collect_changed_buckets(add_to_date(get_datetime(watermark), seconds=-lag), run_started)
+	_merge_changed(changed, json.loads(frappe.db.get_global(FAILED_USERS_KEY) or "{}"))
+
+	failed = {}
+	for user, families in changed.items():
+		try:
+			for family, days in families.items():
+				if family == "srs":
+					from_date, to_date = _srs_date_bounds(user)
+				else:
+					days = [d for d in days if d]
+					from_date, to_date = (min(days), max(days)) if days else (None, None)
+				if from_date:
+					rebuild_user_rollups(user, family, from_date, to_date)
+			frappe.db.commit()
+		except Exception as e:
+			frappe.db.rollback()
+			logger.error(f"Could not refresh study rollups for {user}, retrying next run: {e}", exc_info=True)
+			failed[user] = {
+				family: None if days is None else sorted(str(day) for day in days if day)
+				for family, days in families.items()
+			}
+
+	frappe.db.set_global(WATERMARK_KEY, str(run_started))
+	frappe.db.set_global(FAILED_USERS_KEY, json.dumps(failed))
+	frappe.db.commit()
+	logger.info(f"Daily study rollups refreshed for {len(changed) - len(failed)}/{len(changed)} users up to {run_started}")
+
+
+@frappe.whitelist()
+def get_study_rollup(period="month", year=None):
+	"""
+	Study totals per month or ISO week of a year, read from the rollup table.
+
+	Args:
+		period (str): "month" or "week"
+		year (int, optional): Defaults to the current year
+
+	Returns:
+		list: One entry per period with totals and per-activity seconds
+	"""
+	user = get_current_user()
+	year = cint(year) or getdate().year
+	if period not in ("month", "week"):
+		frappe.throw(_("Invalid period"))
+
+	rows = frappe.get_all(
+		"Daily Study Rollup",
+		filters={"user": user, "date": ["between", [f"{year}-01-01", f"{year}-12-31"]]},
+		fields=["date", "activity_type", "total_seconds", "card_count", "correct_count"],
+		order_by="date asc"
+	)
+
+	periods = {}
+	for row in rows:
+		day = getdate(row.date)
+		key = day.month if period == "month" else day.isocalendar()[1]
+		entry = periods.setdefault(key, {
+			"period": key,
+			"total_seconds": 0,
+			"card_count": 0,
+			"correct_count": 0,
+			"by_activity": {}
+		})
+		entry["total_seconds"] += row.total_seconds or 0
+		entry["card_count"] += row.card_count or 0
+		entry["correct_count"] += row.correct_count or 0
+		entry["by_activity"][row.activity_type] = entry["by_activity"].get(row.activity_type, 0) + (row.total_seconds or 0)
+
+	if period == "month":
+		result = []
+		for month in range(1, 13):
+			entry = periods.get(month) or {"period": month, "total_seconds": 0, "card_count": 0, "correct_count": 0, "by_activity": {}}
+			entry["label"] = frappe.utils.formatdate(f"{year}-{month:02d}-01", "MMM")
+			result.append(entry)
+		return result
+
+	last_week = date_type(year, 12, 28).isocalendar()[1]
+	return [
+		periods.get(week) or {"period": week, "total_seconds": 0, "card_count": 0, "correct_count": 0, "by_activity": {}}
+		for week in range(1, last_week + 1)
+	]
+
+
+@frappe.whitelist()
+def get_study_streak():
+	"""
+	Current and longest streak of consecutive study days.
+
+	Returns:
+		dict: current_streak, longest_streak and the last study date
+	"""
+	user = get_current_user()
+
+	days = frappe.db.sql_list(
+		"""
+		SELECT DISTINCT date
+		FROM `tabDaily Study Rollup`
+		WHERE user = %s AND (total_seconds > 0 OR card_count > 0)
+		ORDER BY date DESC
+		""",
+		(user,),
+	)
+
+	if not days:
+		return {"success": True, "current_streak": 0, "longest_streak": 0, "last_study_date": None}
+
+	days = [getdate(d) for d in days]
+	today = getdate()
+
+	current_streak = 0
+	if (today - days[0]).days <= 1:
+		current_streak = 1
+		for previous, current in zip(days, days[1:]):
+			if (previous - current).days != 1:
+				break
+			current_streak += 1
+
+	longest_streak = run = 1
+	for previous, current in zip(days, days[1:]):
+		run = run + 1 if (previous - current).days == 1 else 1
+		longest_streak = max(longest_streak, run)
+
+	return {
+		"success": True,
+		"current_streak": current_streak,
+		"longest_streak": longest_streak,
+		"last_study_date": days[0]
+	}
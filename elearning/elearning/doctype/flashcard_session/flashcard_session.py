@@ -5,12 +5,19 @@ import frappe
 from frappe.model.document import Document
 from frappe import _
 from frappe.utils import now_datetime, getdate, add_days, get_datetime
+from elearning.elearning.utils.study_analytics import get_year_range
+from elearning.elearning.doctype.daily_study_rollup.daily_study_rollup import refresh_user_day
 
 
 class FlashcardSession(Document):
 	pass
 
 
+def on_doctype_update():
+	# Phục vụ các truy vấn thống kê theo khoảng thời gian của từng user
+	frappe.db.add_index("Flashcard Session", ["user", "start_time"])
+
+
 def get_current_user():
 	user = frappe.session.user
 	if user == "Guest":
@@ -83,6 +90,7 @@ def end_flashcard_session(session_id):
 	
 	session.end_time = now_datetime()
 	session.save(ignore_permissions=True)
+	refresh_user_day(user, getdate(session.start_time), "flashcard")
 	frappe.db.commit()
 	
 	return {"success": True}
@@ -103,12 +111,12 @@ def get_flashcard_time_by_month(year=None):
 			mode,
 			SUM(time_spent_seconds) as time_spent
 		FROM `tabFlashcard Session`
-		WHERE user = %s AND YEAR(start_time) = %s
+		WHERE user = %s AND start_time >= %s AND start_time < %s
 		GROUP BY MONTH(start_time), mode
 	"""
 	
 	try:
-		data = frappe.db.sql(query, (user, year), as_dict=True)
+		data = frappe.db.sql(query, (user, *get_year_range(year)), as_dict=True)
 		
 		# Log dữ liệu gốc để kiểm tra
 		frappe.logger().debug(f"Flashcard session data for user {user}: {data}")
@@ -1,6 +1,10 @@
+import json
+
 import frappe
 from frappe.model.document import Document
 
+from elearning.elearning.utils.math_answer import compile_answer_key, split_accepted_answers
+
 class Question(Document):
     def validate(self):
         """Validate question data before saving"""
@@ -22,6 +26,16 @@ class Question(Document):
                     
             if not has_correct_option:
                 frappe.throw("At least one option must be marked as correct")
+
+        self.compile_answer_key()
+
+    def compile_answer_key(self):
+        """Self Write: precompute the canonical accepted answers used by the grader"""
+        if self.question_type != "Self Write" or not self.answer_key:
+            self.compiled_answer_key = None
+            return
+        compiled = compile_answer_key(split_accepted_answers(self.answer_key, self.accepted_answers), self.answer_tolerance)
+        self.compiled_answer_key = json.dumps(compiled, ensure_ascii=False)
     
     def get_options(self, hide_correct=True):
         """
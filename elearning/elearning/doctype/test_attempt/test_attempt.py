@@ -1,12 +1,29 @@
-import os
-import requests
 import frappe
 import json
 from frappe.model.document import Document
-from frappe.utils import now, get_datetime, time_diff_in_seconds
+from frappe.utils import now, now_datetime, add_to_date, get_datetime, time_diff_in_seconds, cint
 from elearning.elearning.doctype.test.test import get_test_data
+from elearning.elearning.utils.snapshots import get_test_snapshot, get_snapshot_answer_key, get_attempt_answer_key
+from elearning.elearning.utils.question_bank import (
+    get_test_question_items, get_questions_by_name,
+    get_options_by_question, get_rubric_items_by_question
+)
+from elearning.elearning.utils.exam_timer import (
+    compute_deadline, get_remaining_seconds, is_attempt_expired, get_submit_grace_seconds,
+    get_pause_cutoff, pause_attempt_clock, resume_attempt_clock
+)
+from elearning.elearning.utils.pagination import keyset_condition, get_page_size, get_next_cursor
+from elearning.api.api import set_response_header
+from elearning.elearning.utils.idempotency import get_idempotency_key, run_idempotent_submission
+from elearning.elearning.utils.attempt_buffer import (
+    is_write_behind_enabled, buffer_attempt_progress, get_buffered_state, flush_attempt, upsert_attempt_answers
+)
+from elearning.elearning.utils.attempt_events import publish_attempt_event
+from elearning.elearning.utils.math_answer import match_answer_key
+from elearning.elearning.utils.gemini_client import get_api_key, GeminiError, GeminiSchemaError, GeminiUnavailableError, BREAKER_NAME
+from elearning.elearning.utils.circuit_breaker import get_state, CLOSED
+from elearning.elearning.utils.prompt_templates import generate_json_with_template
 from frappe import _ 
-import re
 from elearning.elearning.utils.gemini_grader_service import grade_essay_with_gemini
 import logging
 import base64
@@ -20,7 +37,44 @@ def get_current_user():
     return user
 
 class TestAttempt(Document):
-    pass
+    def on_update(self):
+        self.publish_grading_events()
+
+        # Completed on submit, or Graded after the essays are reviewed
+        if self.status in SUMMARY_STATUSES and self.has_value_changed("status") and not self.feedback:
+            self.db_set("summary_status", "Pending", update_modified=False)
+            enqueue_attempt_summary(self.name)
+
+    def publish_grading_events(self):
+        if self.status == "In Progress":
+            return
+        before = self.get_doc_before_save()
+
+        # Re-grading after submission (manual essay review): one event per changed answer
+        if before and before.status != "In Progress":
+            old_answers = {row.name: (row.points_awarded, row.is_correct) for row in before.answers}
+            for row in self.answers:
+                if old_answers.get(row.name) != (row.points_awarded, row.is_correct):
+                    publish_attempt_event("Test Attempt", self.name, self.user, "question_graded", {
+                        "test_question_id": row.test_question_item,
+                        "points_awarded": row.points_awarded,
+                        "is_correct": row.is_correct,
+                        "ai_feedback": row.ai_feedback,
+                    })
+
+        if self.has_value_changed("status") or self.has_value_changed("final_score"):
+            publish_attempt_event("Test Attempt", self.name, self.user, "score_updated", {
+                "status": self.status,
+                "score": self.final_score,
+                "passed": self.is_passed,
+            })
+
+
+def on_doctype_update():
+    # Sweeper: In Progress attempts ordered by deadline
+    frappe.db.add_index("Test Attempt", ["status", "deadline"])
+    # History lists: WHERE user = ? ORDER BY start_time DESC, name DESC
+    frappe.db.add_index("Test Attempt", ["user", "start_time"])
 
 
 @frappe.whitelist()
@@ -53,7 +107,7 @@ def start_or_resume_test_attempt(test_id):
         logger.error(f"Test {test_id} not found for user {user}.")
         frappe.throw(_("Test {0} not found").format(test_id), frappe.DoesNotExistError)
 
-    test_doc_meta = frappe.get_cached_value("Test", test_id, ["is_active", "title", "time_limit_minutes", "instructions"], as_dict=True)
+    test_doc_meta = frappe.get_cached_value("Test", test_id, ["is_active", "title", "time_limit_minutes", "instructions", "published_snapshot_version", "allow_pause"], as_dict=True)
     if not test_doc_meta:
         logger.error(f"Could not retrieve metadata for Test {test_id}.")
         frappe.throw(_("Test {0} not found").format(test_id), frappe.DoesNotExistError)
@@ -73,6 +127,16 @@ def start_or_resume_test_attempt(test_id):
         attempt_id = existing_attempt[0].name
         attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
         logger.info(f"Resuming attempt {attempt_id} for test {test_id}, user {user}")
+
+        if is_attempt_expired(attempt_doc, get_submit_grace_seconds(), test_doc_meta.time_limit_minutes):
+            # The sweeper hasn't reached it yet: queue the grading of the saved answers now
+            enqueue_auto_submit(attempt_id, after_commit=False)
+            frappe.throw(_("Time is up for this attempt. It has been submitted with your saved answers."), frappe.ValidationError)
+
+        if attempt_doc.paused_at:
+            resume_attempt_clock(attempt_doc, test_doc_meta.time_limit_minutes)
+            attempt_doc.save(ignore_permissions=True)
+            frappe.db.commit()
     else:
         logger.info(f"Starting new attempt for test {test_id}, user {user}")
         attempt_doc = frappe.new_doc("Test Attempt")
@@ -80,7 +144,10 @@ def start_or_resume_test_attempt(test_id):
         attempt_doc.user = user
         attempt_doc.status = "In Progress"
         attempt_doc.start_time = now()
-        if test_doc_meta.time_limit_minutes and test_doc_meta.time_limit_minutes > 0:
+        # Pin the published snapshot so edits during the exam don't change this attempt's questions
+        attempt_doc.snapshot_version = test_doc_meta.published_snapshot_version or 0
+        attempt_doc.deadline = compute_deadline(attempt_doc.start_time, test_doc_meta.time_limit_minutes)
+        if attempt_doc.deadline:
              attempt_doc.remaining_time_seconds = test_doc_meta.time_limit_minutes * 60
 
         try:
@@ -93,7 +160,12 @@ def start_or_resume_test_attempt(test_id):
             logger.error(f"Failed to create new Test Attempt for test {test_id}, user {user}. Error: {e}", exc_info=True)
             frappe.throw(_("Could not start the test attempt. Please try again."))
 
-    test_data_for_taking = get_test_data(test_id) 
+    test_data_for_taking = None
+    if attempt_doc.get("snapshot_version"):
+        test_data_for_taking = get_test_snapshot(test_id, attempt_doc.snapshot_version)
+    if test_data_for_taking is None:
+        # Unpublished test (or snapshot lost): fall back to the live question bank
+        test_data_for_taking = get_test_data(test_id)
 
     saved_answers_dict = {}
     if attempt_doc and attempt_doc.get("answers"):
@@ -112,6 +184,14 @@ def start_or_resume_test_attempt(test_id):
                 # Fallback or logging if test_question_item is not set in saved answer
                 logger.warning(f"Saved answer item {answer_detail.name} in attempt {attempt_doc.name} is missing 'test_question_item' link.")
 
+    # Write-behind: autosaves not flushed yet live in redis and are newer than the DB rows
+    buffered_state = get_buffered_state(attempt_doc.name) if existing_attempt else None
+    if buffered_state:
+        for tqi_id, buffered_answer in buffered_state["answers"].items():
+            saved_answers_dict.setdefault(tqi_id, {"timeSpentSeconds": 0})["userAnswer"] = buffered_answer.get("user_answer")
+        buffered_meta = buffered_state["meta"]
+        if buffered_meta.get("last_viewed_question"):
+            attempt_doc.last_viewed_question = buffered_meta["last_viewed_question"]
 
     time_elapsed_seconds = 0
     if existing_attempt and attempt_doc.start_time : # ensure start_time is not None
@@ -122,7 +202,10 @@ def start_or_resume_test_attempt(test_id):
             "id": attempt_doc.name,
             "status": attempt_doc.status,
             "start_time": attempt_doc.start_time,
-            "remaining_time_seconds": attempt_doc.remaining_time_seconds,
+            # Computed from the server-side deadline, the client clock is never trusted
+            "remaining_time_seconds": get_remaining_seconds(attempt_doc, test_doc_meta.time_limit_minutes),
+            "deadline": attempt_doc.deadline,
+            "allow_pause": test_doc_meta.allow_pause,
             "last_viewed_question_id": attempt_doc.last_viewed_question, 
         },
         "test": {
@@ -138,28 +221,75 @@ def start_or_resume_test_attempt(test_id):
 
 
 @frappe.whitelist(allow_guest=True)
-def submit_test_attempt(attempt_id, submission_data):
+def submit_test_attempt(attempt_id, submission_data, idempotency_key=None):
+    """
+    Grade and close an attempt. Clients should send an idempotency key (argument
+    or Idempotency-Key header): retries with the same key get the stored result,
+    or {"status": "Processing"} while the first request is still running.
+    """
     user = get_current_user()
     submit_logger = frappe.logger("submit_test_attempt")
 
     try:
         submission_data_dict = json.loads(submission_data)
         answers_input = submission_data_dict.get("answers", {})
-        time_left = submission_data_dict.get("timeLeft")
         last_viewed_test_q_detail_id = submission_data_dict.get("lastViewedTestQuestionId")
     except Exception as e:
         submit_logger.error(f"Error parsing submission_data for attempt {attempt_id}. Error: {e}", exc_info=True)
         frappe.throw(_("Could not parse submission data."), frappe.ValidationError)
 
-    attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
-
-    if attempt_doc.user != user:
+    # Check ownership before a key can be claimed on the attempt
+    if frappe.db.get_value("Test Attempt", attempt_id, "user") != user:
         frappe.throw(_("You are not permitted to submit this attempt."), frappe.PermissionError)
-    if attempt_doc.status != "In Progress":
-        frappe.throw(_("This attempt cannot be submitted (Status: {0}).").format(attempt_doc.status), frappe.ValidationError)
 
-    test_doc = frappe.get_doc("Test", attempt_doc.test)
-    test_q_details_map = {tqd.name: {"question": tqd.question, "points": tqd.points} for tqd in test_doc.questions}
+    def submit():
+        # Persist (or replay) any write-behind autosave before the attempt is finalized;
+        # finalizing without it would discard the buffered answers on the next flush
+        if not flush_attempt(attempt_id):
+            frappe.throw(_("Your latest answers are still being saved. Please submit again in a moment."))
+
+        attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
+        if attempt_doc.status != "In Progress":
+            frappe.throw(_("This attempt cannot be submitted (Status: {0}).").format(attempt_doc.status), frappe.ValidationError)
+        if attempt_doc.paused_at:
+            frappe.throw(_("This attempt is paused. Resume it before submitting."), frappe.ValidationError)
+
+        if is_attempt_expired(attempt_doc, get_submit_grace_seconds()):
+            # Submitted after deadline + grace: only what was saved before the deadline counts
+            submit_logger.warning(f"Late submission for attempt {attempt_id}, grading saved answers only.")
+            return finalize_test_attempt(attempt_doc, get_saved_answers_input(attempt_doc), last_viewed_test_q_detail_id, auto_submitted=True)
+
+        return finalize_test_attempt(attempt_doc, answers_input, last_viewed_test_q_detail_id)
+
+    return run_idempotent_submission(
+        attempt_id,
+        get_idempotency_key(idempotency_key),
+        submit,
+        {"status": "Processing", "attemptId": attempt_id},
+    )
+
+
+def get_saved_answers_input(attempt_doc):
+    """Saved Attempt Answer Items in the submission_data["answers"] shape"""
+    return {
+        ans.test_question_item: {"userAnswer": ans.user_answer, "timeSpent": ans.time_spent_seconds}
+        for ans in attempt_doc.get("answers", [])
+        if ans.test_question_item
+    }
+
+
+def finalize_test_attempt(attempt_doc, answers_input, last_viewed_test_q_detail_id=None, auto_submitted=False):
+    """
+    Grade `answers_input` ({test_question_item_id: {"userAnswer", "timeSpent", "base64_images"}})
+    into the attempt, close it and return the submit result.
+    Shared by submit_test_attempt and the expired-attempt sweeper.
+    """
+    submit_logger = frappe.logger("submit_test_attempt")
+    attempt_id = attempt_doc.name
+
+    # Compiled once per published version: objective grading below needs no per-answer queries
+    answer_key = get_attempt_answer_key(attempt_doc)
+    answer_key_items = answer_key["items"]
 
     total_score = 0
     total_possible_score = 0
@@ -173,14 +303,13 @@ def submit_test_attempt(attempt_id, submission_data):
         time_spent = answer_data_from_frontend.get("timeSpent")
         base64_images_data = answer_data_from_frontend.get("base64_images", [])
 
-        try:
-            q_link = frappe.get_doc("Test Question Item", test_q_item_id).question  # name of Question
-        except frappe.DoesNotExistError:
+        key_entry = answer_key_items.get(test_q_item_id)
+        if not key_entry:
             submit_logger.warning(f"Skipping answer for unknown TQI {test_q_item_id}")
             continue
 
-        q_doc = frappe.get_doc("Question", q_link)
-        point_value = getattr(q_doc, "marks", 1) or 1
+        q_link = key_entry["question"]  # name of Question
+        point_value = key_entry["points"]
         total_possible_score += point_value
 
         final_answer_item_data = {
@@ -195,12 +324,12 @@ def submit_test_attempt(attempt_id, submission_data):
         }
 
         try:
-            # We still need q_doc to know its type for current processing, even if not saving it to AAI
-            q_doc = frappe.get_doc("Question", q_link)
-            current_question_type = q_doc.question_type # Get type for logic below
+            current_question_type = key_entry["question_type"]
+            if current_question_type is None:
+                raise frappe.DoesNotExistError
 
             if current_question_type == "Multiple Choice":
-                correct_opt = next((o.name for o in q_doc.options if o.is_correct), None)
+                correct_opt = key_entry["correct_option"]
                 if user_answer_text and correct_opt and str(user_answer_text).strip() == correct_opt.strip():
                     final_answer_item_data["is_correct"] = True
                     final_answer_item_data["points_awarded"] = point_value
@@ -209,8 +338,7 @@ def submit_test_attempt(attempt_id, submission_data):
 
             elif current_question_type == "Self Write":
                 is_correct_sw = False
-                if user_answer_text is not None and q_doc.answer_key and \
-                   str(user_answer_text).strip().lower() == str(q_doc.answer_key).strip().lower():
+                if match_answer_key(user_answer_text, key_entry["answer_key"]):
                     is_correct_sw = True
                 final_answer_item_data["is_correct"] = is_correct_sw
                 if is_correct_sw:
@@ -238,11 +366,7 @@ def submit_test_attempt(attempt_id, submission_data):
                     except Exception as e_b64_file:
                         submit_logger.error(f"    Error processing Base64 image '{original_filename}': {e_b64_file}", exc_info=True)
 
-                rubric_items_raw = frappe.get_all(
-                    "Rubric Item", filters={"parent": q_doc.name, "parenttype": "Question"},
-                    fields=["name", "description", "max_score", "step_order"], order_by="step_order asc"
-                )
-                rubric_for_ai = [{"id": ri.name, "description": ri.description, "max_score": ri.max_score, "step_order": ri.step_order} for ri in rubric_items_raw]
+                rubric_for_ai = key_entry["rubric"]
 
                 if not rubric_for_ai:
                     final_answer_item_data["ai_feedback"] = "Không có thang điểm (rubric) cho câu hỏi này. Cần chấm thủ công."
@@ -250,8 +374,8 @@ def submit_test_attempt(attempt_id, submission_data):
                     any_essay_needs_manual_review = True
                 else:
                     ai_grading_result = grade_essay_with_gemini( # type: ignore
-                        question_doc_content=q_doc.content,
-                        question_name_for_log=f"{q_doc.name} (Attempt: {attempt_id})",
+                        question_doc_content=key_entry["content"],
+                        question_name_for_log=f"{q_link} (Attempt: {attempt_id})",
                         rubric_items=rubric_for_ai,
                         file_doc_names=file_doc_names_for_gemini,
                         student_answer_text=user_answer_text
@@ -277,6 +401,8 @@ def submit_test_attempt(attempt_id, submission_data):
                             feedback_from_ai_service = ai_grading_result.get("overall_feedback")
                         final_answer_item_data["ai_feedback"] = feedback_from_ai_service
                         final_answer_item_data["points_awarded"] = 0
+                        # Gemini circuit open: grade_deferred_essays grades it once the circuit closes
+                        final_answer_item_data["ai_grading_deferred"] = 1 if (ai_grading_result or {}).get("deferred") else 0
                         any_essay_needs_manual_review = True
             
             attempt_doc.append("answers", final_answer_item_data)
@@ -303,37 +429,32 @@ def submit_test_attempt(attempt_id, submission_data):
     if any_essay_needs_manual_review:
         attempt_doc.status = "To be graded"
     else:
-        # To check if there are essays, we now need to fetch the question type for each answer
-        # This check can be simplified or refined if performance is a concern
-        has_essays_in_attempt = False
-        for ans_data in attempt_doc.answers: # ans_data is an AttemptAnswerItem Document
-            if ans_data.question: # Check if 'question' link exists
-                try:
-                    q_type = frappe.get_value("Question", ans_data.question, "question_type")
-                    if q_type == "Essay":
-                        has_essays_in_attempt = True
-                        break 
-                except Exception: # Handle case where question might not be found (shouldn't happen if data is clean)
-                    pass # Or log a warning
-        
+        has_essays_in_attempt = any(
+            answer_key_items.get(ans_data.test_question_item, {}).get("question_type") == "Essay"
+            for ans_data in attempt_doc.answers
+        )
+
         if has_essays_in_attempt: 
             attempt_doc.status = "Graded" 
         else: 
             attempt_doc.status = "Completed"
 
     attempt_doc.end_time = now()
-    attempt_doc.remaining_time_seconds = time_left if time_left is not None else 0
-    if last_viewed_test_q_detail_id and last_viewed_test_q_detail_id in test_q_details_map:
-        attempt_doc.last_viewed_question = test_q_details_map[last_viewed_test_q_detail_id]["question"]
+    attempt_doc.remaining_time_seconds = get_remaining_seconds(attempt_doc) or 0
+    attempt_doc.paused_at = None
+    attempt_doc.auto_submitted = 1 if auto_submitted else 0
+    if last_viewed_test_q_detail_id and last_viewed_test_q_detail_id in answer_key_items:
+        attempt_doc.last_viewed_question = answer_key_items[last_viewed_test_q_detail_id]["question"]
     else: 
         attempt_doc.last_viewed_question = None
 
     attempt_doc.is_passed = False 
-    if total_possible_score > 0 and test_doc.passing_score is not None:
+    passing_score = answer_key["passing_score"]
+    if total_possible_score > 0 and passing_score is not None:
         score_percentage = (total_score / total_possible_score) * 100
-        if score_percentage >= test_doc.passing_score:
+        if score_percentage >= passing_score:
             attempt_doc.is_passed = True
-    elif test_doc.passing_score == 0: 
+    elif passing_score == 0: 
         attempt_doc.is_passed = True
 
     try:
@@ -347,79 +468,249 @@ def submit_test_attempt(attempt_id, submission_data):
     saved_attempt_doc = frappe.get_doc("Test Attempt", attempt_doc.name) 
 
     for ans_item_reloaded in saved_attempt_doc.answers: 
-        # ---- MODIFICATION START ----
-        # Get question_type from the linked Question document
-        current_ans_question_type = None
-        if ans_item_reloaded.question: # Check if the 'question' link field is set
-            try:
-                current_ans_question_type = frappe.get_value("Question", ans_item_reloaded.question, "question_type")
-            except frappe.DoesNotExistError:
-                submit_logger.warning(f"Linked Question {ans_item_reloaded.question} not found for AAI {ans_item_reloaded.name} during Rubric Score creation.")
-            except Exception as e_get_q_type:
-                 submit_logger.error(f"Error fetching question_type for AAI {ans_item_reloaded.name}, Question {ans_item_reloaded.question}: {e_get_q_type}")
-        
-        if current_ans_question_type == "Essay":
-        # ---- MODIFICATION END ----
+        ans_key_entry = answer_key_items.get(ans_item_reloaded.test_question_item, {})
+        if ans_key_entry.get("question_type") == "Essay":
+            known_rubric_ids = {ri["id"] for ri in ans_key_entry.get("rubric", [])}
             ai_grading_data = ai_grading_results_map.get(ans_item_reloaded.test_question_item)
             
             if ai_grading_data and ai_grading_data.get("result") and not ai_grading_data["result"].get("error"):
-                rubric_scores_from_ai = ai_grading_data["result"].get("rubric_scores", [])
-                if rubric_scores_from_ai:
-                    submit_logger.info(f"Creating standalone Rubric Score Items for AAI: {ans_item_reloaded.name}")
-                    for scored_rubric_item_from_ai in rubric_scores_from_ai:
-                        rubric_item_id_from_ai = scored_rubric_item_from_ai.get("rubric_item_id")
-                        points_awarded_from_ai = scored_rubric_item_from_ai.get("points_awarded")
-                        comment_from_ai = scored_rubric_item_from_ai.get("comment")
-
-                        if not rubric_item_id_from_ai:
-                            submit_logger.warning(f"  Skipping standalone RSI for AAI {ans_item_reloaded.name} due to missing 'rubric_item_id'")
-                            continue
-                        if not frappe.db.exists("Rubric Item", rubric_item_id_from_ai):
-                            submit_logger.warning(f"  Skipping standalone RSI for AAI {ans_item_reloaded.name}: Base Rubric Item ID '{rubric_item_id_from_ai}' does not exist.")
-                            continue
-                        
-                        try:
-                            rsi_doc = frappe.new_doc("Rubric Score Item")
-                            rsi_doc.set("attempt_answer_item_link", ans_item_reloaded.name) 
-                            rsi_doc.rubric_item = rubric_item_id_from_ai
-                            rsi_doc.points_awarded = points_awarded_from_ai
-                            rsi_doc.comment = comment_from_ai
-                            rsi_doc.insert(ignore_permissions=True)
-                            submit_logger.info(f"    Created standalone Rubric Score Item: {rsi_doc.name} for AAI {ans_item_reloaded.name}")
-                        except Exception as e_rsi_create:
-                            submit_logger.error(f"    Error creating standalone Rubric Score Item for AAI {ans_item_reloaded.name}: {e_rsi_create}", exc_info=True)
-                    frappe.db.commit() 
-                else:
-                     submit_logger.info(f"  No rubric scores from AI to create for AAI: {ans_item_reloaded.name}")   
+                create_rubric_score_items(ans_item_reloaded.name, ai_grading_data["result"].get("rubric_scores", []), known_rubric_ids)
             elif ai_grading_data and ai_grading_data.get("result") and ai_grading_data["result"].get("error"):
                 submit_logger.warning(f"  AI grading returned an error for AAI: {ans_item_reloaded.name}. No standalone Rubric Score Items will be created. AI Feedback: {ai_grading_data['result'].get('overall_feedback')}")
             # else: # No AI result found for this test_question_item, or question_link_name mismatch
                 # submit_logger.info(f"No AI grading result found for AAI {ans_item_reloaded.name} with TQI {ans_item_reloaded.test_question_item} to create RubricScoreItems.")
 
 
-    final_saved_attempt_doc = frappe.get_doc("Test Attempt", attempt_doc.name)
-    if final_saved_attempt_doc.answers:
-        print("--- Child 'answers' details AFTER ALL SAVES & RELOAD ---")
-        for i, ans_doc_reloaded in enumerate(final_saved_attempt_doc.answers):
-            print(f"  Reloaded Answer Item {i} - Name: {ans_doc_reloaded.name}, Doctype: {ans_doc_reloaded.doctype}:")
-            
-            answer_images_reloaded = getattr(ans_doc_reloaded, "answer_images", None)
-            if answer_images_reloaded and len(answer_images_reloaded) > 0:
-                print(f"    It HAS reloaded answer_images with {len(answer_images_reloaded)} entries.")
-                # for k, img_doc_reloaded in enumerate(answer_images_reloaded): # Not needed if just confirming count
-                #     print(f"      Reloaded Answer Image Entry {k} (Doc): {json.dumps(img_doc_reloaded.as_dict(), default=str)}")
-            else:
-                print(f"    Reloaded answer_images is MISSING or empty on {ans_doc_reloaded.name}.")
-
-    if final_saved_attempt_doc.status == "Graded" or final_saved_attempt_doc.status == "Completed":
-        generate_and_save_feedback_with_llm(final_saved_attempt_doc) # type: ignore
+    # Rubric Score Items are standalone docs, the attempt itself didn't change since the reload
+    final_saved_attempt_doc = saved_attempt_doc
 
+    # The LLM summary is queued by TestAttempt.on_update once the status is
+    # Completed/Graded; submission only waits for grading and persistence.
     return {
         "status": final_saved_attempt_doc.status,
         "score": final_saved_attempt_doc.final_score,
         "passed": final_saved_attempt_doc.is_passed,
-        "attemptId": final_saved_attempt_doc.name
+        "attemptId": final_saved_attempt_doc.name,
+        "summaryStatus": "Pending" if final_saved_attempt_doc.status in SUMMARY_STATUSES else None
     }
+
+
+def create_rubric_score_items(answer_item_name, rubric_scores_from_ai, known_rubric_ids):
+    """Standalone Rubric Score Items of one AI-graded essay answer"""
+    submit_logger = frappe.logger("submit_test_attempt")
+    if not rubric_scores_from_ai:
+        submit_logger.info(f"  No rubric scores from AI to create for AAI: {answer_item_name}")
+        return
+
+    submit_logger.info(f"Creating standalone Rubric Score Items for AAI: {answer_item_name}")
+    for scored_rubric_item_from_ai in rubric_scores_from_ai:
+        rubric_item_id_from_ai = scored_rubric_item_from_ai.get("rubric_item_id")
+        if not rubric_item_id_from_ai:
+            submit_logger.warning(f"  Skipping standalone RSI for AAI {answer_item_name} due to missing 'rubric_item_id'")
+            continue
+        if rubric_item_id_from_ai not in known_rubric_ids:
+            submit_logger.warning(f"  Skipping standalone RSI for AAI {answer_item_name}: Base Rubric Item ID '{rubric_item_id_from_ai}' does not exist.")
+            continue
+
+        try:
+            rsi_doc = frappe.new_doc("Rubric Score Item")
+            rsi_doc.set("attempt_answer_item_link", answer_item_name)
+            rsi_doc.rubric_item = rubric_item_id_from_ai
+            rsi_doc.points_awarded = scored_rubric_item_from_ai.get("points_awarded")
+            rsi_doc.comment = scored_rubric_item_from_ai.get("comment")
+            rsi_doc.insert(ignore_permissions=True)
+            submit_logger.info(f"    Created standalone Rubric Score Item: {rsi_doc.name} for AAI {answer_item_name}")
+        except Exception as e_rsi_create:
+            submit_logger.error(f"    Error creating standalone Rubric Score Item for AAI {answer_item_name}: {e_rsi_create}", exc_info=True)
+    frappe.db.commit()
+
+
+def essay_needs_manual_review(answer_row):
+    """Same rule as finalize_test_attempt: no AI score, no content, or an AI error scored 0"""
+    feedback = (answer_row.ai_feedback or "").lower()
+    if answer_row.ai_grading_deferred or answer_row.ai_score is None:
+        return True
+    if answer_row.ai_feedback == "Không có nội dung bài làm được nộp (cả văn bản và hình ảnh).":
+        return True
+    return not answer_row.points_awarded and ("error" in feedback or "lỗi" in feedback)
+
+
+def grade_deferred_essays(limit=50):
+    """
+    Scheduled: essays that couldn't be graded while the Gemini circuit was
+    open are queued again, one job per attempt, once it is closed.
+    """
+    if get_state(BREAKER_NAME) != CLOSED:
+        return
+    waiting = frappe.get_all("Test Attempt", filters={"status": "To be graded"}, pluck="name", limit=1000)
+    if not waiting:
+        return
+    deferred = frappe.get_all(
+        "Attempt Answer Item",
+        filters={"parent": ["in", waiting], "parenttype": "Test Attempt", "ai_grading_deferred": 1},
+        pluck="parent",
+        distinct=True,
+        limit=limit,
+    )
+    for attempt_id in deferred:
+        frappe.enqueue(
+            "elearning.elearning.doctype.test_attempt.test_attempt.grade_deferred_essays_job",
+            queue="long",
+            job_id=f"deferred_essays::{attempt_id}",
+            deduplicate=True,
+            attempt_id=attempt_id,
+        )
+    if deferred:
+        frappe.logger("submit_test_attempt").info(f"Queued deferred essay grading of {len(deferred)} attempts.")
+
+
+def grade_deferred_essays_job(attempt_id):
+    """Background job: AI-grade the deferred essays of one attempt, then rescore it"""
+    job_logger = frappe.logger("submit_test_attempt")
+    attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
+    if attempt_doc.status != "To be graded":
+        return
+    answer_key = get_attempt_answer_key(attempt_doc)
+    answer_key_items = answer_key["items"]
+
+    graded = []
+    for row in attempt_doc.answers:
+        if not row.ai_grading_deferred:
+            continue
+        key_entry = answer_key_items.get(row.test_question_item) or {}
+        image_urls = [image.image for image in row.get("answer_images", []) if image.image]
+        file_doc_names = frappe.get_all(
+            "File", filters={"file_url": ["in", image_urls], "attached_to_name": attempt_id}, pluck="name"
+        ) if image_urls else []
+        result = grade_essay_with_gemini(
+            question_doc_content=key_entry.get("content"),
+            question_name_for_log=f"{row.question} (Attempt: {attempt_id}, deferred)",
+            rubric_items=key_entry.get("rubric") or [],
+            file_doc_names=file_doc_names,
+            student_answer_text=row.user_answer,
+        )
+        if result.get("deferred"):
+            # Circuit opened again: the rest waits for the next run
+            break
+        row.ai_grading_deferred = 0
+        row.ai_feedback = result.get("overall_feedback")
+        if result.get("error"):
+            row.ai_score = None
+            row.points_awarded = 0
+        else:
+            row.ai_score = result.get("total_score_awarded")
+            row.points_awarded = result.get("total_score_awarded", 0)
+            graded.append((row.name, result.get("rubric_scores", []), {ri["id"] for ri in key_entry.get("rubric") or []}))
+
+    attempt_doc.final_score = sum(row.points_awarded or 0 for row in attempt_doc.answers)
+    total_possible_score = sum(
+        answer_key_items[row.test_question_item]["points"] for row in attempt_doc.answers if row.test_question_item in answer_key_items
+    )
+    passing_score = answer_key["passing_score"]
+    if total_possible_score > 0 and passing_score is not None:
+        attempt_doc.is_passed = (attempt_doc.final_score / total_possible_score) * 100 >= passing_score
+    if not any(
+        essay_needs_manual_review(row) for row in attempt_doc.answers
+        if answer_key_items.get(row.test_question_item, {}).get("question_type") == "Essay"
+    ):
+        attempt_doc.status = "Graded"
+
+    # on_update pushes question_graded/score_updated and queues the summary once Graded
+    attempt_doc.save(ignore_permissions=True)
+    frappe.db.commit()
+    for answer_item_name, rubric_scores, known_rubric_ids in graded:
+        create_rubric_score_items(answer_item_name, rubric_scores, known_rubric_ids)
+    job_logger.info(f"Deferred essays of attempt {attempt_id} graded ({len(graded)} by AI), status {attempt_doc.status}.")
+
+
+def auto_submit_attempt(attempt_doc):
+    """Grade an expired attempt from its saved (and buffered) answers"""
+    if not flush_attempt(attempt_doc.name):
+        # Still In Progress, so the sweeper queues it again on its next run
+        frappe.logger("auto_submit_expired_attempts").warning(
+            f"Buffered answers of attempt {attempt_doc.name} could not be flushed, auto-submit postponed."
+        )
+        return None
+    attempt_doc.reload()
+    if attempt_doc.status != "In Progress" or not is_attempt_expired(attempt_doc, get_submit_grace_seconds()):
+        return None
+    if attempt_doc.paused_at:
+        # Abandoned while paused: the clock stopped at the pause
+        resume_attempt_clock(attempt_doc)
+    return finalize_test_attempt(attempt_doc, get_saved_answers_input(attempt_doc), auto_submitted=True)
+
+
+def enqueue_auto_submit(attempt_id, after_commit=True):
+    """Queue auto_submit_attempt_job; job_id keeps one queued job per attempt"""
+    frappe.enqueue(
+        "elearning.elearning.doctype.test_attempt.test_attempt.auto_submit_attempt_job",
+        queue="long",
+        job_id=f"auto_submit_attempt::{attempt_id}",
+        deduplicate=True,
+        enqueue_after_commit=after_commit,
+        attempt_id=attempt_id,
+    )
+
+
+def auto_submit_attempt_job(attempt_id):
+    """Background job: grade one expired attempt (essays can take a while, so each gets its own job)"""
+    try:
+        auto_submit_attempt(frappe.get_doc("Test Attempt", attempt_id))
+    except frappe.DoesNotExistError:
+        return
+    except Exception:
+        frappe.db.rollback()
+        frappe.logger("auto_submit_expired_attempts").error(f"Could not auto-submit expired attempt {attempt_id}", exc_info=True)
+        raise
+
+
+def auto_submit_expired_attempts(limit=200):
+    """
+    Scheduled sweeper: queue the submission of In Progress attempts whose
+    deadline (+ grace) has passed, or that stayed paused longer than the max
+    pause length, so abandoned attempts don't stay open forever. Untimed
+    tests (no deadline) are only picked up when abandoned while paused.
+    """
+    sweeper_logger = frappe.logger("auto_submit_expired_attempts")
+    cutoff = add_to_date(now_datetime(), seconds=-get_submit_grace_seconds())
+    expired = frappe.get_all(
+        "Test Attempt",
+        filters={"status": "In Progress", "deadline": ["<", cutoff], "paused_at": ["is", "not set"]},
+        pluck="name",
+        order_by="deadline asc",
+        limit=limit,
+    )
+    expired += frappe.get_all(
+        "Test Attempt",
+        filters={"status": "In Progress", "paused_at": ["<", get_pause_cutoff()]},
+        pluck="name",
+        order_by="paused_at asc",
+        limit=limit,
+    )
+    for attempt_id in expired:
+        enqueue_auto_submit(attempt_id, after_commit=False)
+    if expired:
+        sweeper_logger.info(f"Queued auto-submission of {len(expired)} expired attempts.")
+
+
+@frappe.whitelist(methods=["POST"])
+def pause_test_attempt(attempt_id):
+    """Stop the attempt's clock; start_or_resume_test_attempt resumes it and extends the deadline"""
+    user = get_current_user()
+    attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
+    if attempt_doc.user != user:
+        frappe.throw(_("You are not permitted to pause this attempt."), frappe.PermissionError)
+    if attempt_doc.status != "In Progress":
+        frappe.throw(_("Cannot pause. Status is {0}.").format(attempt_doc.status), frappe.ValidationError)
+    if not frappe.get_cached_value("Test", attempt_doc.test, "allow_pause"):
+        frappe.throw(_("This test cannot be paused."), frappe.ValidationError)
+    if is_attempt_expired(attempt_doc):
+        frappe.throw(_("Time is up for this attempt."), frappe.ValidationError)
+
+    pause_attempt_clock(attempt_doc)
+    attempt_doc.save(ignore_permissions=True)
+    frappe.db.commit()
+    return {"success": True, "remaining_time_seconds": get_remaining_seconds(attempt_doc)}
     
 @frappe.whitelist(methods=["PATCH"])
 def save_attempt_progress(attempt_id, progress_data):
@@ -429,7 +720,6 @@ def save_attempt_progress(attempt_id, progress_data):
     try:
         progress_data_dict = json.loads(progress_data)
         answers_input = progress_data_dict.get("answers", {}) # keys are test_question_detail_id
-        remaining_time = progress_data_dict.get("remainingTimeSeconds")
         last_viewed_test_q_detail_id = progress_data_dict.get("lastViewedTestQuestionId") # This is Test Question Item ID
     except json.JSONDecodeError:
         logger.error(f"Invalid progress_data JSON for attempt {attempt_id}.", exc_info=True)
@@ -450,9 +740,27 @@ def save_attempt_progress(attempt_id, progress_data):
     if attempt_doc.status != "In Progress":
         logger.warning(f"Attempt to save progress for Test Attempt {attempt_id} which is not 'In Progress' (Status: {attempt_doc.status}).")
         frappe.throw(_("Cannot save progress. Status is {0}.").format(attempt_doc.status), frappe.ValidationError)
+    if attempt_doc.paused_at:
+        frappe.throw(_("This attempt is paused. Resume it before saving answers."), frappe.ValidationError)
+    # Answers saved after the deadline must not reach the late-submit/sweeper grading
+    if is_attempt_expired(attempt_doc):
+        frappe.throw(_("Time is up for this attempt."), frappe.ValidationError)
+
+    if is_write_behind_enabled():
+        answer_key_items = get_attempt_answer_key(attempt_doc)["items"]
+        answer_rows = [
+            {
+                "test_question_item": tqi_id,
+                "question": answer_key_items[tqi_id]["question"],
+                "user_answer": str(answer_data.get("userAnswer")) if answer_data.get("userAnswer") is not None else None
+            }
+            for tqi_id, answer_data in answers_input.items() if tqi_id in answer_key_items
+        ]
+        last_viewed_question = answer_key_items.get(last_viewed_test_q_detail_id, {}).get("question") if last_viewed_test_q_detail_id else None
+        # {"success": False, "retry": True} while a flush holds the attempt: the client saves again
+        return buffer_attempt_progress(attempt_doc, answer_rows, last_viewed_question=last_viewed_question)
 
-    attempt_doc.remaining_time_seconds = remaining_time
-
+    # remaining_time_seconds is derived from the server-side deadline; the client value is ignored
     if last_viewed_test_q_detail_id:
         base_question_name = frappe.db.get_value("Test Question Item", last_viewed_test_q_detail_id, "question")
         if base_question_name:
@@ -512,300 +820,554 @@ def save_attempt_progress(attempt_id, progress_data):
         frappe.throw(_("Could not save progress. Please try again."))
 
 
-@frappe.whitelist()
-def get_user_attempts_for_test(test_id):
+@frappe.whitelist(methods=["PATCH", "POST"])
+def autosave_attempt_delta(attempt_id, delta_data):
+    """
+    Delta autosave: only the answers changed since the last successful save.
+
+    delta_data (JSON):
+        seq (int): strictly increasing per attempt (the client uses a timestamp);
+            a seq <= the last accepted one is rejected as stale
+        answers (dict): {test_question_item_id: {"userAnswer": ...}} - changed answers only
+        remainingTimeSeconds: ignored, the timer is server-side (see exam_timer)
+        lastViewedTestQuestionId (str, optional): Test Question Item ID
+
+    Cost is one locked read of the attempt row, one upsert for the changed
+    answers and one update of the attempt - independent of the test size.
+    """
     user = get_current_user()
+    logger = frappe.logger("autosave_attempt_delta")
 
-    attempts = frappe.get_list(
+    try:
+        delta = json.loads(delta_data) if isinstance(delta_data, str) else delta_data
+        seq = cint(delta.get("seq"))
+        answers_input = delta.get("answers") or {}
+        last_viewed_test_q_detail_id = delta.get("lastViewedTestQuestionId")
+    except Exception as e:
+        logger.error(f"Could not parse delta_data for attempt {attempt_id}. Error: {e}", exc_info=True)
+        frappe.throw(_("Could not parse progress data."), frappe.ValidationError)
+
+    if seq <= 0:
+        frappe.throw(_("A positive sequence number is required."), frappe.ValidationError)
+
+    # FOR UPDATE serializes concurrent autosaves of the same attempt so seq checks can't race
+    attempt = frappe.db.get_value(
         "Test Attempt",
-        filters={"test": test_id, "user": user},
-        fields=[
-            "name as id", 
-            "status",
-            "final_score",
-            "is_passed",
-            "start_time",
-            "end_time"
-        ],
-        order_by="start_time desc"
+        attempt_id,
+        ["name", "user", "status", "test", "snapshot_version", "autosave_seq", "paused_at", "start_time", "deadline", "paused_seconds"],
+        as_dict=True,
+        for_update=True,
     )
+    if not attempt:
+        frappe.throw(_("Test Attempt {0} not found.").format(attempt_id), frappe.DoesNotExistError)
+    if attempt.user != user:
+        frappe.throw(_("You are not permitted to save progress for this attempt."), frappe.PermissionError)
+    if attempt.status != "In Progress":
+        frappe.throw(_("Cannot save progress. Status is {0}.").format(attempt.status), frappe.ValidationError)
+    if attempt.paused_at:
+        frappe.throw(_("This attempt is paused. Resume it before saving answers."), frappe.ValidationError)
+    if is_attempt_expired(attempt):
+        frappe.throw(_("Time is up for this attempt."), frappe.ValidationError)
+
+    if seq <= cint(attempt.autosave_seq):
+        frappe.db.rollback()
+        logger.info(f"Rejected stale autosave seq {seq} (current {attempt.autosave_seq}) for attempt {attempt_id}.")
+        return {"success": False, "stale": True, "seq": cint(attempt.autosave_seq)}
+
+    answer_key_items = get_attempt_answer_key(attempt)["items"]
+
+    answer_rows = []
+    for test_q_item_id, answer_data in answers_input.items():
+        key_entry = answer_key_items.get(test_q_item_id)
+        if not key_entry:
+            logger.warning(f"Skipping autosave for unknown Test Question Item ID {test_q_item_id} in attempt {attempt_id}.")
+            continue
+        user_answer = (answer_data or {}).get("userAnswer")
+        answer_rows.append({
+            "test_question_item": test_q_item_id,
+            "question": key_entry["question"],
+            "user_answer": str(user_answer) if user_answer is not None else None
+        })
+
+    if is_write_behind_enabled():
+        frappe.db.rollback()  # release the row lock, redis serializes buffered writes
+        return buffer_attempt_progress(
+            attempt, answer_rows, seq=seq,
+            last_viewed_question=answer_key_items.get(last_viewed_test_q_detail_id, {}).get("question") if last_viewed_test_q_detail_id else None
+        )
+
+    attempt_updates = {"autosave_seq": seq}
+    if last_viewed_test_q_detail_id:
+        attempt_updates["last_viewed_question"] = answer_key_items.get(last_viewed_test_q_detail_id, {}).get("question")
 
+    try:
+        saved_count = upsert_attempt_answers(attempt_id, answer_rows)
+        frappe.db.set_value("Test Attempt", attempt_id, attempt_updates)
+        frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        logger.error(f"Failed to autosave Test Attempt {attempt_id}: {e}", exc_info=True)
+        frappe.throw(_("Could not save progress. Please try again."))
+
+    return {"success": True, "seq": seq, "saved": saved_count}
+
+
+def query_user_attempts(user, test_id=None, limit=None, cursor=None):
+    """
+    One joined query for a user's attempt history, newest first, with the test
+    title and time taken computed in SQL. With `limit`, returns a keyset page
+    and sets the X-Next-Cursor response header for the following page.
+    """
+    params = {"user": user}
+    conditions = ""
+    if test_id:
+        conditions += " AND ta.test = %(test_id)s"
+        params["test_id"] = test_id
+    conditions += " " + keyset_condition("ta.start_time", "ta.name", cursor, params)
+
+    page_size = get_page_size(limit) if (limit or cursor) else None
+    limit_clause = f"LIMIT {page_size + 1}" if page_size else ""
+
+    attempts = frappe.db.sql(
+        f"""
+        SELECT ta.name AS id, ta.status, ta.final_score, ta.is_passed,
+               ta.start_time, ta.end_time, ta.test AS test_id, t.title AS test_title,
+               TIMESTAMPDIFF(SECOND, ta.start_time, ta.end_time) AS time_taken_seconds
+        FROM `tabTest Attempt` ta
+        LEFT JOIN `tabTest` t ON t.name = ta.test
+        WHERE ta.user = %(user)s {conditions}
+        ORDER BY ta.start_time DESC, ta.name DESC
+        {limit_clause}
+        """,
+        params,
+        as_dict=True,
+    )
+
+    if page_size:
+        next_cursor = get_next_cursor(attempts, page_size, "start_time", "id")
+        attempts = attempts[:page_size]
+        if next_cursor:
+            set_response_header("X-Next-Cursor", next_cursor)
+    return attempts
+
+
+@frappe.whitelist()
+def get_user_attempts_for_test(test_id, limit=None, cursor=None):
+    """
+    Attempts of the current user for one test, newest first.
+    Pass `limit` (and the X-Next-Cursor header value as `cursor`) to page.
+    """
+    user = get_current_user()
+    attempts = query_user_attempts(user, test_id=test_id, limit=limit, cursor=cursor)
     for attempt in attempts:
-        attempt["time_taken_seconds"] = None
-        if attempt.start_time and attempt.end_time:
-            start = get_datetime(attempt.start_time)
-            end = get_datetime(attempt.end_time)
-            attempt["time_taken_seconds"] = time_diff_in_seconds(end, start)
+        attempt.pop("test_id", None)
+        attempt.pop("test_title", None)
     return attempts
 
 
 @frappe.whitelist()
-def get_user_attempts_for_all_tests():
+def get_user_attempts_for_all_tests(limit=None, cursor=None):
     """
     Get all test attempts for the current user across all tests
     
+    Args:
+        limit (int, optional): Page size; without it every attempt is returned
+        cursor (str, optional): X-Next-Cursor header value of the previous page
+
     Returns:
         list: List of test attempts with associated test information
     """
     user = get_current_user()
+    attempts = query_user_attempts(user, limit=limit, cursor=cursor)
+    for attempt in attempts:
+        if attempt.test_id and not attempt.test_title:
+            attempt["test_title"] = f"Test: {attempt.test_id}"
+    return attempts
 
-    attempts = frappe.get_list(
-        "Test Attempt",
-        filters={"user": user},
-        fields=[
-            "name as id", 
-            "status",
-            "final_score",
-            "is_passed",
-            "start_time",
-            "end_time",
-            "test as test_id"
-        ],
-        order_by="start_time desc"
-    )
 
-    for attempt in attempts:
-        # Calculate time taken
-        attempt["time_taken_seconds"] = None
-        if attempt.start_time and attempt.end_time:
-            start = get_datetime(attempt.start_time)
-            end = get_datetime(attempt.end_time)
-            attempt["time_taken_seconds"] = time_diff_in_seconds(end, start)
-        
-        # Get test title
-        if attempt.test_id:
-            try:
-                test_title = frappe.get_value("Test", attempt.test_id, "title")
-                attempt["test_title"] = test_title
-            except:
-                attempt["test_title"] = f"Test: {attempt.test_id}"
+# Results of attempts in these statuses never change without the attempt's
+# `modified` changing too, so they're cached under (attempt, modified).
+RESULT_CACHE_STATUSES = ("Completed", "Graded")
+RESULT_CACHE_PREFIX = "elearning:attempt_result"
+RESULT_CACHE_TTL = 7 * 24 * 60 * 60
+RESULT_VIEWS = ("detail", "summary")
 
-    return attempts
 
+def clear_attempt_result_cache(doc, method=None):
+    """
+    doc_events hook for Rubric Score Item: rubric scores are standalone docs,
+    so saving one doesn't touch the attempt's `modified`; drop every cached
+    result of the attempt the scored answer belongs to.
+    """
+    answer_item = doc.get("attempt_answer_item_link")
+    attempt_id = answer_item and frappe.db.get_value("Attempt Answer Item", answer_item, "parent")
+    if attempt_id:
+        frappe.cache().delete_keys(f"{RESULT_CACHE_PREFIX}:{attempt_id}:")
 
-@frappe.whitelist()
-def get_attempt_result_details(attempt_id):
-    user = get_current_user()
-    logger = frappe.logger("get_attempt_result_details")
-    
-    try:
-        attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
-        logger.info(f"Fetched Test Attempt: {attempt_doc.name}, Status: {attempt_doc.status}")
-    except frappe.DoesNotExistError:
-        logger.error(f"Test Attempt {attempt_id} not found.")
-        frappe.throw(_("Test Attempt {0} not found.").format(attempt_id), frappe.DoesNotExistError)
 
-    if hasattr(attempt_doc, 'user') and attempt_doc.user != user:
-        logger.warning(f"Permission denied for user {user} on Test Attempt {attempt_id} owned by {attempt_doc.user}.")
-        frappe.throw(_("You are not permitted to view results for this attempt."), frappe.PermissionError)
+def get_snapshot_result_sources(attempt):
+    """
+    (test_items, questions, options_by_question, rubric_by_question) of the
+    snapshot an attempt was taken on, in the shapes build_attempt_result reads
+    from the live tables; None when the attempt isn't pinned to a full snapshot.
+    """
+    payload = get_test_snapshot(attempt.test, attempt.get("snapshot_version"))
+    answer_key = get_snapshot_answer_key(attempt.test, attempt.get("snapshot_version"))
+    if not payload or not answer_key:
+        return None
+
+    test_items, questions, options_by_question, rubric_by_question = [], {}, {}, {}
+    for q in payload["questions"]:
+        key_item = answer_key["items"].get(q["test_question_detail_id"]) or {}
+        test_items.append(frappe._dict(
+            name=q["test_question_detail_id"], question=q["question_id"], points=q["point_value"], idx=q["question_order"]
+        ))
+        if not key_item.get("question_type"):
+            continue
+        questions[q["question_id"]] = frappe._dict(
+            name=q["question_id"], content=q["content"], question_type=q["question_type"], marks=key_item["points"],
+            image_url=q["image"], hint=q["hint"], answer_key=key_item.get("answer_key_text"),
+            explanation=key_item.get("explanation"),
+        )
+        options_by_question[q["question_id"]] = [
+            frappe._dict(name=option["id"], option_text=option["text"], is_correct=option["id"] == key_item.get("correct_option"))
+            for option in q["options"] or []
+        ]
+        rubric_by_question[q["question_id"]] = key_item.get("rubric") or []
+    return test_items, questions, options_by_question, rubric_by_question
 
-    valid_result_statuses = ["Completed", "Graded", "To be graded", "Timed Out"]
-    if attempt_doc.status not in valid_result_statuses:
-        logger.info(f"Results cannot be displayed for attempt {attempt_id} with status: {attempt_doc.status}.")
-        frappe.throw(_("Results are not available for this attempt status ({0}).").format(attempt_doc.status), frappe.ValidationError)
 
-    try:
-        test_doc = frappe.get_cached_doc("Test", attempt_doc.test)
-    except frappe.DoesNotExistError:
-        logger.error(f"Associated Test {attempt_doc.test} for Attempt {attempt_id} not found.")
+def build_attempt_result(attempt):
+    """
+    Build the result payload of an attempt from a fixed number of bulk queries:
+    answers, answer images, test questions, questions, options, rubric items and
+    rubric scores - independent of the number of questions.
+    """
+    test_meta = frappe.get_cached_value("Test", attempt.test, ["name", "title", "passing_score"], as_dict=True)
+    if not test_meta:
         frappe.throw(_("Associated Test not found."), frappe.DoesNotExistError)
 
-    student_answer_item_doc_map = {ans.test_question_item: ans for ans in attempt_doc.answers if ans.test_question_item}
-    logger.debug(f"Attempt answers map (keys): {list(student_answer_item_doc_map.keys())}")
+    answers = frappe.get_all(
+        "Attempt Answer Item",
+        filters={"parent": attempt.name, "parenttype": "Test Attempt", "parentfield": "answers"},
+        fields=["name", "test_question_item", "user_answer", "is_correct", "points_awarded",
+                "time_spent_seconds", "ai_score", "ai_feedback"],
+        order_by="idx asc",
+    )
+    answer_by_tqi = {ans.test_question_item: ans for ans in answers if ans.test_question_item}
+    answer_names = [ans.name for ans in answers]
+
+    images_by_answer = {}
+    rubric_scores_by_answer = {}
+    if answer_names:
+        for img_row in frappe.get_all(
+            "Answer Image",
+            filters={"parent": ["in", answer_names], "parenttype": "Attempt Answer Item"},
+            fields=["parent", "image"],
+            order_by="idx asc",
+        ):
+            if img_row.image:
+                images_by_answer.setdefault(img_row.parent, []).append({
+                    "url": img_row.image,
+                    "name": img_row.image.split('/')[-1]
+                })
+        for rsi_entry in frappe.get_all(
+            "Rubric Score Item",
+            filters={"attempt_answer_item_link": ["in", answer_names]},
+            fields=["name", "rubric_item", "points_awarded", "comment", "attempt_answer_item_link"],
+            order_by="creation asc",
+        ):
+            rubric_scores_by_answer.setdefault(rsi_entry.attempt_answer_item_link, []).append(rsi_entry)
+
+    snapshot_sources = get_snapshot_result_sources(attempt)
+    if snapshot_sources:
+        test_items, questions, options_by_question, rubric_by_question = snapshot_sources
+    else:
+        test_items = get_test_question_items(attempt.test)
+        questions = get_questions_by_name([item.question for item in test_items if item.question])
+        options_by_question = get_options_by_question(
+            [name for name, q in questions.items() if q.question_type == "Multiple Choice"]
+        )
+        rubric_by_question = get_rubric_items_by_question(
+            [name for name, q in questions.items() if q.question_type == "Essay"]
+        )
+    rubric_info = {ri["id"]: ri for items in rubric_by_question.values() for ri in items}
 
     processed_questions_answers = []
     total_possible_score_from_test = 0
+    has_essay_question = False
 
-    LINK_FIELD_IN_RUBRIC_SCORE_ITEM_TO_AAI = "attempt_answer_item_link" # <<< THAY THẾ NẾU CẦN
-
-    for tqd_item in test_doc.questions:
-        test_question_item_id = tqd_item.name
-        base_question_id = tqd_item.question
-        try:
-            question_doc = frappe.get_doc("Question", base_question_id)
-            print(f"DEBUG_QUESTION_DOC for Q_ID {base_question_id}: {question_doc.as_dict()}")
-            marks_in_question = getattr(question_doc, 'marks', 1)
-        except frappe.DoesNotExistError:
-            marks_in_question = 0
-        total_possible_score_from_test += marks_in_question
-
-        question_db_details = {}
+    for tqd_item in test_items:
+        question = questions.get(tqd_item.question)
         question_frontend_options = []
-        # question_original_rubric = [] # Biến này có thể vẫn hữu ích để hiển thị rubric gốc
-
-        try:
-            question_doc = frappe.get_doc("Question", base_question_id)
-            question_db_details = {
-                'content': question_doc.content,
-                'question_type': question_doc.question_type,
-                'marks': question_doc.marks,
-                'explanation': question_doc.explanation,
-                'hint': getattr(question_doc, 'hint', None),
-                'question_image_url': getattr(question_doc, 'image_url', None) or getattr(question_doc, 'image', None)
-            }
-            if question_doc.question_type == "Multiple Choice":
+        if question:
+            marks_in_question = question.marks or 1
+            if question.question_type == "Multiple Choice":
                 correct_option_id = None
-                for opt_idx, option_row in enumerate(question_doc.options or []):
+                for opt_idx, option_row in enumerate(options_by_question.get(question.name, [])):
                     question_frontend_options.append({
                         "id": option_row.name, "text": option_row.option_text, "label": chr(65 + opt_idx)
                     })
-                    if option_row.is_correct: correct_option_id = option_row.name
-                question_db_details['answer_key_display'] = correct_option_id
-            elif question_doc.question_type == "Essay":
-                # Vẫn lấy rubric gốc để hiển thị nếu cần
-                rubric_items_raw = frappe.get_all("Rubric Item",
-                    filters={"parent": question_doc.name, "parenttype": "Question"},
-                    fields=["name", "description", "max_score", "step_order"], order_by="step_order asc")
-                question_original_rubric_for_display = [{"id": ri.name, "description": ri.description, "max_score": ri.max_score, "step_order": ri.step_order} for ri in rubric_items_raw]
-                question_db_details['answer_key_display'] = question_original_rubric_for_display # Hoặc một cách hiển thị khác
+                    if option_row.is_correct:
+                        correct_option_id = option_row.name
+                answer_key_display = correct_option_id
+            elif question.question_type == "Essay":
+                answer_key_display = rubric_by_question.get(question.name, [])
             else:
-                question_db_details['answer_key_display'] = question_doc.answer_key
-        except frappe.DoesNotExistError:
-            logger.error(f"Base Question Doc {base_question_id} not found for TQI {test_question_item_id}")
-            question_db_details.update({'content': _("Error: Question content not found."), 'question_type': "Unknown", 'marks': 0})
-
-        student_answer_doc = student_answer_item_doc_map.get(test_question_item_id)
-        
-        student_submitted_images_list = []
-        ai_rubric_scores_list = [] # Đây sẽ là danh sách điểm rubric đã được chấm cho câu trả lời này
-        has_essay_question = False
-        if student_answer_doc:
-            for img_row in getattr(student_answer_doc, "answer_images", []):
-                if img_row.image:
-                    student_submitted_images_list.append({
-                        "url": img_row.image,
-                        "name": img_row.image.split('/')[-1]
-                    })
-         
-            if question_db_details.get('question_type') == "Essay":
-                try:
-                    has_essay_question = True
-                    # Truy vấn các bản ghi Rubric Score Item độc lập liên quan đến student_answer_doc (AttemptAnswerItem) này
-                    standalone_rsi_docs = frappe.get_all(
-                        "Rubric Score Item", # Tên Doctype Rubric Score Item độc lập của bạn
-                        filters={LINK_FIELD_IN_RUBRIC_SCORE_ITEM_TO_AAI: student_answer_doc.name},
-                        fields=["name", "rubric_item", "points_awarded", "comment"] # Các trường bạn muốn lấy
-                        # bạn có thể thêm 'order_by' nếu cần, ví dụ theo 'creation' hoặc một trường thứ tự nào đó
-                    )
-
-                    for rsi_entry in standalone_rsi_docs:
-                        base_rubric_info = {}
-                        try:
-                            # rsi_entry.rubric_item là link đến Rubric Item gốc (định nghĩa tiêu chí)
-                            base_rubric_doc = frappe.get_cached_doc("Rubric Item", rsi_entry.rubric_item)
-                            base_rubric_info = {
-                                "description": base_rubric_doc.description, # Mô tả của tiêu chí gốc
-                                "criterion_max_score": base_rubric_doc.max_score # Điểm tối đa của tiêu chí gốc
-                            }
-                        except Exception as e_rubric_fetch:
-                            logger.warning(f"Could not fetch base Rubric Item {rsi_entry.rubric_item} for standalone RSI {rsi_entry.name}: {e_rubric_fetch}")
-
-                        ai_rubric_scores_list.append({
-                            "rubric_score_item_doc_name": rsi_entry.name, # ID của bản ghi Rubric Score Item độc lập
-                            "rubric_item_id": rsi_entry.rubric_item, # ID của Rubric Item gốc (tiêu chí)
-                            "criterion_description": base_rubric_info.get("description"),
-                            "criterion_max_score": base_rubric_info.get("criterion_max_score"),
-                            "points_awarded_by_ai": rsi_entry.points_awarded, # Điểm được chấm
-                            "ai_comment": rsi_entry.comment # Nhận xét
-                        })
-                    logger.info(f"Fetched {len(ai_rubric_scores_list)} standalone Rubric Score Items for AAI {student_answer_doc.name}")
-                except Exception as e_fetch_rsi:
-                    logger.error(f"Error fetching standalone Rubric Score Items for AAI {student_answer_doc.name}: {e_fetch_rsi}", exc_info=True)
+                answer_key_display = question.answer_key
         else:
-            logger.warning(f"No student answer document found in map for Test Q Item '{test_question_item_id}'.")
+            logger.error(f"Base Question Doc {tqd_item.question} not found for TQI {tqd_item.name}")
+            marks_in_question = 0
+            answer_key_display = None
+        total_possible_score_from_test += marks_in_question
+        question_type = question.question_type if question else "Unknown"
+
+        student_answer = answer_by_tqi.get(tqd_item.name)
+        ai_rubric_scores_list = []
+        if student_answer and question_type == "Essay":
+            has_essay_question = True
+            for rsi_entry in rubric_scores_by_answer.get(student_answer.name, []):
+                base_rubric_info = rubric_info.get(rsi_entry.rubric_item, {})
+                ai_rubric_scores_list.append({
+                    "rubric_score_item_doc_name": rsi_entry.name,
+                    "rubric_item_id": rsi_entry.rubric_item,
+                    "criterion_description": base_rubric_info.get("description"),
+                    "criterion_max_score": base_rubric_info.get("max_score"),
+                    "points_awarded_by_ai": rsi_entry.points_awarded,
+                    "ai_comment": rsi_entry.comment
+                })
 
         processed_questions_answers.append({
-            "q_id": base_question_id,
-            "test_question_id": test_question_item_id,
-            "q_content": question_db_details.get('content'),
-            "q_type": question_db_details.get('question_type'),
-            "q_marks": question_db_details.get('marks'),
-            "q_image_url": question_db_details.get('question_image_url'),
+            "q_id": tqd_item.question,
+            "test_question_id": tqd_item.name,
+            "q_content": question.content if question else _("Error: Question content not found."),
+            "q_type": question_type,
+            "q_marks": question.marks if question else 0,
+            "q_image_url": question.image_url if question else None,
             "options": question_frontend_options,
-            "answer_key_display": question_db_details.get('answer_key_display'), # Có thể chứa rubric gốc cho Essay
-            "explanation": question_db_details.get('explanation'),
-            "hint": question_db_details.get('hint'),
-            
-            "user_answer_text": student_answer_doc.user_answer if student_answer_doc else None,
-            "user_submitted_images": student_submitted_images_list,
-            
-            "is_correct": student_answer_doc.is_correct if student_answer_doc else None,
-            "points_awarded_final": student_answer_doc.points_awarded if student_answer_doc else 0,
+            "answer_key_display": answer_key_display,  # Có thể chứa rubric gốc cho Essay
+            "explanation": question.explanation if question else None,
+            "hint": question.hint if question else None,
+
+            "user_answer_text": student_answer.user_answer if student_answer else None,
+            "user_submitted_images": images_by_answer.get(student_answer.name, []) if student_answer else [],
+
+            "is_correct": student_answer.is_correct if student_answer else None,
+            "points_awarded_final": student_answer.points_awarded if student_answer else 0,
             "point_value_in_test": marks_in_question,
-            "time_spent_seconds": student_answer_doc.time_spent_seconds if student_answer_doc else None,
-            
-            "ai_total_score_for_question": getattr(student_answer_doc, 'ai_score', None) if student_answer_doc else None,
-            "ai_overall_feedback_for_question": getattr(student_answer_doc, 'ai_feedback', None) if student_answer_doc else None,
-            "ai_rubric_scores": ai_rubric_scores_list # Danh sách này giờ được điền từ các bản ghi độc lập
+            "time_spent_seconds": student_answer.time_spent_seconds if student_answer else None,
+
+            "ai_total_score_for_question": student_answer.ai_score if student_answer else None,
+            "ai_overall_feedback_for_question": student_answer.ai_feedback if student_answer else None,
+            "ai_rubric_scores": ai_rubric_scores_list
         })
 
     time_taken_seconds_val = None
-    if attempt_doc.start_time and attempt_doc.end_time:
-        time_taken_seconds_val = time_diff_in_seconds(get_datetime(attempt_doc.end_time), get_datetime(attempt_doc.start_time))
+    if attempt.start_time and attempt.end_time:
+        time_taken_seconds_val = time_diff_in_seconds(get_datetime(attempt.end_time), get_datetime(attempt.start_time))
 
-    result_payload = {
+    return {
         "attempt": {
-            "id": attempt_doc.name, "status": attempt_doc.status, "score": attempt_doc.final_score,
-            "passed": attempt_doc.is_passed, "start_time": attempt_doc.start_time,
-            "end_time": attempt_doc.end_time, "time_taken_seconds": time_taken_seconds_val,
+            "id": attempt.name, "status": attempt.status, "score": attempt.final_score,
+            "passed": attempt.is_passed, "start_time": attempt.start_time,
+            "end_time": attempt.end_time, "time_taken_seconds": time_taken_seconds_val,
         },
         "test": {
-            "id": test_doc.name, "title": test_doc.title,
-            "passing_score_threshold": test_doc.passing_score,
+            "id": test_meta.name, "title": test_meta.title,
+            "passing_score_threshold": test_meta.passing_score,
             "total_possible_score": total_possible_score_from_test,
             "has_essay_question": has_essay_question,
         },
         "questions_answers": processed_questions_answers,
-        "overall_feedback_from_llm": getattr(attempt_doc, 'feedback', None),
-        "overall_recommendation_from_llm": getattr(attempt_doc, 'recommendation', None),
+        "overall_feedback_from_llm": attempt.feedback,
+        "overall_recommendation_from_llm": attempt.recommendation,
+        "summary_status": attempt.summary_status,
     }
-    logger.info(f"Finished processing results for attempt {attempt_id}. Returning {len(processed_questions_answers)} Q&A details.")
-    return result_payload
 
-def extract_json_from_markdown(text):
+
+def select_result_view(result_payload, view="detail", fields=None):
+    """
+    Project a result payload for the caller:
+    view="summary" drops questions_answers (list pages), view="detail" keeps them,
+    optionally reduced to the question-level keys in `fields`.
+    """
+    if view == "summary":
+        return {k: v for k, v in result_payload.items() if k != "questions_answers"}
+    if not fields:
+        return result_payload
+    wanted = set(fields) | {"test_question_id"}
+    projected = dict(result_payload)
+    projected["questions_answers"] = [
+        {k: v for k, v in qa.items() if k in wanted} for qa in result_payload["questions_answers"]
+    ]
+    return projected
+
+
+@frappe.whitelist()
+def get_attempt_result_details(attempt_id, view="detail", fields=None):
     """
-    Extract JSON from Markdown-style code blocks, handling case sensitivity and whitespace.
-    Returns cleaned JSON string or original text if no match.
+    Result page data of an attempt.
+
+    Args:
+        view (str): "detail" (default, with questions_answers) or "summary"
+        fields (str|list, optional): question-level keys to keep in detail view
+            (JSON list or comma separated), e.g. "q_content,user_answer_text,is_correct"
     """
-    # Match code blocks with optional 'json' (case-insensitive)
-    markdown_match = re.search(
-        r"^\s*```(?:json\s+)?([\s\S]+?)\s*```\s*$", 
-        text, 
-        re.IGNORECASE | re.MULTILINE
+    user = get_current_user()
+    logger = frappe.logger("get_attempt_result_details")
+
+    if view not in RESULT_VIEWS:
+        frappe.throw(_("Invalid view {0}.").format(view), frappe.ValidationError)
+    if isinstance(fields, str):
+        fields = json.loads(fields) if fields.strip().startswith("[") else [f.strip() for f in fields.split(",") if f.strip()]
+
+    attempt = frappe.db.get_value(
+        "Test Attempt",
+        attempt_id,
+        ["name", "user", "test", "snapshot_version", "status", "final_score", "is_passed", "start_time", "end_time",
+         "feedback", "recommendation", "summary_status", "modified"],
+        as_dict=True,
     )
-    
-    if markdown_match:
-        # If found in code block, use the inner content
-        return markdown_match.group(1).strip()
-    else:
-        # Otherwise, use the full text
-        return text.strip()
+    if not attempt:
+        logger.error(f"Test Attempt {attempt_id} not found.")
+        frappe.throw(_("Test Attempt {0} not found.").format(attempt_id), frappe.DoesNotExistError)
+
+    if attempt.user != user:
+        logger.warning(f"Permission denied for user {user} on Test Attempt {attempt_id} owned by {attempt.user}.")
+        frappe.throw(_("You are not permitted to view results for this attempt."), frappe.PermissionError)
+
+    valid_result_statuses = ["Completed", "Graded", "To be graded", "Timed Out"]
+    if attempt.status not in valid_result_statuses:
+        logger.info(f"Results cannot be displayed for attempt {attempt_id} with status: {attempt.status}.")
+        frappe.throw(_("Results are not available for this attempt status ({0}).").format(attempt.status), frappe.ValidationError)
+
+    if attempt.status not in RESULT_CACHE_STATUSES:
+        return select_result_view(build_attempt_result(attempt), view, fields)
+
+    cache_key = f"{RESULT_CACHE_PREFIX}:{attempt.name}:{attempt.modified}"
+    result_payload = frappe.cache().get_value(cache_key)
+    if not result_payload:
+        result_payload = build_attempt_result(attempt)
+        frappe.cache().set_value(cache_key, result_payload, expires_in_sec=RESULT_CACHE_TTL)
+    return select_result_view(result_payload, view, fields)
+
+SUMMARY_STATUSES = ("Completed", "Graded")
+# Failed summaries are retried by retry_failed_attempt_summaries up to this many runs in total
+MAX_SUMMARY_ATTEMPTS = 5
+# Gemini JSON-mode schema of the attempt summary
+ATTEMPT_SUMMARY_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "feedback": {"type": "STRING"},
+        "recommendation": {"type": "STRING"},
+    },
+    "required": ["feedback", "recommendation"],
+}
+
+
+def enqueue_attempt_summary(attempt_id):
+    """
+    Queue the LLM summary (feedback + recommendation) of a finished attempt.
+    job_id makes repeated calls for the same attempt collapse into one queued
+    job; the job only runs after the submitting transaction commits.
+    """
+    frappe.enqueue(
+        "elearning.elearning.doctype.test_attempt.test_attempt.generate_attempt_summary_job",
+        queue="long",
+        job_id=f"attempt_summary::{attempt_id}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        attempt_id=attempt_id,
+    )
+
+
+def generate_attempt_summary_job(attempt_id):
+    """
+    Background job: build the summary of `attempt_id` and push it to the
+    student as a summary_ready attempt event. Attempts with essays still
+    "To be graded" are skipped; TestAttempt.on_update queues the job again
+    once they're graded. A failed summary leaves feedback empty and is
+    retried by retry_failed_attempt_summaries.
+    """
+    job_logger = frappe.logger("llm_feedback_generation")
+    attempt = frappe.db.get_value(
+        "Test Attempt", attempt_id, ["name", "user", "status", "feedback", "summary_status", "summary_attempts"], as_dict=True
+    )
+    if not attempt:
+        return
+    if attempt.status not in SUMMARY_STATUSES:
+        job_logger.info(f"Attempt {attempt_id} is {attempt.status}, summary deferred until grading finishes.")
+        return
+    if attempt.feedback and attempt.summary_status == "Ready":
+        return
+
+    attempt_doc = frappe.get_doc("Test Attempt", attempt_id)
+    feedback, recommendation, ok = generate_feedback_with_llm(attempt_doc)
+
+    # set_value bumps `modified`, so the cached result of this attempt is rebuilt.
+    # On failure `feedback` is the error message: shown to the student, never stored.
+    frappe.db.set_value("Test Attempt", attempt_id, {
+        "feedback": feedback if ok else None,
+        "recommendation": recommendation if ok else None,
+        "summary_status": "Ready" if ok else "Failed",
+        "summary_attempts": cint(attempt.summary_attempts) + 1,
+    })
+    publish_attempt_event("Test Attempt", attempt_id, attempt.user, "summary_ready", {
+        "summaryStatus": "Ready" if ok else "Failed",
+        "feedback": feedback if ok else None,
+        "recommendation": recommendation if ok else None,
+        "error": None if ok else feedback,
+    })
+    frappe.db.commit()
+
+
+def retry_failed_attempt_summaries(limit=100):
+    """Scheduled: queue the summary again for Failed ones, while Gemini is reachable"""
+    if get_state(BREAKER_NAME) != CLOSED:
+        return
+    failed = frappe.get_all(
+        "Test Attempt",
+        filters={
+            "summary_status": "Failed",
+            "status": ["in", SUMMARY_STATUSES],
+            "summary_attempts": ["<", MAX_SUMMARY_ATTEMPTS],
+        },
+        pluck="name",
+        order_by="modified asc",
+        limit=limit,
+    )
+    for attempt_id in failed:
+        enqueue_attempt_summary(attempt_id)
+    if failed:
+        frappe.logger("llm_feedback_generation").info(f"Queued {len(failed)} failed attempt summaries for retry.")
+
+
+def generate_feedback_with_llm(attempt_doc):
+    """
+    Ask Gemini for the overall feedback and recommendation of a graded attempt.
+    Question content/type come from the attempt's answer key instead of one
+    Question load per answer.
 
-def generate_and_save_feedback_with_llm(attempt_doc):
-    logger = frappe.logger("llm_feedback_generation") # Đổi tên logger cho rõ ràng hơn
+    Returns:
+        tuple: (feedback, recommendation, ok)
+    """
+    logger = frappe.logger("llm_feedback_generation")
     try:
+        answer_key_items = get_attempt_answer_key(attempt_doc)["items"] if attempt_doc.test else {}
+
         questions_and_answers = []
         for ans in attempt_doc.answers: # ans là một Attempt Answer Item document
-            question_content = None
-            question_type_from_linked_doc = None # Loại câu hỏi lấy từ Question gốc
-
-            if ans.question: # ans.question là link đến Question Doctype
-                try:
-                    question_doc = frappe.get_doc("Question", ans.question)
-                    question_content = getattr(question_doc, "content", _("Nội dung câu hỏi không có sẵn."))
-                    question_type_from_linked_doc = getattr(question_doc, "question_type", _("Không rõ loại"))
-                except frappe.DoesNotExistError:
-                    logger.warning(f"Không tìm thấy Question document {ans.question} được liên kết từ AttemptAnswerItem {ans.name}")
-                    question_content = _("Câu hỏi gốc không tìm thấy.")
-                    question_type_from_linked_doc = _("Không rõ loại")
-                except Exception as e:
-                    logger.warning(f"Lỗi khi tải nội dung/loại cho câu hỏi {ans.question}: {e}")
-                    question_content = _("Lỗi khi tải nội dung câu hỏi.")
-                    question_type_from_linked_doc = _("Không rõ loại")
-            else:
-                logger.warning(f"AttemptAnswerItem {ans.name} không có trường 'question' được liên kết.")
+            key_item = answer_key_items.get(ans.test_question_item) or {}
+            if not ans.question:
                 question_content = _("Câu hỏi không được liên kết.")
                 question_type_from_linked_doc = _("Không rõ loại")
+            elif key_item.get("question_type"):
+                question_content = key_item.get("content") or _("Nội dung câu hỏi không có sẵn.")
+                question_type_from_linked_doc = key_item["question_type"]
+            else:
+                logger.warning(f"Không tìm thấy Question {ans.question} được liên kết từ AttemptAnswerItem {ans.name}")
+                question_content = _("Câu hỏi gốc không tìm thấy.")
+                question_type_from_linked_doc = _("Không rõ loại")
 
             q_and_a_item = {
                 "ma_cau_hoi_goc": ans.question, # Link đến Question gốc
@@ -818,114 +1380,42 @@ def generate_and_save_feedback_with_llm(attempt_doc):
 
             # Thêm ai_feedback nếu là câu Essay và có thông tin
             if question_type_from_linked_doc == "Essay":
-                # Giả sử 'ai_feedback' là trường trong Attempt Answer Item chứa nhận xét của AI cho câu essay đó
-                q_and_a_item["nhan_xet_ai_cho_bai_luan"] = getattr(ans, 'ai_feedback', _("Không có nhận xét tự động cho bài luận này."))
-            
+                q_and_a_item["nhan_xet_ai_cho_bai_luan"] = getattr(ans, 'ai_feedback', None) or _("Không có nhận xét tự động cho bài luận này.")
+
             questions_and_answers.append(q_and_a_item)
 
         llm_payload = {
             "chi_tiet_bai_lam": questions_and_answers,
             "diem_so_tong_cong": attempt_doc.final_score,
-            # Bạn có thể thêm các thông tin tổng quan khác của attempt_doc nếu cần
         }
 
-        # Prompt bằng tiếng Việt
-        prompt = (
-            "Dựa trên chi tiết bài làm kiểm tra của học sinh dưới đây, bao gồm nội dung câu hỏi, câu trả lời của học sinh, "
-            "kết quả đúng/sai, điểm số đạt được, và đặc biệt là các 'nhan_xet_ai_cho_bai_luan' (nếu có) đối với các câu hỏi tự luận. "
-            "Hãy thực hiện những yêu cầu sau:\n"
-            "1. Phân tích tổng quan về hiệu suất của học sinh. Chú ý đến các chủ đề kiến thức hoặc dạng câu hỏi mà học sinh làm tốt hoặc chưa tốt "
-            "(ví dụ: giải phương trình, đọc hiểu, trắc nghiệm lý thuyết, bài luận về chủ đề X,...). "
-            "Bỏ qua những câu hỏi không được trả lời (có 'cau_tra_loi_hoc_sinh' là null hoặc rỗng) khi đánh giá điểm yếu.\n"
-            "2. Xác định những điểm mạnh và những lĩnh vực kiến thức hoặc kỹ năng còn yếu mà học sinh cần cải thiện.\n"
-            "3. Đưa ra một 'nhận xét tổng quát' (feedback) mang tính xây dựng, tập trung vào những điểm yếu chính.\n"
-            "4. Đề xuất một 'kế hoạch cải thiện' (recommendation) cụ thể, bao gồm các gợi ý về cách học tập hoặc ôn luyện để cải thiện những điểm yếu đó.\n"
-            "Vui lòng trả lời bằng JSON, bằng tiếng Việt, theo định dạng sau:\n"
-            "{\n"
-            "  \"feedback\": \"(Nhận xét tổng quát của bạn về bài làm...)\",\n"
-            "  \"recommendation\": \"(Kế hoạch và đề xuất cải thiện cho học sinh...)\"\n"
-            "}\n\n"
-            f"Dữ liệu bài làm của học sinh: {json.dumps(llm_payload, ensure_ascii=False, indent=2)}"
-        )
-        print(f"Generated prompt for LLM (attempt {attempt_doc.name}): {prompt[:500]}...") # Log một phần prompt
-
+        # Chỉ gửi dữ liệu bài làm, phần hướng dẫn là prompt template "attempt_summary"
+        prompt = f"Dữ liệu bài làm của học sinh: {json.dumps(llm_payload, ensure_ascii=False, indent=2)}"
 
-        api_key = frappe.conf.get("gemini_api_key") or os.environ.get("GEMINI_API_KEY")
+        api_key = get_api_key()
         if not api_key:
             logger.error("Gemini API key not found in site config or environment variable.")
-            attempt_doc.feedback = _("Lỗi hệ thống: Không thể tạo nhận xét tự động do thiếu cấu hình API.")
-            attempt_doc.save(ignore_permissions=True)
-            frappe.db.commit()
-            return
-        
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-        
-        response = requests.post(
-            api_url,
-            json={"contents": [{"parts": [{"text": prompt}]}]},
-            timeout=30 # Tăng timeout nếu cần cho các prompt dài
-        )
-
-        if response.ok:
-            llm_result = response.json()
-            logger.debug(f"LLM raw response: {json.dumps(llm_result, ensure_ascii=False)}")
-            
-            text_candidate_from_llm = ""
-            try:
-                text_candidate_from_llm = llm_result["candidates"][0]["content"]["parts"][0]["text"]
-            except (IndexError, KeyError, TypeError) as e:
-                logger.error(f"Could not extract text from LLM response structure: {e}. Response: {llm_result}")
-                attempt_doc.feedback = _("Lỗi hệ thống: Không thể xử lý phản hồi từ AI để tạo nhận xét.")
-                attempt_doc.save(ignore_permissions=True)
-                frappe.db.commit()
-                return
-
-            json_extracted_from_markdown = extract_json_from_markdown(text_candidate_from_llm) # type: ignore
-            feedback_data = None
-
-            try:
-                logger.debug(f"Attempting to parse JSON from extracted markdown: {repr(json_extracted_from_markdown)}")
-                feedback_data = json.loads(json_extracted_from_markdown)
-            except json.JSONDecodeError as e:
-                logger.warning(f"JSON parse failed for extracted markdown content. Attempting raw text candidate. Error: {e}")
-                try:
-                    logger.debug(f"Attempting to parse raw text candidate from LLM: {repr(text_candidate_from_llm)}")
-                    feedback_data = json.loads(text_candidate_from_llm)
-                except json.JSONDecodeError as e2:
-                    logger.error(f"Final JSON parse failed for LLM response. Error: {e2}. Raw text was: {repr(text_candidate_from_llm)}")
-                    # Nếu không parse được JSON, có thể lưu toàn bộ text vào feedback để xem lại
-                    feedback_data = {"feedback": _("AI đã phản hồi, nhưng có lỗi khi xử lý định dạng JSON. Nội dung gốc: ") + text_candidate_from_llm, "recommendation": ""}
-
-
-            if feedback_data and isinstance(feedback_data, dict):
-                attempt_doc.feedback = feedback_data.get("feedback", _("Không có nhận xét chi tiết."))
-                attempt_doc.recommendation = feedback_data.get("recommendation", _("Không có đề xuất cụ thể."))
-            elif isinstance(text_candidate_from_llm, str) and text_candidate_from_llm.strip(): # Nếu không có feedback_data nhưng có text
-                 attempt_doc.feedback = text_candidate_from_llm
-                 attempt_doc.recommendation = _("Vui lòng xem nhận xét chi tiết ở trên.")
-            else: # Không có gì cả
-                attempt_doc.feedback = _("Không thể tạo nhận xét tự động vào lúc này.")
-                attempt_doc.recommendation = None
-
+            return _("Lỗi hệ thống: Không thể tạo nhận xét tự động do thiếu cấu hình API."), None, False
 
-            attempt_doc.save(ignore_permissions=True)
-            frappe.db.commit()
-            logger.info(f"Successfully generated and saved LLM feedback for attempt {attempt_doc.name}")
+        try:
+            summary = generate_json_with_template(
+                {"contents": [{"parts": [{"text": prompt}]}]}, ATTEMPT_SUMMARY_SCHEMA, "attempt_summary", api_key=api_key
+            )
+        except GeminiUnavailableError:
+            logger.warning(f"Gemini circuit open, no LLM summary for attempt {attempt_doc.name}")
+            return _("Dịch vụ AI đang quá tải, nhận xét tự động tạm thời chưa có."), None, False
+        except GeminiSchemaError as e:
+            logger.error(f"LLM summary for attempt {attempt_doc.name} doesn't match the schema: {e}. Raw: {e.body}")
+            return _("Lỗi hệ thống: Không thể xử lý phản hồi từ AI để tạo nhận xét."), None, False
+        except GeminiError as e:
+            logger.warning(f"Gemini API call failed: {e.status_code} - {e.body}")
+            return _("Lỗi khi giao tiếp với dịch vụ AI để tạo nhận xét."), None, False
+
+        feedback = summary["feedback"] or _("Không có nhận xét chi tiết.")
+        recommendation = summary["recommendation"] or _("Không có đề xuất cụ thể.")
+        logger.info(f"Generated LLM feedback for attempt {attempt_doc.name}")
+        return feedback, recommendation, True
 
-        else:
-            logger.warning(f"Gemini API call failed: {response.status_code} - {response.text}")
-            attempt_doc.feedback = _("Lỗi khi giao tiếp với dịch vụ AI để tạo nhận xét.")
-            attempt_doc.save(ignore_permissions=True)
-            frappe.db.commit()
-            
     except Exception as e:
         logger.error(f"Critical error in LLM feedback generation for attempt {attempt_doc.name}: {e}", exc_info=True)
-        # Cân nhắc có nên cập nhật attempt_doc.feedback với thông báo lỗi ở đây không
-        try: # Cố gắng lưu lỗi vào attempt_doc nếu có thể
-            if frappe.db.exists("Test Attempt", attempt_doc.name): # Đảm bảo attempt_doc vẫn hợp lệ
-                doc_to_update = frappe.get_doc("Test Attempt", attempt_doc.name)
-                doc_to_update.feedback = _("Đã xảy ra lỗi nghiêm trọng trong quá trình tạo nhận xét tự động.")
-                doc_to_update.save(ignore_permissions=True)
-                frappe.db.commit()
-        except Exception as e_save_err:
-            logger.error(f"Could not save error feedback to attempt {attempt_doc.name}: {e_save_err}")
\ No newline at end of file
+        return _("Đã xảy ra lỗi nghiêm trọng trong quá trình tạo nhận xét tự động."), None, False
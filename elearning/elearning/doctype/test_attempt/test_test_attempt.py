@@ -0,0 +1,39 @@
+# Copyright (c) 2026, Minh Quy and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from elearning.elearning.doctype.test_attempt.test_attempt import autosave_attempt_delta, save_attempt_progress
+
+
+class TestTestAttempt(FrappeTestCase):
+	def setUp(self):
+		test = frappe.get_doc({"doctype": "Test", "title": "_Test Timed Test", "time_limit_minutes": 30})
+		test.flags.ignore_mandatory = True
+		test.insert(ignore_permissions=True)
+
+		started = add_to_date(now_datetime(), minutes=-40)
+		self.attempt = frappe.get_doc({
+			"doctype": "Test Attempt",
+			"test": test.name,
+			"user": frappe.session.user,
+			"status": "In Progress",
+			"start_time": started,
+			"deadline": add_to_date(started, minutes=30),
+		}).insert(ignore_permissions=True)
+
+	def test_autosave_after_deadline_is_rejected(self):
+		delta = json.dumps({"seq": 1, "answers": {"any-question": {"userAnswer": "42"}}})
+		with self.assertRaises(frappe.ValidationError):
+			autosave_attempt_delta(self.attempt.name, delta)
+		self.assertFalse(frappe.db.get_value("Test Attempt", self.attempt.name, "autosave_seq"))
+
+	def test_save_progress_after_deadline_is_rejected(self):
+		progress = json.dumps({"answers": {"any-question": {"userAnswer": "42"}}})
+		with self.assertRaises(frappe.ValidationError):
+			save_attempt_progress(self.attempt.name, progress)
+		self.assertFalse(frappe.get_all("Attempt Answer Item", filters={"parent": self.attempt.name}))
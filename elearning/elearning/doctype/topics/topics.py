@@ -1,6 +1,8 @@
 import frappe
 from frappe.model.document import Document
 from frappe import _
+from elearning.api.api import respond_with_etag
+from elearning.elearning.utils.catalog_cache import get_cached_catalog
 
 def get_current_user():
     user = frappe.session.user
@@ -16,24 +18,20 @@ class Topics(Document):
 def find_all_active_topics():
     """
     Retrieves a list of all active topics, ordered by name.
+    Served from the catalog cache; supports If-None-Match / 304.
     """
-    user = get_current_user()
-    
-    if not user:
-        frappe.throw(_("Authentication required."), frappe.AuthenticationError)
-    else:
-        print(f"Authenticated user: {user}")
+    get_current_user()
 
     try:
-        topics_list = frappe.get_list(
+        catalog = get_cached_catalog("topics", "Topics", (), lambda: frappe.get_list(
             "Topics",
             filters={"is_active": 1},
             fields=["name", "topic_name", "grade_level", "description"], 
             order_by="name" 
-        )
+        ))
 
-        return topics_list
+        return respond_with_etag(catalog["data"], catalog["etag"])
 
     except Exception as e:
         frappe.log_error(f"Error fetching active topics: {e}", "Topic API Error")
-        frappe.throw(_("An error occurred while fetching topics."), exc=e)
\ No newline at end of file
+        frappe.throw(_("An error occurred while fetching topics."), exc=e)
@@ -7,10 +7,20 @@ from frappe.model.document import Document
 from frappe.utils import now_datetime, cint, flt, now, get_datetime, add_to_date
 import json
 import os
-import requests
 import time
-import re
 import random
+from elearning.elearning.utils.study_analytics import get_year_range
+from elearning.elearning.utils.pagination import keyset_condition, get_page_size, get_next_cursor
+from elearning.elearning.doctype.daily_study_rollup.daily_study_rollup import refresh_user_day
+from elearning.elearning.utils.attempt_events import publish_attempt_event
+from elearning.elearning.utils.local_grader import (
+	grade_flashcard_locally, build_local_feedback, get_confidence_threshold, to_plain_text
+)
+from elearning.elearning.utils.answer_clusters import find_cluster_feedback, add_to_cluster_index
+from elearning.elearning.utils.gemini_client import (
+	GeminiError, GeminiSchemaError, GeminiUnavailableError, get_api_key, with_json_schema, parse_json_response, extract_partial_json_strings
+)
+from elearning.elearning.utils.prompt_templates import generate_json_with_template, stream_with_template
 
 class UserExamAttempt(Document):
 	def __init__(self, *args, **kwargs):
@@ -45,14 +55,17 @@ class UserExamAttempt(Document):
 		# Log completion for analytics
 		frappe.logger().info(f"Exam completed: {self.name} by {self.user} for topic {self.topic}")
 		
-		# Get total number of questions for logging purposes
-		total_questions = frappe.db.count("User Exam Attempt Detail", {"parent": self.name})
-		frappe.logger().info(f"Total questions for attempt {self.name}: {total_questions}")
+		# Counters are maintained on write (update_attempt_counters), no need to recount here
+		frappe.logger().info(f"Total questions for attempt {self.name}: {self.total_questions}")
 	
 	def get_analytics(self):
 		"""Return analytics data for this attempt"""
 		analytics = {
-			"total_questions": len(self.attempt_details) if self.attempt_details else 0,
+			"total_questions": self.total_questions,
+			"answered": self.answered_count,
+			"correct": self.correct_count,
+			"skipped": self.skipped_count,
+			"assessed": self.assessed_count,
 			"completion_time": self.completion_timestamp,
 			"topic": self.topic,
 			"created": self.creation
@@ -62,6 +75,60 @@ class UserExamAttempt(Document):
 		
 		return analytics
 
+# Attempts per UPDATE ... JOIN when repairing, each batch is its own transaction
+COUNTER_REPAIR_BATCH_SIZE = 1000
+
+def _counters_sql():
+	return """
+		UPDATE `tabUser Exam Attempt` a
+		LEFT JOIN (
+			SELECT parent,
+				COUNT(*) AS total_questions,
+				SUM(CASE WHEN is_skipped = 0 AND COALESCE(user_answer, '') != '' THEN 1 ELSE 0 END) AS answered_count,
+				SUM(is_correct) AS correct_count,
+				SUM(is_skipped) AS skipped_count,
+				SUM(is_assessed) AS assessed_count
+			FROM `tabUser Exam Attempt Detail`
+			WHERE parenttype = 'User Exam Attempt' AND parent IN %(attempts)s
+			GROUP BY parent
+		) d ON d.parent = a.name
+		SET a.total_questions = COALESCE(d.total_questions, 0),
+			a.answered_count = COALESCE(d.answered_count, 0),
+			a.correct_count = COALESCE(d.correct_count, 0),
+			a.skipped_count = COALESCE(d.skipped_count, 0),
+			a.assessed_count = COALESCE(d.assessed_count, 0)
+		WHERE a.name IN %(attempts)s
+	"""
+
+def update_attempt_counters(attempt_name):
+	"""
+	Refresh the stored counters of one attempt from its details. Runs inside the
+	caller's transaction right after a detail changes, so reads never aggregate
+	the child table.
+	"""
+	frappe.db.sql(_counters_sql(), {"attempts": [attempt_name]})
+
+def repair_exam_attempt_counters(batch_size=COUNTER_REPAIR_BATCH_SIZE):
+	"""
+	Scheduled / patch: recompute the counters of every attempt, in batches of
+	attempt names committed one by one so no statement locks the whole table.
+	"""
+	last_name = ""
+	while True:
+		batch = frappe.db.sql_list(
+			"SELECT name FROM `tabUser Exam Attempt` WHERE name > %s ORDER BY name LIMIT %s",
+			(last_name, batch_size),
+		)
+		if not batch:
+			break
+		frappe.db.sql(_counters_sql(), {"attempts": batch})
+		frappe.db.commit()
+		last_name = batch[-1]
+
+def on_doctype_update():
+	frappe.db.add_index("User Exam Attempt", ["user", "creation"])
+	frappe.db.add_index("User Exam Attempt", ["user", "start_time"])
+
 def get_current_user():
 	user = frappe.session.user
 	if user == "Guest":
@@ -151,6 +218,7 @@ def start_exam_attempt(topic_name):
 		detail.ai_feedback = ""
 		detail.insert(ignore_permissions=True)
 	
+	update_attempt_counters(attempt.name)
 	frappe.db.commit()
 	
 	return {
@@ -164,6 +232,34 @@ def start_exam_attempt(topic_name):
 		}
 	}
 
+def get_or_create_exam_detail(attempt, flashcard_name):
+	"""Return the User Exam Attempt Detail of `flashcard_name` in `attempt`, creating it if missing"""
+	detail_list = frappe.get_all(
+		"User Exam Attempt Detail",
+		filters={"parent": attempt.name, "flashcard": flashcard_name},
+		fields=["name"]
+	)
+	if detail_list:
+		return frappe.get_doc("User Exam Attempt Detail", detail_list[0].name)
+
+	# Tạo mới User Exam Attempt Detail nếu không tìm thấy
+	detail = frappe.new_doc("User Exam Attempt Detail")
+	detail.parent = attempt.name
+	detail.parenttype = "User Exam Attempt"
+	detail.parentfield = "details"
+	detail.flashcard = flashcard_name
+	detail.is_correct = 0
+	detail.user_answer = ""
+	# Lưu doc mới tạo
+	detail.insert(ignore_permissions=True)
+	frappe.db.commit()
+	
+	# Cập nhật doc attempt cha
+	attempt.append("details", detail)
+	attempt.save(ignore_permissions=True)
+	frappe.db.commit()
+	return detail
+
 @frappe.whitelist()
 def submit_exam_answer_and_get_feedback(attempt_name, flashcard_name, user_answer, is_skipped=0):
 	"""
@@ -194,37 +290,14 @@ def submit_exam_answer_and_get_feedback(attempt_name, flashcard_name, user_answe
 	
 	flashcard = frappe.get_doc("Flashcard", flashcard_name)
 	
-	# Find the detail record
-	detail_list = frappe.get_all(
-		"User Exam Attempt Detail",
-		filters={"parent": attempt_name, "flashcard": flashcard_name},
-		fields=["name"]
-	)
-	
-	if not detail_list:
-		# Tạo mới User Exam Attempt Detail nếu không tìm thấy
-		detail = frappe.new_doc("User Exam Attempt Detail")
-		detail.parent = attempt_name
-		detail.parenttype = "User Exam Attempt"
-		detail.parentfield = "details"
-		detail.flashcard = flashcard_name
-		detail.is_correct = 0
-		detail.user_answer = ""
-		# Lưu doc mới tạo
-		detail.insert(ignore_permissions=True)
-		frappe.db.commit()
-		
-		# Cập nhật doc attempt cha
-		attempt.append("details", detail)
-		attempt.save(ignore_permissions=True)
-		frappe.db.commit()
-	else:
-		detail = frappe.get_doc("User Exam Attempt Detail", detail_list[0].name)
+	detail = get_or_create_exam_detail(attempt, flashcard_name)
 	
 	# Mark as skipped if requested
 	if is_skipped:
 		detail.user_answer = ""
+		detail.is_skipped = 1
 		detail.save(ignore_permissions=True)
+		update_attempt_counters(attempt_name)
 		frappe.db.commit()
 		
 		return {
@@ -238,9 +311,19 @@ def submit_exam_answer_and_get_feedback(attempt_name, flashcard_name, user_answe
 	
 	# Save user answer
 	detail.user_answer = user_answer
-	
-	# Generate AI feedback using Gemini
-	ai_feedback = generate_ai_feedback(detail, user_answer)
+	detail.is_skipped = 0
+	
+	# Exact/numeric/symbolic/ordering matches are graded locally, the rest goes to Gemini
+	# then near-duplicates of answers Gemini already reviewed reuse that feedback
+	local_grade, ai_feedback = grade_answer_locally(flashcard, user_answer)
+	cluster_feedback = None
+	if local_grade:
+		detail.is_correct = 1 if local_grade["is_correct"] else 0
+	else:
+		detail.is_correct = 0
+		ai_feedback = cluster_feedback = find_cluster_feedback(flashcard_name, user_answer)
+		if not ai_feedback:
+			ai_feedback = generate_ai_feedback(detail, user_answer)
 	
 	# Store feedback in the appropriate fields
 	detail.ai_feedback_what_was_correct = ai_feedback.get("ai_feedback_what_was_correct", "")
@@ -248,17 +331,136 @@ def submit_exam_answer_and_get_feedback(attempt_name, flashcard_name, user_answe
 	detail.ai_feedback_what_to_include = ai_feedback.get("ai_feedback_what_to_include", "")
 	
 	detail.save(ignore_permissions=True)
+	update_attempt_counters(attempt_name)
+	if ai_feedback.get("success"):
+		add_to_cluster_index(flashcard_name, user_answer, feedback_fields(ai_feedback), detail.name)
+	publish_attempt_event("User Exam Attempt", attempt_name, user_id, "question_graded", {
+		"flashcard": flashcard_name,
+		"ai_feedback_what_was_correct": detail.ai_feedback_what_was_correct,
+		"ai_feedback_what_was_incorrect": detail.ai_feedback_what_was_incorrect,
+		"ai_feedback_what_to_include": detail.ai_feedback_what_to_include
+	})
 	frappe.db.commit()
 	
 	return {
 		"success": True,
 		"message": _("Answer submitted successfully"),
 		"is_skipped": False,
+		"graded_locally": bool(local_grade),
+		"reused_feedback": bool(cluster_feedback),
 		"ai_feedback_what_was_correct": detail.ai_feedback_what_was_correct,
 		"ai_feedback_what_was_incorrect": detail.ai_feedback_what_was_incorrect,
 		"ai_feedback_what_to_include": detail.ai_feedback_what_to_include
 	}
 
+@frappe.whitelist(methods=["POST"])
+def submit_exam_answer_streaming(attempt_name, flashcard_name, user_answer):
+	"""
+	Streaming variant of submit_exam_answer_and_get_feedback: saves the answer
+	and returns right away, the feedback is generated by a background job that
+	relays each Gemini chunk as a FEEDBACK_STREAM_EVENT realtime message.
+	
+	Returns:
+		dict: stream_id to match the realtime messages of this answer
+	"""
+	user_id = get_current_user()
+	
+	attempt = frappe.get_doc("User Exam Attempt", attempt_name)
+	if attempt.user != user_id:
+		frappe.throw(_("This exam attempt does not belong to you"))
+	if attempt.completion_timestamp:
+		frappe.throw(_("This exam attempt is already completed"))
+	if not frappe.db.exists("Flashcard", flashcard_name):
+		frappe.throw(_("Flashcard does not exist"))
+	
+	detail = get_or_create_exam_detail(attempt, flashcard_name)
+	detail.user_answer = user_answer
+	detail.is_skipped = 0
+	
+	# Locally graded answers and near-duplicates of reviewed answers need no
+	# stream, the feedback is returned right away
+	local_grade, ready_feedback = grade_answer_locally(frappe.get_doc("Flashcard", flashcard_name), user_answer)
+	cluster_feedback = None if local_grade else find_cluster_feedback(flashcard_name, user_answer)
+	if local_grade or cluster_feedback:
+		ready_feedback = ready_feedback or cluster_feedback
+		detail.is_correct = 1 if local_grade and local_grade["is_correct"] else 0
+		detail.update(ready_feedback)
+		detail.save(ignore_permissions=True)
+		update_attempt_counters(attempt_name)
+		publish_attempt_event("User Exam Attempt", attempt_name, user_id, "question_graded", dict(
+			ready_feedback, flashcard=flashcard_name
+		))
+		frappe.db.commit()
+		return dict(
+			ready_feedback, success=True, message=_("Answer submitted successfully"), is_skipped=False,
+			graded_locally=bool(local_grade), reused_feedback=bool(cluster_feedback), stream_id=None
+		)
+	
+	detail.is_correct = 0
+	detail.ai_feedback_what_was_correct = ""
+	detail.ai_feedback_what_was_incorrect = ""
+	detail.ai_feedback_what_to_include = ""
+	detail.save(ignore_permissions=True)
+	update_attempt_counters(attempt_name)
+	
+	stream_id = frappe.generate_hash(length=12)
+	frappe.enqueue(
+		"elearning.elearning.doctype.user_exam_attempt.user_exam_attempt.stream_ai_feedback_job",
+		queue="short",
+		enqueue_after_commit=True,
+		attempt_name=attempt_name,
+		detail_name=detail.name,
+		user_id=user_id,
+		user_answer=user_answer,
+		stream_id=stream_id
+	)
+	frappe.db.commit()
+	
+	return {
+		"success": True,
+		"message": _("Answer submitted, feedback is streaming"),
+		"is_skipped": False,
+		"graded_locally": False,
+		"reused_feedback": False,
+		"stream_id": stream_id,
+		"event": FEEDBACK_STREAM_EVENT
+	}
+
+def stream_ai_feedback_job(attempt_name, detail_name, user_id, user_answer, stream_id):
+	"""
+	Background job of submit_exam_answer_streaming. Every realtime message
+	carries the sections parsed so far; the last one (done=True) carries the
+	final parsed feedback, which is also saved on the detail.
+	"""
+	detail = frappe.get_doc("User Exam Attempt Detail", detail_name)
+	message = {"attempt": attempt_name, "flashcard": detail.flashcard, "stream_id": stream_id}
+	seq = 0
+	
+	def relay_chunk(delta, text_so_far):
+		nonlocal seq
+		seq += 1
+		frappe.publish_realtime(FEEDBACK_STREAM_EVENT, dict(
+			message, seq=seq, delta=delta, sections=partial_feedback_sections(text_so_far), done=False
+		), user=user_id)
+	
+	ai_feedback = generate_ai_feedback(detail, user_answer, on_chunk=relay_chunk)
+	
+	# The student answered again while this one was streaming: its own job persists that answer
+	if frappe.db.get_value("User Exam Attempt Detail", detail_name, "user_answer") != user_answer:
+		return
+	
+	fields = feedback_fields(ai_feedback)
+	frappe.db.set_value("User Exam Attempt Detail", detail_name, fields)
+	if ai_feedback.get("success"):
+		add_to_cluster_index(detail.flashcard, user_answer, fields, detail_name)
+	frappe.publish_realtime(FEEDBACK_STREAM_EVENT, dict(
+		message, seq=seq + 1, delta="", sections=fields, done=True
+	), user=user_id, after_commit=True)
+	publish_attempt_event("User Exam Attempt", attempt_name, user_id, "question_graded", dict(
+		fields, flashcard=detail.flashcard
+	))
+	frappe.db.commit()
+
 @frappe.whitelist()
 def submit_self_assessment_and_init_srs(attempt_name, flashcard_name, self_assessment_value):
 	"""
@@ -313,7 +515,9 @@ def submit_self_assessment_and_init_srs(attempt_name, flashcard_name, self_asses
 	
 	# Update self-assessment
 	detail.user_self_assessment = self_assessment_value
+	detail.is_assessed = 1
 	detail.save(ignore_permissions=True)
+	update_attempt_counters(attempt_name)
 	
 	# Initialize or update SRS progress based on self-assessment
 	# Map self-assessment values to SRS initial values
@@ -428,13 +632,11 @@ def complete_exam_attempt(attempt_name):
 	attempt.time_spent_seconds = time_spent_seconds
 	attempt.completion_timestamp = now()
 	attempt.save(ignore_permissions=True)
+	refresh_user_day(user_id, frappe.utils.getdate(attempt.creation), "exam")
 	
 	# Log completion
 	attempt.calculate_exam_statistics()
 	
-	# Count total questions
-	total_questions = frappe.db.count("User Exam Attempt Detail", {"parent": attempt_name})
-	
 	return {
 		"success": True,
 		"message": _("Exam attempt completed successfully"),
@@ -444,7 +646,10 @@ def complete_exam_attempt(attempt_name):
 			"start_time": attempt.start_time,
 			"completion_timestamp": attempt.completion_timestamp,
 			"time_spent_seconds": attempt.time_spent_seconds,
-			"total_questions": total_questions
+			"total_questions": attempt.total_questions,
+			"answered_count": attempt.answered_count,
+			"skipped_count": attempt.skipped_count,
+			"assessed_count": attempt.assessed_count
 		}
 	}
 
@@ -529,251 +734,254 @@ def get_exam_attempt_details(attempt_name):
 	}
 
 @frappe.whitelist()
-def get_user_exam_history(topic_name=None, limit=10, offset=0):
+def get_user_exam_history(topic_name=None, limit=10, offset=0, cursor=None):
 	"""
 	Get user's exam history
 	
 	Args:
 		topic_name (str, optional): Filter by topic name
 		limit (int, optional): Limit number of results
-		offset (int, optional): Offset for pagination
+		offset (int, optional): Offset for pagination (deprecated, use cursor)
+		cursor (str, optional): `next_cursor` of the previous page
 		
 	Returns:
-		dict: User's exam history
+		dict: User's exam history, with `next_cursor` for the following page
 	"""
 	user_id = get_current_user()
-	
-	# Build query using only columns that exist in the doctype
+	page_size = get_page_size(limit, default=10)
+
+	params = {"user": user_id}
+	conditions = ""
 	if topic_name:
-		query = """
-			SELECT name, topic, start_time, completion_timestamp as end_time, 
-			       time_spent_seconds
-			FROM `tabUser Exam Attempt`
-			WHERE user = %s 
-			AND completion_timestamp IS NOT NULL
-			AND topic = %s
-			ORDER BY start_time DESC
-			LIMIT %s OFFSET %s
-		"""
-		attempts = frappe.db.sql(query, (user_id, topic_name, cint(limit), cint(offset)), as_dict=True)
-		
-		# Count total records matching criteria
-		count_query = """
-			SELECT COUNT(*) as count
-			FROM `tabUser Exam Attempt`
-			WHERE user = %s 
-			AND completion_timestamp IS NOT NULL
-			AND topic = %s
-		"""
-		count_result = frappe.db.sql(count_query, (user_id, topic_name), as_dict=True)
-		total_count = count_result[0].count if count_result else 0
-	else:
-		query = """
-			SELECT name, topic, start_time, completion_timestamp as end_time, 
-			       time_spent_seconds
-			FROM `tabUser Exam Attempt`
-			WHERE user = %s 
-			AND completion_timestamp IS NOT NULL
-			ORDER BY start_time DESC
-			LIMIT %s OFFSET %s
-		"""
-		attempts = frappe.db.sql(query, (user_id, cint(limit), cint(offset)), as_dict=True)
-		
-		# Count total records matching criteria
-		count_query = """
-			SELECT COUNT(*) as count
-			FROM `tabUser Exam Attempt`
-			WHERE user = %s 
-			AND completion_timestamp IS NOT NULL
-		"""
-		count_result = frappe.db.sql(count_query, (user_id,), as_dict=True)
-		total_count = count_result[0].count if count_result else 0
-	
-	# Get topic names and count total questions
-	topics = {}
+		conditions += " AND a.topic = %(topic)s"
+		params["topic"] = topic_name
+
+	# total_count only for the first page, later pages come from the same history
+	total_count = None
+	if not cursor:
+		total_count = frappe.db.sql(f"""
+			SELECT COUNT(*)
+			FROM `tabUser Exam Attempt` a
+			WHERE a.user = %(user)s AND a.completion_timestamp IS NOT NULL {conditions}
+		""", params)[0][0]
+
+	conditions += " " + keyset_condition("a.start_time", "a.name", cursor, params)
+	# Keyset pagination; OFFSET is only kept for clients that haven't moved to cursors
+	offset_clause = f"OFFSET {cint(offset)}" if cint(offset) and not cursor else ""
+
+	attempts = frappe.db.sql(f"""
+		SELECT a.name, a.topic, a.start_time, a.completion_timestamp AS end_time,
+		       a.time_spent_seconds, t.topic_name, a.total_questions,
+		       a.answered_count, a.correct_count, a.skipped_count, a.assessed_count
+		FROM `tabUser Exam Attempt` a
+		LEFT JOIN `tabTopics` t ON t.name = a.topic
+		WHERE a.user = %(user)s AND a.completion_timestamp IS NOT NULL {conditions}
+		ORDER BY a.start_time DESC, a.name DESC
+		LIMIT {page_size + 1} {offset_clause}
+	""", params, as_dict=True)
+
+	next_cursor = get_next_cursor(attempts, page_size, "start_time")
+	attempts = attempts[:page_size]
+
 	for attempt in attempts:
-		if attempt.topic not in topics:
-			topic_doc = frappe.get_doc("Topics", attempt.topic)
-			topics[attempt.topic] = topic_doc.topic_name
-		
-		attempt["topic_name"] = topics[attempt.topic]
-		
-		# Count the number of questions for this attempt
-		attempt["total_questions"] = frappe.db.count("User Exam Attempt Detail", {"parent": attempt.name})
-		
 		# Format time spent in a more readable format
-		time_spent_mins = int(attempt.time_spent_seconds / 60)
-		time_spent_secs = int(attempt.time_spent_seconds % 60)
-		attempt["formatted_time"] = f"{time_spent_mins}m {time_spent_secs}s"
+		time_spent = attempt.time_spent_seconds or 0
+		attempt["formatted_time"] = f"{int(time_spent / 60)}m {int(time_spent % 60)}s"
 	
 	return {
 		"success": True,
 		"total_count": total_count,
-		"attempts": attempts
+		"attempts": attempts,
+		"next_cursor": next_cursor
 	}
 
-def generate_ai_feedback(detail, user_answer):
-    """
-    Generate AI feedback for a flashcard answer using Gemini API (HTTP request)
-    """
-    try:
-        # Lấy thông tin flashcard từ detail
-        flashcard = frappe.get_doc("Flashcard", detail.flashcard)
-
-        api_key = frappe.conf.get("gemini_api_key")
-        if not api_key:
-            api_key = frappe.db.get_single_value("Elearning Settings", "gemini_api_key")
-
-        if not api_key:
-            return {
-                "ai_feedback_what_was_correct": "Chức năng phản hồi AI không khả dụng.",
-                "ai_feedback_what_was_incorrect": "Vui lòng cấu hình Gemini API key trong site_config.json hoặc Elearning Settings.",
-                "ai_feedback_what_to_include": "Liên hệ quản trị viên để được hỗ trợ."
-            }
-
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
-
-        system_prompt = """
-        Bạn là trợ lý AI giáo dục phân tích câu trả lời của học sinh.
-        Hãy cung cấp phản hồi cụ thể, mang tính xây dựng về câu trả lời của học sinh so với câu trả lời đúng.
+# Gemini JSON-mode schema of flashcard feedback, mapped to the detail fields
+FLASHCARD_FEEDBACK_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "what_was_correct": {"type": "STRING"},
+        "what_was_incorrect": {"type": "STRING"},
+        "what_to_include": {"type": "STRING"},
+    },
+    "required": ["what_was_correct", "what_was_incorrect", "what_to_include"],
+}
+FEEDBACK_STREAM_EVENT = "flashcard_feedback_stream"
 
-        Phản hồi của bạn nên được chia thành ba phần rõ ràng:
-        1. Phần đúng: Nêu bật những khía cạnh cụ thể mà học sinh đã làm đúng
-        2. Phần chưa đúng: Xác định những lỗi cụ thể hoặc hiểu sai
-        3. Phần nên bổ sung: Đề xuất cải tiến cụ thể hoặc thông tin bổ sung
 
-        Mỗi phần nên ngắn gọn (2-4 câu). Hãy cụ thể và mang tính giáo dục thay vì chỉ đơn thuần nêu đúng/sai.
-        Phản hồi nên giúp học sinh hiểu khái niệm tốt hơn.
+def grade_answer_locally(flashcard, user_answer):
+    """
+    Run the deterministic grading tier. Returns (grade, detail feedback fields)
+    when its confidence reaches the threshold, (None, None) otherwise.
+    """
+    steps = None
+    if flashcard.flashcard_type == "Ordering Steps":
+        steps = frappe.get_all(
+            "Ordering Step Item",
+            filters={"parent": flashcard.name},
+            fields=["step_content", "correct_order"],
+            order_by="correct_order"
+        )
+    grade = grade_flashcard_locally(flashcard, user_answer, steps)
+    if not grade or grade["confidence"] < get_confidence_threshold():
+        return None, None
+    return grade, build_local_feedback(grade, flashcard, steps)
 
-        Khi cần sử dụng công thức toán học, hãy sử dụng cú pháp LaTeX với \\( \\) cho công thức inline và \\[ \\] cho công thức standalone.
-        Ví dụ: "Để tính đạo hàm, ta áp dụng công thức \\( f'(x) = \\lim_{h \\to 0} \\frac{f(x+h) - f(x)}{h} \\)"
 
-        Nếu không thể tạo phản hồi do lỗi, hãy cung cấp thông báo lỗi đơn giản.
+def get_feedback_api_key():
+    return get_api_key() or frappe.db.get_single_value("Elearning Settings", "gemini_api_key")
 
-        QUAN TRỌNG: Phản hồi của bạn PHẢI bằng tiếng Việt.
-        """
 
-        user_prompt = ""
-        if flashcard.flashcard_type == "Concept/Theorem/Formula":
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+def build_ai_feedback_payload(flashcard, user_answer):
+    """
+    Variable part of the Gemini request for a flashcard answer (question,
+    answers, generation config); the fixed instructions are the
+    "flashcard_feedback" prompt template.
+    """
+    user_prompt = ""
+    if flashcard.flashcard_type == "Concept/Theorem/Formula":
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Đáp án đúng: {flashcard.answer}
 Câu trả lời của học sinh: {user_answer}
 
 Đây là câu hỏi về khái niệm/định lý/công thức. Hãy đánh giá câu trả lời của học sinh so với đáp án đúng."""
-        elif flashcard.flashcard_type == "Fill in the Blank":
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+    elif flashcard.flashcard_type == "Fill in the Blank":
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Đáp án đúng: {flashcard.answer}
 Câu trả lời của học sinh: {user_answer}
 
 Đây là câu hỏi điền vào chỗ trống. Hãy đánh giá câu trả lời của học sinh so với đáp án đúng."""
-        elif flashcard.flashcard_type == "Ordering Steps":
-            correct_steps = frappe.get_all(
-                "Ordering Step Item",
-                filters={"parent": flashcard.name},
-                fields=["step_content", "correct_order"],
-                order_by="correct_order"
-            )
-            correct_steps_text = "\n".join([f"{idx+1}. {step.step_content}" for idx, step in enumerate(correct_steps)])
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+    elif flashcard.flashcard_type == "Ordering Steps":
+        correct_steps = frappe.get_all(
+            "Ordering Step Item",
+            filters={"parent": flashcard.name},
+            fields=["step_content", "correct_order"],
+            order_by="correct_order"
+        )
+        correct_steps_text = "\n".join([f"{idx+1}. {step.step_content}" for idx, step in enumerate(correct_steps)])
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Thứ tự các bước đúng:
 {correct_steps_text}
 Câu trả lời của học sinh: {user_answer}
 
 Đây là câu hỏi sắp xếp các bước theo thứ tự đúng. Hãy đánh giá câu trả lời của học sinh."""
-        elif flashcard.flashcard_type == "What's the Next Step?":
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+    elif flashcard.flashcard_type == "What's the Next Step?":
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Bước tiếp theo đúng: {flashcard.answer}
 Câu trả lời của học sinh: {user_answer}
 
 Đây là câu hỏi về bước tiếp theo trong giải quyết vấn đề. Hãy đánh giá liệu học sinh đã xác định đúng bước tiếp theo chưa."""
-        elif flashcard.flashcard_type == "Short Answer/Open-ended":
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+    elif flashcard.flashcard_type == "Short Answer/Open-ended":
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Đáp án mẫu: {flashcard.answer}
 Câu trả lời của học sinh: {user_answer}
 
 Đây là câu hỏi mở. Hãy đánh giá câu trả lời của học sinh so với đáp án mẫu, xem xét các cách tiếp cận thay thế hợp lệ."""
-        elif flashcard.flashcard_type == "Identify the Error":
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+    elif flashcard.flashcard_type == "Identify the Error":
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Cách xác định lỗi đúng: {flashcard.answer}
 Câu trả lời của học sinh: {user_answer}
 
 Đây là câu hỏi xác định lỗi. Hãy đánh giá liệu học sinh đã xác định đúng lỗi chưa."""
-        else:
-            user_prompt = f"""Câu hỏi: {flashcard.question}
+    else:
+        user_prompt = f"""Câu hỏi: {flashcard.question}
 Đáp án đúng: {flashcard.answer}
 Câu trả lời của học sinh: {user_answer}
 
 Hãy đánh giá câu trả lời của học sinh so với đáp án đúng."""
 
-        payload = {
-            "contents": [
-                {"role": "user", "parts": [{"text": system_prompt}]},
-                {"role": "user", "parts": [{"text": user_prompt}]}
-            ],
-            "generationConfig": {
-                "temperature": 0.2,
-                "topP": 0.8,
-                "topK": 40,
-                "maxOutputTokens": 1024
-            }
+    payload = {
+        "contents": [
+            {"role": "user", "parts": [{"text": user_prompt}]}
+        ],
+        "generationConfig": {
+            "temperature": 0.2,
+            "topP": 0.8,
+            "topK": 40,
+            "maxOutputTokens": 1024
         }
+    }
+    return payload
+
 
+def feedback_fields(ai_feedback):
+    """The three User Exam Attempt Detail fields of a generate_ai_feedback result"""
+    return {field: ai_feedback.get(field, "") for field in (
+        "ai_feedback_what_was_correct", "ai_feedback_what_was_incorrect", "ai_feedback_what_to_include"
+    )}
+
+
+def to_detail_feedback(feedback):
+    """
+    Map a FLASHCARD_FEEDBACK_SCHEMA object to the User Exam Attempt Detail
+    fields. success marks real Gemini feedback (error messages are not reused).
+    """
+    return {
+        "success": True,
+        "ai_feedback_what_was_correct": feedback.get("what_was_correct") or "Không có phần nào được xác định là đúng.",
+        "ai_feedback_what_was_incorrect": feedback.get("what_was_incorrect") or "Không có phần nào được xác định là chưa đúng.",
+        "ai_feedback_what_to_include": feedback.get("what_to_include") or "Không có đề xuất cụ thể cho việc cải thiện."
+    }
+
+
+def partial_feedback_sections(text_so_far):
+    """Detail fields read from the JSON streamed so far (missing ones are "")"""
+    partial = extract_partial_json_strings(text_so_far, FLASHCARD_FEEDBACK_SCHEMA["required"])
+    return {
+        "ai_feedback_what_was_correct": partial["what_was_correct"],
+        "ai_feedback_what_was_incorrect": partial["what_was_incorrect"],
+        "ai_feedback_what_to_include": partial["what_to_include"]
+    }
+
+
+def generate_ai_feedback(detail, user_answer, on_chunk=None):
+    """
+    Generate AI feedback for a flashcard answer using Gemini API (HTTP request).
+    With `on_chunk(delta, text_so_far)` the answer is streamed and the callback
+    runs for every chunk; the parsed result is the same either way.
+    """
+    try:
+        # Lấy thông tin flashcard từ detail
+        flashcard = frappe.get_doc("Flashcard", detail.flashcard)
+
+        api_key = get_feedback_api_key()
+        if not api_key:
+            return {
+                "ai_feedback_what_was_correct": "Chức năng phản hồi AI không khả dụng.",
+                "ai_feedback_what_was_incorrect": "Vui lòng cấu hình Gemini API key trong site_config.json hoặc Elearning Settings.",
+                "ai_feedback_what_to_include": "Liên hệ quản trị viên để được hỗ trợ."
+            }
+
+        payload = build_ai_feedback_payload(flashcard, user_answer)
         try:
-            response = requests.post(api_url, json=payload, timeout=30)
-            if response.status_code == 200:
-                data = response.json()
-                feedback_text = (
-                    data.get("candidates", [{}])[0]
-                    .get("content", {})
-                    .get("parts", [{}])[0]
-                    .get("text", "")
-                )
-                what_was_correct = ""
-                what_was_incorrect = ""
-                what_to_include = ""
-                if "Phần đúng" in feedback_text:
-                    sections = feedback_text.split("Phần")
-                    for section in sections:
-                        if section.strip().startswith("đúng"):
-                            next_heading_pos = section.find("Phần", 10)
-                            if next_heading_pos > 0:
-                                what_was_correct = section[5:next_heading_pos].strip()
-                            else:
-                                what_was_correct = section[5:].strip()
-                        elif section.strip().startswith("chưa đúng"):
-                            next_heading_pos = section.find("Phần", 10)
-                            if next_heading_pos > 0:
-                                what_was_incorrect = section[10:next_heading_pos].strip()
-                            else:
-                                what_was_incorrect = section[10:].strip()
-                if "Phần nên bổ sung" in feedback_text:
-                    what_to_include_pos = feedback_text.find("Phần nên bổ sung")
-                    if what_to_include_pos > 0:
-                        what_to_include = feedback_text[what_to_include_pos + 16:].strip()
-                if not what_was_correct and not what_was_incorrect and not what_to_include:
-                    return {
-                        "ai_feedback_what_was_correct": "Chúng tôi gặp khó khăn khi phân tích phản hồi AI.",
-                        "ai_feedback_what_was_incorrect": "Phản hồi đầy đủ: " + feedback_text,
-                        "ai_feedback_what_to_include": "Vui lòng thử lại hoặc kiểm tra định dạng câu trả lời của bạn."
-                    }
-                what_was_correct = what_was_correct.strip()
-                what_was_incorrect = what_was_incorrect.strip()
-                what_to_include = what_to_include.strip()
-                # Clean up special formatting characters
-                what_was_correct = clean_ai_text(what_was_correct)
-                what_was_incorrect = clean_ai_text(what_was_incorrect)
-                what_to_include = clean_ai_text(what_to_include)
-                return {
-                    "ai_feedback_what_was_correct": what_was_correct or "Không có phần nào được xác định là đúng.",
-                    "ai_feedback_what_was_incorrect": what_was_incorrect or "Không có phần nào được xác định là chưa đúng.",
-                    "ai_feedback_what_to_include": what_to_include or "Không có đề xuất cụ thể cho việc cải thiện."
-                }
+            if on_chunk:
+                feedback_text = ""
+                for delta in stream_with_template(with_json_schema(payload, FLASHCARD_FEEDBACK_SCHEMA), "flashcard_feedback", api_key=api_key):
+                    feedback_text += delta
+                    on_chunk(delta, feedback_text)
+                feedback = parse_json_response(feedback_text, FLASHCARD_FEEDBACK_SCHEMA)
             else:
-                return {
-                    "ai_feedback_what_was_correct": "Không thể kết nối tới Gemini API.",
-                    "ai_feedback_what_was_incorrect": f"Lỗi HTTP: {response.status_code} - {response.text}",
-                    "ai_feedback_what_to_include": "Vui lòng thử lại sau hoặc liên hệ hỗ trợ."
-                }
+                feedback = generate_json_with_template(payload, FLASHCARD_FEEDBACK_SCHEMA, "flashcard_feedback", api_key=api_key)
+            return to_detail_feedback(feedback)
+        except GeminiUnavailableError:
+            # Gemini is failing/slow across the site: answer at once with the model answer
+            return {
+                "ai_feedback_what_was_correct": "Phản hồi AI tạm thời không khả dụng, câu trả lời của bạn đã được lưu.",
+                "ai_feedback_what_was_incorrect": "Hãy tự so sánh câu trả lời của bạn với đáp án bên dưới.",
+                "ai_feedback_what_to_include": f"Đáp án: {to_plain_text(flashcard.answer)}"
+            }
+        except GeminiSchemaError as schema_error:
+            frappe.log_error(f"Gemini feedback schema error: {schema_error}\n{schema_error.body}", "AI Feedback Generation Error")
+            return {
+                "ai_feedback_what_was_correct": "Chúng tôi gặp khó khăn khi phân tích phản hồi AI.",
+                "ai_feedback_what_was_incorrect": f"Phản hồi không đúng định dạng: {schema_error}",
+                "ai_feedback_what_to_include": "Vui lòng thử lại hoặc kiểm tra định dạng câu trả lời của bạn."
+            }
+        except GeminiError as api_error:
+            return {
+                "ai_feedback_what_was_correct": "Không thể kết nối tới Gemini API.",
+                "ai_feedback_what_was_incorrect": f"Lỗi HTTP: {api_error.status_code} - {api_error.body}",
+                "ai_feedback_what_to_include": "Vui lòng thử lại sau hoặc liên hệ hỗ trợ."
+            }
         except Exception as api_error:
             frappe.log_error(f"Gemini API error: {str(api_error)}", "AI Feedback Generation Error")
             return {
@@ -789,6 +997,7 @@ Hãy đánh giá câu trả lời của học sinh so với đáp án đúng."""
             "ai_feedback_what_was_incorrect": f"Chi tiết lỗi: {str(e)}",
             "ai_feedback_what_to_include": "Vui lòng thử lại sau hoặc liên hệ hỗ trợ."
         }
+
 @frappe.whitelist()
 def get_exam_attempt_time_by_month(year=None):
 	"""Lấy dữ liệu thời gian làm bài thi theo tháng trong năm"""
@@ -804,12 +1013,12 @@ def get_exam_attempt_time_by_month(year=None):
 			SUM(time_spent_seconds) as time_spent
 		FROM `tabUser Exam Attempt` 
 		WHERE user = %s 
-		AND YEAR(creation) = %s
+		AND creation >= %s AND creation < %s
 		AND completion_timestamp IS NOT NULL
 		GROUP BY MONTH(creation)
 	"""
 	
-	data = frappe.db.sql(query, (user, year), as_dict=True)
+	data = frappe.db.sql(query, (user, *get_year_range(year)), as_dict=True)
 	
 	# Chuyển đổi thành định dạng cần thiết
 	result = {}
@@ -827,25 +1036,3 @@ def get_exam_attempt_time_by_month(year=None):
 	
 	return formatted_result
 
-def clean_ai_text(text):
-	"""
-	Làm sạch văn bản từ AI, loại bỏ các dấu hiệu định dạng nhưng giữ lại nội dung
-	"""
-	# Loại bỏ các dấu đánh số như "1. ", "2. " ở đầu dòng
-	text = re.sub(r'^\d+\.\s*', '', text, flags=re.MULTILINE)
-	
-	# Loại bỏ dấu :** ở đầu và dấu ** ở cuối
-	text = re.sub(r':\*\*\s*', '', text)
-	text = re.sub(r'\s*\*\*$', '', text, flags=re.MULTILINE)
-	
-	# Loại bỏ dấu ** ở đầu và cuối
-	text = re.sub(r'^\*\*\s*', '', text, flags=re.MULTILINE)
-	text = re.sub(r'\s*\*\*$', '', text, flags=re.MULTILINE)
-	
-	# Loại bỏ các dấu hiệu như :**, ** ở giữa câu
-	text = re.sub(r':\*\*|\*\*', '', text)
-	
-	# Loại bỏ khoảng trắng thừa
-	text = re.sub(r'\s+', ' ', text).strip()
-	
-	return text
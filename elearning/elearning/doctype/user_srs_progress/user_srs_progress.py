@@ -8,6 +8,7 @@ from frappe.utils import now_datetime, add_days, getdate, get_datetime
 from datetime import datetime, timedelta
 import random
 import math
+from elearning.elearning.utils.study_analytics import get_year_range
 
 class UserSRSProgress(Document):
     def before_save(self):
@@ -25,6 +26,9 @@ class UserSRSProgress(Document):
         if not frappe.db.exists("Flashcard", self.flashcard):
             frappe.throw(_("Flashcard {0} does not exist").format(self.flashcard))
 
+def on_doctype_update():
+    frappe.db.add_index("User SRS Progress", ["user", "last_review_timestamp"])
+
 def get_current_user():
     """Get current authenticated user"""
     user = frappe.session.user
@@ -598,11 +602,11 @@ def get_srs_time_by_month(year=None):
             SUM(total_time_spent_seconds) as time_spent
         FROM `tabUser SRS Progress` 
         WHERE user = %s 
-        AND YEAR(last_review_timestamp) = %s
+        AND last_review_timestamp >= %s AND last_review_timestamp < %s
         GROUP BY MONTH(last_review_timestamp)
     """
     
-    data = frappe.db.sql(query, (user, year), as_dict=True)
+    data = frappe.db.sql(query, (user, *get_year_range(year)), as_dict=True)
     
     # Chuyển đổi thành định dạng cần thiết
     result = {}
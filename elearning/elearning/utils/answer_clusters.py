@@ -0,0 +1,211 @@
+# elearning/elearning/utils/answer_clusters.py
+import random
+import re
+import time
+import unicodedata
+import zlib
+
+import frappe
+from frappe.utils import flt, cint, getdate, add_days, nowdate, strip_html_tags
+
+# Near-duplicate answers to the same flashcard share AI feedback. Each answer
+# is reduced to normalized tokens -> character shingles -> a MinHash signature;
+# LSH bands of the signature point to clusters whose feedback came from Gemini.
+#
+# Redis layout per flashcard:
+#   elearning:answer_clusters:{flashcard}  cluster id -> {"signature", "numbers", "feedback", "detail"}
+#   elearning:answer_lsh:{flashcard}:{band}:{bucket}  sorted set of cluster ids (score = time added),
+#       trimmed to the newest MAX_CANDIDATES; updated with ZADD in one MULTI, so concurrent
+#       writers can't drop each other's ids
+#   elearning:answer_lsh:{flashcard}:buckets  set of the bucket keys above, for clearing
+#   elearning:answer_cluster_stats:{date}:{lookups|hits}  daily counters
+NUM_PERM = 64
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERM // LSH_BANDS
+SHINGLE_SIZE = 4
+MAX_CANDIDATES = 20
+DEFAULT_SIMILARITY_THRESHOLD = 0.9
+CLUSTERS_KEY = "elearning:answer_clusters"
+LSH_KEY = "elearning:answer_lsh"
+STATS_KEY = "elearning:answer_cluster_stats"
+CLUSTER_TTL = 30 * 24 * 60 * 60
+STATS_TTL = 90 * 24 * 60 * 60
+
+_MERSENNE_PRIME = (1 << 61) - 1
+# Fixed seed: signatures must stay comparable across workers and restarts
+_rng = random.Random(20250601)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+
+def get_similarity_threshold():
+    return flt(frappe.conf.get("answer_cluster_threshold") or DEFAULT_SIMILARITY_THRESHOLD)
+
+
+def normalize_tokens(answer):
+    """
+    Lowercase word/number/operator tokens without punctuation. Single-letter
+    variables are renamed by first appearance, so "2x + 1" and "2y + 1" match.
+    """
+    text = unicodedata.normalize("NFC", strip_html_tags(answer or "")).lower()
+    # "2x" -> "2", "x": coefficients and variables are separate tokens
+    tokens = re.findall(r"\d+|[^\W\d_]+|[=+\-*/^<>]", text)
+    variables = {}
+    normalized = []
+    for token in tokens:
+        if len(token) == 1 and token.isalpha() and token.isascii():
+            token = variables.setdefault(token, f"v{len(variables)}")
+        normalized.append(token)
+    return normalized
+
+
+def shingles(tokens):
+    text = " ".join(tokens)
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    hashes = [zlib.crc32(shingle.encode()) for shingle in shingle_set]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def lsh_buckets(signature):
+    return [
+        f"{band}:{zlib.crc32(','.join(map(str, signature[band * LSH_ROWS:(band + 1) * LSH_ROWS])).encode())}"
+        for band in range(LSH_BANDS)
+    ]
+
+
+def estimate_similarity(signature, other):
+    """MinHash estimate of the Jaccard similarity of the two shingle sets"""
+    return sum(1 for x, y in zip(signature, other) if x == y) / NUM_PERM
+
+
+def get_signature(answer):
+    """(MinHash signature, sorted numbers of the answer) or (None, None) for an empty answer"""
+    tokens = normalize_tokens(answer)
+    shingle_set = shingles(tokens)
+    if not shingle_set:
+        return None, None
+    return minhash(shingle_set), sorted(token for token in tokens if token.isdigit())
+
+
+def _bucket_key(flashcard_name, bucket):
+    # Plain redis sorted sets, not pickled cache values
+    return frappe.cache().make_key(f"{LSH_KEY}:{flashcard_name}:{bucket}")
+
+
+def _bucket_registry_key(flashcard_name):
+    return frappe.cache().make_key(f"{LSH_KEY}:{flashcard_name}:buckets")
+
+
+def _stats_key(day, counter):
+    # Plain redis counters (INCR), not pickled cache values
+    return frappe.cache().make_key(f"{STATS_KEY}:{day}:{counter}")
+
+
+def _record_lookup(hit):
+    day = nowdate()
+    pipe = frappe.cache().pipeline()
+    for counter in (("lookups", "hits") if hit else ("lookups",)):
+        pipe.incr(_stats_key(day, counter))
+        pipe.expire(_stats_key(day, counter), STATS_TTL)
+    pipe.execute()
+
+
+def find_cluster_feedback(flashcard_name, answer):
+    """
+    Feedback of the most similar clustered answer to `flashcard_name`, or None
+    when no cluster reaches get_similarity_threshold().
+    """
+    signature, numbers = get_signature(answer)
+    if not signature:
+        return None
+
+    cache = frappe.cache()
+    pipe = cache.pipeline(transaction=False)
+    for bucket in lsh_buckets(signature):
+        pipe.zrevrange(_bucket_key(flashcard_name, bucket), 0, -1)
+    candidate_ids = []
+    for bucket_ids in pipe.execute():
+        for cluster_id in map(frappe.safe_decode, bucket_ids):
+            if cluster_id not in candidate_ids:
+                candidate_ids.append(cluster_id)
+
+    best, best_similarity = None, 0
+    for cluster_id in candidate_ids[:MAX_CANDIDATES]:
+        cluster = cache.hget(f"{CLUSTERS_KEY}:{flashcard_name}", cluster_id)
+        # A long answer with a different result number can still look 90% similar
+        if not cluster or cluster["numbers"] != numbers:
+            continue
+        similarity = estimate_similarity(signature, cluster["signature"])
+        if similarity > best_similarity:
+            best, best_similarity = cluster, similarity
+
+    hit = best is not None and best_similarity >= get_similarity_threshold()
+    _record_lookup(hit)
+    if not hit:
+        return None
+    return dict(best["feedback"])
+
+
+def add_to_cluster_index(flashcard_name, answer, feedback, detail_name):
+    """Index an answer whose feedback came from Gemini; the detail name is the cluster id"""
+    signature, numbers = get_signature(answer)
+    if not signature:
+        return
+
+    cache = frappe.cache()
+    clusters_key = f"{CLUSTERS_KEY}:{flashcard_name}"
+    cache.hset(clusters_key, detail_name, {
+        "signature": signature, "numbers": numbers, "feedback": feedback, "detail": detail_name
+    })
+    cache.expire(cache.make_key(clusters_key), CLUSTER_TTL)
+
+    added_at = time.time()
+    registry_key = _bucket_registry_key(flashcard_name)
+    pipe = cache.pipeline()
+    for bucket in lsh_buckets(signature):
+        bucket_key = _bucket_key(flashcard_name, bucket)
+        pipe.zadd(bucket_key, {detail_name: added_at})
+        # A handful of ids per bucket is enough to find a close cluster
+        pipe.zremrangebyrank(bucket_key, 0, -MAX_CANDIDATES - 1)
+        pipe.expire(bucket_key, CLUSTER_TTL)
+        pipe.sadd(registry_key, bucket_key)
+    pipe.expire(registry_key, CLUSTER_TTL)
+    pipe.execute()
+
+
+def clear_flashcard_clusters(doc=None, method=None):
+    """doc_events hook for Flashcard: feedback depends on the question and answer"""
+    cache = frappe.cache()
+    registry_key = _bucket_registry_key(doc.name)
+    # Raw SMEMBERS: the wrapper's smembers would prefix the key a second time
+    bucket_keys = cache.pipeline(transaction=False).smembers(registry_key).execute()[0]
+    cache.delete(registry_key, *bucket_keys)
+    cache.delete_value(f"{CLUSTERS_KEY}:{doc.name}")
+
+
+@frappe.whitelist()
+def get_answer_cluster_stats(days=7):
+    """Daily lookups/hits of the answer cluster index, each hit is a Gemini call avoided"""
+    frappe.only_for("System Manager")
+
+    cache = frappe.cache()
+    today = getdate(nowdate())
+    result = []
+    total_lookups = total_hits = 0
+    for offset in range(max(cint(days), 1)):
+        day = add_days(today, -offset)
+        lookups, hits = (cint(frappe.safe_decode(v)) for v in cache.mget([_stats_key(day, "lookups"), _stats_key(day, "hits")]))
+        total_lookups += lookups
+        total_hits += hits
+        result.append({"date": str(day), "lookups": lookups, "hits": hits, "hit_rate": round(hits / lookups, 4) if lookups else 0})
+
+    return {
+        "days": result,
+        "lookups": total_lookups,
+        "hits": total_hits,
+        "hit_rate": round(total_hits / total_lookups, 4) if total_lookups else 0,
+    }
@@ -0,0 +1,306 @@
+# elearning/elearning/utils/attempt_buffer.py
+import frappe
+from frappe.utils import now, cint
+from redis.exceptions import LockError
+
+logger = frappe.logger("attempt_buffer")
+
+# Write-behind mode (site_config: "test_attempt_write_behind": 1).
+# Autosaves go to one redis hash per attempt instead of MariaDB:
+#   "answer:{test_question_item}" -> {"question", "user_answer"}
+#   "meta" -> {"user", "seq", "last_viewed_question"}
+# and the attempt id is added to a dirty set. Flushing renames the live hash
+# to "...:flushing" before writing it, so a worker dying mid-flush leaves the
+# data in redis and the next flush replays it; autosaves arriving meanwhile
+# go to a fresh live hash. The attempt lock is held until the flush is
+# committed, so an autosave can't land between reading and deleting the hash.
+#
+# Until flushed the buffer is the only copy of those answers, so it must not
+# live in redis_cache (LRU eviction, no persistence). It uses the redis at
+# site_config "attempt_buffer_redis", else redis_queue: configure that server
+# with `maxmemory-policy noeviction` and AOF/RDB persistence.
+BUFFER_KEY_PREFIX = "elearning:attempt_buffer"
+DIRTY_SET_KEY = f"{BUFFER_KEY_PREFIX}:dirty"
+LOCK_TIMEOUT = 10
+# A flush holds the lock across the DB write, give it more room than an autosave
+FLUSH_LOCK_TIMEOUT = 60
+
+
+_stores = {}
+
+
+def get_buffer_store():
+    """RedisWrapper on the buffer's redis (see above), one connection pool per process"""
+    from frappe.utils.redis_wrapper import RedisWrapper
+
+    url = frappe.conf.get("attempt_buffer_redis") or frappe.conf.get("redis_queue")
+    if not url:
+        frappe.throw("Write-behind autosave needs attempt_buffer_redis or redis_queue configured")
+    if url not in _stores:
+        _stores[url] = RedisWrapper.from_url(url)
+    return _stores[url]
+
+
+def is_write_behind_enabled():
+    return cint(frappe.conf.get("test_attempt_write_behind"))
+
+
+def get_buffer_key(attempt_id):
+    return f"{BUFFER_KEY_PREFIX}:{attempt_id}"
+
+
+def get_flushing_key(attempt_id):
+    return f"{BUFFER_KEY_PREFIX}:{attempt_id}:flushing"
+
+
+def _attempt_lock(attempt_id, blocking_timeout=5, timeout=LOCK_TIMEOUT):
+    cache = get_buffer_store()
+    return cache.lock(
+        cache.make_key(f"{BUFFER_KEY_PREFIX}:lock:{attempt_id}"),
+        timeout=timeout,
+        blocking_timeout=blocking_timeout,
+    )
+
+
+def upsert_attempt_answers(attempt_id, answer_rows):
+    """
+    Insert or update Attempt Answer Item rows of an attempt in a single statement.
+
+    Args:
+        attempt_id (str): Test Attempt name
+        answer_rows (list): dicts with test_question_item, question, user_answer
+    Returns:
+        int: number of rows written
+    """
+    if not answer_rows:
+        return 0
+
+    tqi_ids = [row["test_question_item"] for row in answer_rows]
+    existing = frappe.db.sql(
+        """
+        SELECT name, test_question_item
+        FROM `tabAttempt Answer Item`
+        WHERE parent = %(parent)s AND parenttype = 'Test Attempt' AND parentfield = 'answers'
+        AND test_question_item IN %(tqi_ids)s
+        """,
+        {"parent": attempt_id, "tqi_ids": tqi_ids},
+        as_dict=True,
+    )
+    existing_names = {row.test_question_item: row.name for row in existing}
+
+    next_idx = None
+    timestamp = now()
+    values = []
+    for row in answer_rows:
+        name = existing_names.get(row["test_question_item"])
+        idx = 0
+        if not name:
+            if next_idx is None:
+                next_idx = cint(frappe.db.sql(
+                    "SELECT MAX(idx) FROM `tabAttempt Answer Item` WHERE parent = %s AND parenttype = 'Test Attempt'",
+                    attempt_id,
+                )[0][0]) + 1
+            name = frappe.generate_hash(length=10)
+            idx = next_idx
+            next_idx += 1
+        values.append((
+            name, timestamp, timestamp, frappe.session.user, frappe.session.user,
+            attempt_id, "answers", "Test Attempt", idx,
+            row["question"], row["test_question_item"], row["user_answer"], timestamp
+        ))
+
+    # idx/creation/owner are only used for new rows; grading fields are reset like save_attempt_progress does
+    placeholders = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 0, 0)"] * len(values))
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabAttempt Answer Item`
+            (name, creation, modified, modified_by, owner,
+             parent, parentfield, parenttype, idx,
+             question, test_question_item, user_answer, submitted_at,
+             is_correct, points_awarded)
+        VALUES {placeholders}
+        ON DUPLICATE KEY UPDATE
+            user_answer = VALUES(user_answer),
+            submitted_at = VALUES(submitted_at),
+            modified = VALUES(modified),
+            modified_by = VALUES(modified_by),
+            is_correct = 0,
+            points_awarded = 0
+        """,
+        [value for row in values for value in row],
+    )
+    return len(values)
+
+
+
+def buffer_attempt_progress(attempt, answer_rows, seq=None, last_viewed_question=None):
+    """
+    Store an autosave in the attempt's redis hash instead of MariaDB.
+
+    Args:
+        attempt (dict): Test Attempt row with name and user (already validated by the caller)
+        answer_rows (list): dicts with test_question_item, question, user_answer
+        seq (int, optional): autosave sequence, rejected when not above the buffered/DB one
+    Returns:
+        dict: {"success", "seq"} plus "stale": True when rejected, or
+            "retry": True when the attempt stayed locked (a flush is running)
+    """
+    cache = get_buffer_store()
+    key = get_buffer_key(attempt.name)
+
+    try:
+        with _attempt_lock(attempt.name):
+            return _buffer_locked(cache, key, attempt, answer_rows, seq, last_viewed_question)
+    except LockError:
+        logger.warning(f"Buffer of attempt {attempt.name} is locked, autosave not stored.")
+        # Not stale: the client keeps the answers unsaved and sends them again
+        return {"success": False, "stale": False, "retry": True, "seq": cint(attempt.get("autosave_seq"))}
+
+
+def _buffer_locked(cache, key, attempt, answer_rows, seq, last_viewed_question):
+    """buffer_attempt_progress under the attempt lock"""
+    meta = cache.hget(key, "meta") or {}
+    current_seq = max(cint(meta.get("seq")), cint(attempt.get("autosave_seq")))
+    if seq is not None and cint(seq) <= current_seq:
+        return {"success": False, "stale": True, "seq": current_seq}
+
+    for row in answer_rows:
+        cache.hset(key, f"answer:{row['test_question_item']}", {
+            "question": row["question"],
+            "user_answer": row["user_answer"]
+        })
+
+    meta["user"] = attempt.user
+    if seq is not None:
+        meta["seq"] = cint(seq)
+    if last_viewed_question is not None:
+        meta["last_viewed_question"] = last_viewed_question
+    cache.hset(key, "meta", meta)
+    cache.sadd(DIRTY_SET_KEY, attempt.name)
+    return {"success": True, "seq": meta.get("seq")}
+
+
+def get_buffered_state(attempt_id):
+    """
+    Return the not-yet-flushed state of an attempt:
+    {"answers": {tqi: {"question", "user_answer"}}, "meta": {...}}, or None when nothing is buffered.
+    """
+    cache = get_buffer_store()
+    state = {"answers": {}, "meta": {}}
+    found = False
+    # flushing first so the newer live hash wins
+    for key in (get_flushing_key(attempt_id), get_buffer_key(attempt_id)):
+        values = cache.hgetall(key)
+        if not values:
+            continue
+        found = True
+        for field, value in values.items():
+            field = frappe.safe_decode(field)
+            if field == "meta":
+                state["meta"].update(value or {})
+            elif field.startswith("answer:"):
+                state["answers"][field[len("answer:"):]] = value
+    return state if found else None
+
+
+def flush_attempt(attempt_id):
+    """
+    Write the buffered answers/meta of one attempt to MariaDB and drop the buffer.
+    Safe to call when nothing is buffered. Buffers of attempts that are no longer
+    In Progress are discarded: the submitted answers are authoritative.
+    """
+    cache = get_buffer_store()
+    live_key = get_buffer_key(attempt_id)
+    flushing_key = get_flushing_key(attempt_id)
+
+    try:
+        lock = _attempt_lock(attempt_id, blocking_timeout=LOCK_TIMEOUT, timeout=FLUSH_LOCK_TIMEOUT)
+        if not lock.acquire():
+            raise LockError("blocking_timeout reached")
+    except LockError:
+        logger.warning(f"Could not lock buffer of attempt {attempt_id}, flush skipped.")
+        return False
+
+    try:
+        return _flush_locked(attempt_id, cache, live_key, flushing_key)
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            logger.warning(f"Buffer lock of attempt {attempt_id} expired during the flush.")
+
+
+def _flush_locked(attempt_id, cache, live_key, flushing_key):
+    # A leftover flushing hash means a previous flush died: replay it together with the live one
+    if cache.exists(live_key):
+        if cache.exists(flushing_key):
+            for field, value in cache.hgetall(live_key).items():
+                field = frappe.safe_decode(field)
+                if field == "meta":
+                    meta = cache.hget(flushing_key, "meta") or {}
+                    meta.update(value or {})
+                    value = meta
+                cache.hset(flushing_key, field, value)
+            cache.delete_value(live_key)
+        else:
+            cache.rename(cache.make_key(live_key), cache.make_key(flushing_key))
+
+    state = {"answers": {}, "meta": {}}
+    for field, value in cache.hgetall(flushing_key).items():
+        field = frappe.safe_decode(field)
+        if field == "meta":
+            state["meta"] = value or {}
+        elif field.startswith("answer:"):
+            state["answers"][field[len("answer:"):]] = value
+
+    if not state["answers"] and not state["meta"]:
+        cache.srem(DIRTY_SET_KEY, attempt_id)
+        return True
+
+    # FOR UPDATE: a submit finalizing the attempt concurrently waits for this flush (or vice versa)
+    status = frappe.db.get_value("Test Attempt", attempt_id, "status", for_update=True)
+    if status == "In Progress":
+        answer_rows = [
+            {"test_question_item": tqi, "question": value.get("question"), "user_answer": value.get("user_answer")}
+            for tqi, value in state["answers"].items()
+        ]
+        meta = state["meta"]
+        attempt_updates = {}
+        if meta.get("seq"):
+            attempt_updates["autosave_seq"] = cint(meta["seq"])
+        if "last_viewed_question" in meta:
+            attempt_updates["last_viewed_question"] = meta["last_viewed_question"]
+
+        try:
+            upsert_attempt_answers(attempt_id, answer_rows)
+            if attempt_updates:
+                frappe.db.set_value("Test Attempt", attempt_id, attempt_updates)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            logger.error(f"Failed to flush buffer of attempt {attempt_id}, kept for replay.", exc_info=True)
+            return False
+    elif status:
+        logger.info(f"Discarding buffered autosave of attempt {attempt_id} (status {status}).")
+
+    cache.delete_value(flushing_key)
+    cache.srem(DIRTY_SET_KEY, attempt_id)
+    return True
+
+
+def discard_attempt_buffer(attempt_id):
+    cache = get_buffer_store()
+    cache.delete_value([get_buffer_key(attempt_id), get_flushing_key(attempt_id)])
+    cache.srem(DIRTY_SET_KEY, attempt_id)
+
+
+def flush_attempt_buffers():
+    """Scheduled: flush every dirty attempt buffer in one pass"""
+    dirty = get_buffer_store().smembers(DIRTY_SET_KEY)
+    if not dirty:
+        return
+    flushed = 0
+    for attempt_id in dirty:
+        if flush_attempt(frappe.safe_decode(attempt_id)):
+            flushed += 1
+    logger.info(f"Flushed {flushed}/{len(dirty)} attempt buffers.")
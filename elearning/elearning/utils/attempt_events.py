@@ -0,0 +1,85 @@
+# elearning/elearning/utils/attempt_events.py
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, now
+
+# Every grading/feedback change of an attempt is pushed to the owner's
+# realtime room as ATTEMPT_EVENT and appended to a short per-attempt log, so a
+# client that reconnects asks for the events after its last seq instead of
+# rebuilding the whole result.
+ATTEMPT_EVENT = "attempt_event"
+ATTEMPT_EVENTS_KEY = "elearning:attempt_events"
+ATTEMPT_EVENTS_MAX = 200
+ATTEMPT_EVENTS_TTL = 24 * 60 * 60
+EVENT_DOCTYPES = ("Test Attempt", "User Exam Attempt")
+
+
+def _log_key(doctype, attempt_id):
+    # Unprefixed: the RedisWrapper list methods (lrange) add the site prefix
+    # themselves, raw calls (incr, pipeline) go through make_key
+    return f"{ATTEMPT_EVENTS_KEY}:{frappe.scrub(doctype)}:{attempt_id}"
+
+
+def _append_and_publish(doctype, attempt_id, user, event_type, data):
+    cache = frappe.cache()
+    log_key = cache.make_key(_log_key(doctype, attempt_id))
+    seq = cache.incr(f"{log_key}:seq")
+    event = {
+        "doctype": doctype,
+        "attemptId": attempt_id,
+        "seq": seq,
+        "type": event_type,
+        "data": data or {},
+        "timestamp": now(),
+    }
+
+    pipe = cache.pipeline()
+    pipe.rpush(log_key, json.dumps(event, default=str, ensure_ascii=False))
+    pipe.ltrim(log_key, -ATTEMPT_EVENTS_MAX, -1)
+    pipe.expire(log_key, ATTEMPT_EVENTS_TTL)
+    pipe.expire(f"{log_key}:seq", ATTEMPT_EVENTS_TTL)
+    pipe.execute()
+
+    frappe.publish_realtime(ATTEMPT_EVENT, event, user=user)
+
+
+def publish_attempt_event(doctype, attempt_id, user, event_type, data=None):
+    """
+    Queue an attempt event ("question_graded", "score_updated", "summary_ready", ...)
+    for `user`. It is logged and pushed only once the current transaction
+    commits, so clients never see a score that was rolled back.
+    """
+    frappe.db.after_commit.add(lambda: _append_and_publish(doctype, attempt_id, user, event_type, data))
+
+
+def get_attempt_events_since(doctype, attempt_id, since=0):
+    """Return (events with seq > since, cursor). Older events may have been trimmed."""
+    since = cint(since)
+    raw_events = frappe.cache().lrange(_log_key(doctype, attempt_id), 0, -1) or []
+    events = [event for event in (json.loads(frappe.safe_decode(raw)) for raw in raw_events) if event["seq"] > since]
+    cursor = events[-1]["seq"] if events else since
+    return events, cursor
+
+
+@frappe.whitelist()
+def get_attempt_events(attempt_id, since=0, doctype="Test Attempt"):
+    """
+    Catch-up endpoint for reconnecting clients: events of an attempt after `since`.
+    `truncated` is set when `since` is older than the kept log, the client
+    should then reload the result once.
+    """
+    if doctype not in EVENT_DOCTYPES:
+        frappe.throw(_("Invalid attempt type {0}.").format(doctype), frappe.ValidationError)
+
+    user = frappe.session.user
+    owner = frappe.db.get_value(doctype, attempt_id, "user")
+    if not owner:
+        frappe.throw(_("Attempt {0} not found.").format(attempt_id), frappe.DoesNotExistError)
+    if owner != user and not frappe.has_permission(doctype, "read", attempt_id):
+        frappe.throw(_("You do not have permission to view this attempt."), frappe.PermissionError)
+
+    events, cursor = get_attempt_events_since(doctype, attempt_id, since)
+    truncated = bool(events) and events[0]["seq"] > cint(since) + 1
+    return {"events": events, "cursor": cursor, "truncated": truncated}
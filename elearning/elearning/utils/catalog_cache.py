@@ -0,0 +1,57 @@
+# elearning/elearning/utils/catalog_cache.py
+import hashlib
+import json
+
+import frappe
+from frappe.core.doctype.user_permission.user_permission import get_user_permissions
+
+# Single redis hash for the whole catalog: any Test/Topics change clears it in one call
+CATALOG_CACHE_KEY = "elearning:catalog"
+
+
+def _scope_signature(doctype):
+    """
+    Who a cached listing can be shared with. get_list filters by role, and for
+    users with User Permissions or if_owner rules on `doctype` also per user:
+    those users get listings of their own.
+    """
+    roles = sorted(frappe.get_roles())
+    scope = ",".join(roles)
+    if_owner = any(
+        perm.if_owner and perm.role in roles for perm in frappe.get_meta(doctype).permissions
+    )
+    if if_owner or get_user_permissions(frappe.session.user):
+        scope += f"|{frappe.session.user}"
+    return hashlib.md5(scope.encode()).hexdigest()[:12]
+
+
+def make_etag(payload):
+    body = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+    return '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+
+
+def get_cached_catalog(catalog_name, doctype, filters, builder):
+    """
+    Return {"data": ..., "etag": ...} for a catalog listing, building it with
+    `builder()` on a cache miss.
+
+    Args:
+        catalog_name (str): "tests", "topics", ...
+        doctype (str): The DocType `builder` lists with frappe.get_list
+        filters (tuple): The filter values the listing depends on
+        builder (callable): Builds the listing for the current user
+    """
+    field = f"{catalog_name}:{_scope_signature(doctype)}:{json.dumps(list(filters), default=str)}"
+    entry = frappe.cache().hget(CATALOG_CACHE_KEY, field)
+    if entry:
+        return entry
+
+    data = builder()
+    entry = {"data": data, "etag": make_etag(data)}
+    frappe.cache().hset(CATALOG_CACHE_KEY, field, entry)
+    return entry
+
+
+def clear_catalog_cache(doc=None, method=None):
+    """doc_events hook for Test and Topics (Test Question Item edits save the parent Test)"""
+    frappe.cache().delete_value(CATALOG_CACHE_KEY)
@@ -0,0 +1,111 @@
+# elearning/elearning/utils/circuit_breaker.py
+import time
+
+import frappe
+from frappe.utils import cint, flt
+
+# Circuit breaker shared by all workers through Redis, for slow external
+# dependencies (Gemini). Failures and slow calls are counted in a rolling
+# window; reaching the threshold opens the circuit and calls fail fast with
+# CircuitOpenError. After the cooldown one probe call is let through
+# (half-open): success closes the circuit, failure opens it again.
+#
+# Redis (plain string keys, per breaker name):
+#   elearning:circuit:{name}:failures    failures in the current window (INCR, expires with the window)
+#   elearning:circuit:{name}:open_until  unix time the cooldown ends; present while open/half-open
+#   elearning:circuit:{name}:probe       held by the worker running the half-open probe
+#   elearning:circuit:{name}:trips       number of times the circuit opened
+BREAKER_KEY = "elearning:circuit"
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_WINDOW_SECONDS = 60
+DEFAULT_COOLDOWN_SECONDS = 30
+# A probe that never reports back (killed worker) frees the slot after this
+PROBE_TIMEOUT = 5 * 60
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The dependency is considered down, the call was not attempted"""
+
+
+def _key(name, part):
+    return frappe.cache().make_key(f"{BREAKER_KEY}:{name}:{part}")
+
+
+def _setting(name, setting, default):
+    # site_config: circuit_breaker = {"gemini": {"failure_threshold": 5, "window_seconds": 60, "cooldown_seconds": 30}}
+    return flt((frappe.conf.get("circuit_breaker") or {}).get(name, {}).get(setting)) or default
+
+
+def get_state(name):
+    cache = frappe.cache()
+    open_until = flt(frappe.safe_decode(cache.get(_key(name, "open_until"))))
+    if not open_until:
+        return CLOSED
+    return OPEN if time.time() < open_until else HALF_OPEN
+
+
+def before_call(name):
+    """
+    Ask to call the dependency. Returns True when this call is the half-open
+    probe, False for a normal call; raises CircuitOpenError to fail fast.
+    """
+    state = get_state(name)
+    if state == CLOSED:
+        return False
+    if state == HALF_OPEN and frappe.cache().set(_key(name, "probe"), frappe.local.site, nx=True, ex=PROBE_TIMEOUT):
+        return True
+    raise CircuitOpenError(f"Circuit {name} is {state}")
+
+
+def _trip(name):
+    cache = frappe.cache()
+    cooldown = _setting(name, "cooldown_seconds", DEFAULT_COOLDOWN_SECONDS)
+    pipe = cache.pipeline()
+    pipe.set(_key(name, "open_until"), time.time() + cooldown)
+    pipe.delete(_key(name, "failures"), _key(name, "probe"))
+    pipe.incr(_key(name, "trips"))
+    pipe.execute()
+    frappe.logger("circuit_breaker").warning(f"Circuit {name} opened for {cooldown}s")
+
+
+def record_failure(name, probe=False):
+    """A failed or too slow call: a failed probe reopens, otherwise count towards the threshold"""
+    if probe:
+        _trip(name)
+        return
+
+    cache = frappe.cache()
+    failures_key = _key(name, "failures")
+    pipe = cache.pipeline()
+    # The window starts at the first failure; INCR keeps the TTL instead of sliding it
+    pipe.set(failures_key, 0, ex=cint(_setting(name, "window_seconds", DEFAULT_WINDOW_SECONDS)), nx=True)
+    pipe.incr(failures_key)
+    failures = pipe.execute()[1]
+    if failures >= _setting(name, "failure_threshold", DEFAULT_FAILURE_THRESHOLD) and get_state(name) == CLOSED:
+        _trip(name)
+
+
+def record_success(name, probe=False):
+    if probe:
+        frappe.cache().delete(_key(name, "open_until"), _key(name, "probe"), _key(name, "failures"))
+        frappe.logger("circuit_breaker").info(f"Circuit {name} closed after a successful probe")
+
+
+def get_breaker_state(name):
+    cache = frappe.cache()
+    failures, open_until, trips = (
+        frappe.safe_decode(value)
+        for value in cache.mget([_key(name, "failures"), _key(name, "open_until"), _key(name, "trips")])
+    )
+    return {
+        "name": name,
+        "state": get_state(name),
+        "failures": cint(failures),
+        "failure_threshold": cint(_setting(name, "failure_threshold", DEFAULT_FAILURE_THRESHOLD)),
+        "open_until": flt(open_until) or None,
+        "trips": cint(trips),
+    }
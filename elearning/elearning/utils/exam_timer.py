@@ -0,0 +1,78 @@
+# elearning/elearning/utils/exam_timer.py
+import frappe
+from frappe.utils import now_datetime, get_datetime, add_to_date, cint
+
+# Thời gian làm bài do server quyết định: deadline được lưu khi bắt đầu,
+# mỗi lần tạm dừng (paused_at -> resume) sẽ dời deadline thêm đúng khoảng đó.
+DEFAULT_SUBMIT_GRACE_SECONDS = 120
+# Một bài tạm dừng quá lâu coi như bị bỏ dở: sweeper sẽ nộp bài với các câu đã lưu
+DEFAULT_MAX_PAUSE_SECONDS = 24 * 60 * 60
+
+
+def get_submit_grace_seconds():
+    """Network slack accepted after the deadline before a submission counts as late"""
+    return cint(frappe.conf.get("exam_submit_grace_seconds") or DEFAULT_SUBMIT_GRACE_SECONDS)
+
+
+def get_max_pause_seconds():
+    """How long an attempt may stay paused before the sweeper submits it"""
+    return cint(frappe.conf.get("exam_max_pause_seconds") or DEFAULT_MAX_PAUSE_SECONDS)
+
+
+def get_pause_cutoff():
+    """Attempts paused before this are abandoned"""
+    return add_to_date(now_datetime(), seconds=-get_max_pause_seconds())
+
+
+def compute_deadline(start_time, time_limit_minutes):
+    if not time_limit_minutes or time_limit_minutes <= 0:
+        return None
+    return add_to_date(get_datetime(start_time), minutes=time_limit_minutes)
+
+
+def get_attempt_deadline(attempt, time_limit_minutes=None):
+    """Stored deadline, or start_time + limit for attempts created before deadlines existed"""
+    if attempt.get("deadline"):
+        return get_datetime(attempt.deadline)
+    if time_limit_minutes is None:
+        time_limit_minutes = frappe.get_cached_value("Test", attempt.test, "time_limit_minutes")
+    deadline = compute_deadline(attempt.start_time, time_limit_minutes)
+    if deadline and cint(attempt.get("paused_seconds")):
+        deadline = add_to_date(deadline, seconds=cint(attempt.paused_seconds))
+    return deadline
+
+
+def get_remaining_seconds(attempt, time_limit_minutes=None):
+    """Seconds left on the attempt's clock; None for untimed tests. A paused clock doesn't run."""
+    deadline = get_attempt_deadline(attempt, time_limit_minutes)
+    if not deadline:
+        return None
+    reference = get_datetime(attempt.paused_at) if attempt.get("paused_at") else now_datetime()
+    return max(0, int((deadline - reference).total_seconds()))
+
+
+def is_attempt_expired(attempt, grace_seconds=0, time_limit_minutes=None):
+    """Past the deadline (+ grace), or paused for longer than the max pause length"""
+    if attempt.get("paused_at"):
+        return get_datetime(attempt.paused_at) < get_pause_cutoff()
+    deadline = get_attempt_deadline(attempt, time_limit_minutes)
+    if not deadline:
+        return False
+    return now_datetime() > add_to_date(deadline, seconds=grace_seconds)
+
+
+def pause_attempt_clock(attempt_doc):
+    if not attempt_doc.get("paused_at"):
+        attempt_doc.paused_at = now_datetime()
+
+
+def resume_attempt_clock(attempt_doc, time_limit_minutes=None):
+    """Close the open pause interval: push the deadline back by its length"""
+    if not attempt_doc.get("paused_at"):
+        return
+    paused_for = max(0, int((now_datetime() - get_datetime(attempt_doc.paused_at)).total_seconds()))
+    deadline = get_attempt_deadline(attempt_doc, time_limit_minutes)
+    attempt_doc.paused_seconds = cint(attempt_doc.get("paused_seconds")) + paused_for
+    if deadline:
+        attempt_doc.deadline = add_to_date(deadline, seconds=paused_for)
+    attempt_doc.paused_at = None
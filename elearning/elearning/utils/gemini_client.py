@@ -0,0 +1,271 @@
+# elearning/elearning/utils/gemini_client.py
+import json
+import os
+import re
+import time
+
+import frappe
+import requests
+
+from elearning.elearning.utils.circuit_breaker import (
+    CircuitOpenError, before_call, record_failure, record_success, get_breaker_state
+)
+
+logger = frappe.logger("gemini_client")
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.0-flash"
+DEFAULT_TIMEOUT = 30
+BREAKER_NAME = "gemini"
+# A call taking more than this share of its timeout counts as a breaker failure
+SLOW_CALL_RATIO = 0.5
+
+
+class GeminiError(Exception):
+    """Gemini call failed (HTTP error, broken stream or unexpected response shape)"""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class GeminiSchemaError(GeminiError):
+    """Gemini answered, but the JSON doesn't match the requested responseSchema"""
+
+
+class GeminiUnavailableError(GeminiError):
+    """The circuit breaker is open: Gemini was failing or slow, the call was not made"""
+
+
+def _is_outage(error):
+    """Errors that say Gemini itself is unhealthy, as opposed to a bad request"""
+    if isinstance(error, requests.exceptions.RequestException):
+        return True
+    return isinstance(error, GeminiError) and error.status_code in (429, 500, 502, 503, 504)
+
+
+def _acquire_call():
+    try:
+        return before_call(BREAKER_NAME)
+    except CircuitOpenError:
+        raise GeminiUnavailableError("Gemini is temporarily unavailable (circuit open)")
+
+
+def _release_call(probe, started, timeout, error=None):
+    slow = time.monotonic() - started > timeout * SLOW_CALL_RATIO
+    if (error is not None and _is_outage(error)) or slow:
+        record_failure(BREAKER_NAME, probe)
+    else:
+        record_success(BREAKER_NAME, probe)
+
+
+def _guarded_request(method, url, timeout, **kwargs):
+    """requests.request behind the Gemini circuit breaker"""
+    probe = _acquire_call()
+    started = time.monotonic()
+    try:
+        response = requests.request(method, url, timeout=timeout, **kwargs)
+    except requests.exceptions.RequestException as e:
+        _release_call(probe, started, timeout, e)
+        raise
+    error = None
+    if response.status_code != 200:
+        error = GeminiError(f"Gemini API error {response.status_code}", response.status_code, response.text)
+    _release_call(probe, started, timeout, error)
+    return response
+
+
+def get_api_key():
+    return frappe.conf.get("gemini_api_key") or os.environ.get("GEMINI_API_KEY")
+
+
+def get_base_url():
+    """gemini_base_url in site_config points every call at another server (e.g. `bench gemini-stub`)"""
+    return (frappe.conf.get("gemini_base_url") or GEMINI_BASE_URL).rstrip("/")
+
+
+def get_model_url(method, model=DEFAULT_MODEL, api_key=None):
+    """URL of `models/{model}:{method}`, e.g. method="generateContent" """
+    return f"{get_base_url()}/models/{model}:{method}?key={api_key or get_api_key()}"
+
+
+def extract_text(response_json):
+    """Concatenate the text parts of the first candidate ("" when there is none)"""
+    candidates = (response_json or {}).get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+def generate_content(payload, model=DEFAULT_MODEL, api_key=None, timeout=DEFAULT_TIMEOUT):
+    """Blocking generateContent call, returns the decoded response JSON"""
+    response = _guarded_request("POST", get_model_url("generateContent", model, api_key), timeout, json=payload)
+    if response.status_code != 200:
+        raise GeminiError(f"Gemini API error {response.status_code}", response.status_code, response.text)
+    return response.json()
+
+
+def _cached_content_request(method, path, api_key=None, params=None, **kwargs):
+    params = dict(params or {}, key=api_key or get_api_key())
+    response = _guarded_request(method, f"{get_base_url()}/{path}", DEFAULT_TIMEOUT, params=params, **kwargs)
+    if response.status_code != 200:
+        raise GeminiError(f"Gemini cachedContents error {response.status_code}", response.status_code, response.text)
+    return response.json()
+
+
+def create_cached_content(system_instruction, ttl_seconds, model=DEFAULT_MODEL, api_key=None, display_name=None):
+    """
+    Store `system_instruction` server-side for `ttl_seconds`. Returns the
+    resource name ("cachedContents/...") to send as `cachedContent`.
+    Gemini refuses prefixes below the model's minimum cache size (GeminiError 400).
+    """
+    body = {
+        "model": f"models/{model}",
+        "systemInstruction": {"parts": [{"text": system_instruction}]},
+        "ttl": f"{int(ttl_seconds)}s",
+    }
+    if display_name:
+        body["displayName"] = display_name
+    return _cached_content_request("POST", "cachedContents", api_key, json=body)["name"]
+
+
+def update_cached_content_ttl(name, ttl_seconds, api_key=None):
+    """Extend the expiry of an existing cached content to now + `ttl_seconds`"""
+    _cached_content_request("PATCH", name, api_key, params={"updateMask": "ttl"}, json={"ttl": f"{int(ttl_seconds)}s"})
+
+
+def delete_cached_content(name, api_key=None):
+    _cached_content_request("DELETE", name, api_key)
+
+
+def stream_generate_content(payload, model=DEFAULT_MODEL, api_key=None, timeout=DEFAULT_TIMEOUT):
+    """
+    streamGenerateContent over server-sent events: yields each text chunk as
+    soon as Gemini sends it. `timeout` applies to the connection and to the
+    gap between two chunks, not to the whole answer.
+    """
+    url = get_model_url("streamGenerateContent", model, api_key) + "&alt=sse"
+    # Only the time to the first byte counts towards the breaker, a long answer isn't slow
+    with _guarded_request("POST", url, timeout, json=payload, stream=True) as response:
+        if response.status_code != 200:
+            raise GeminiError(f"Gemini API error {response.status_code}", response.status_code, response.text)
+
+        # text/event-stream has no charset, requests would fall back to latin-1
+        response.encoding = "utf-8"
+        for line in response.iter_lines(decode_unicode=True):
+            # SSE frames are "data: {...}" lines separated by blank lines
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if not data:
+                continue
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError as e:
+                raise GeminiError(f"Malformed stream chunk from Gemini: {e}", body=data)
+            text = extract_text(chunk)
+            if text:
+                yield text
+
+
+def with_json_schema(payload, schema):
+    """
+    Copy of `payload` asking Gemini for JSON matching `schema` (an OpenAPI
+    subset: type OBJECT/ARRAY/STRING/NUMBER/INTEGER/BOOLEAN, properties,
+    required, items, nullable).
+    """
+    generation_config = dict(payload.get("generationConfig") or {})
+    generation_config.update({"responseMimeType": "application/json", "responseSchema": schema})
+    return dict(payload, generationConfig=generation_config)
+
+
+def validate_response(value, schema, path="$"):
+    """
+    Check `value` against `schema` and return it normalized (NUMBER as float,
+    INTEGER as int, unknown object keys dropped). Raises GeminiSchemaError.
+    """
+    if value is None:
+        if schema.get("nullable"):
+            return None
+        raise GeminiSchemaError(f"{path} is null")
+
+    expected = schema.get("type", "STRING").upper()
+    if expected == "OBJECT":
+        if not isinstance(value, dict):
+            raise GeminiSchemaError(f"{path} should be an object")
+        missing = [key for key in schema.get("required", []) if key not in value]
+        if missing:
+            raise GeminiSchemaError(f"{path} is missing {', '.join(missing)}")
+        return {
+            key: validate_response(value[key], sub_schema, f"{path}.{key}")
+            for key, sub_schema in schema.get("properties", {}).items()
+            if key in value
+        }
+    if expected == "ARRAY":
+        if not isinstance(value, list):
+            raise GeminiSchemaError(f"{path} should be an array")
+        return [validate_response(item, schema.get("items", {}), f"{path}[{i}]") for i, item in enumerate(value)]
+    if expected == "STRING":
+        if not isinstance(value, str):
+            raise GeminiSchemaError(f"{path} should be a string")
+        return value
+    if expected == "BOOLEAN":
+        if not isinstance(value, bool):
+            raise GeminiSchemaError(f"{path} should be a boolean")
+        return value
+    # NUMBER / INTEGER; bool is an int subclass but never a valid score
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise GeminiSchemaError(f"{path} should be a number")
+    if expected == "INTEGER":
+        if float(value) != int(value):
+            raise GeminiSchemaError(f"{path} should be an integer")
+        return int(value)
+    return float(value)
+
+
+def parse_json_response(text, schema):
+    """Decode the JSON text of a responseSchema call and validate it"""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise GeminiSchemaError(f"Gemini returned invalid JSON: {e}", body=text)
+    return validate_response(data, schema)
+
+
+def generate_json(payload, schema, model=DEFAULT_MODEL, api_key=None, timeout=DEFAULT_TIMEOUT):
+    """generateContent in JSON mode, returns the validated object"""
+    response_json = generate_content(with_json_schema(payload, schema), model, api_key, timeout)
+    text = extract_text(response_json)
+    if not text:
+        block_reason = (response_json.get("promptFeedback") or {}).get("blockReason")
+        raise GeminiError(f"Gemini returned no content (blockReason: {block_reason or 'unknown'})", body=response_json)
+    return parse_json_response(text, schema)
+
+
+def extract_partial_json_strings(text, keys):
+    """
+    Read string fields out of an incomplete JSON object while it streams:
+    {key: value so far}, "" for keys that haven't started yet.
+    """
+    values = {}
+    for key in keys:
+        match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % re.escape(key), text)
+        if not match:
+            values[key] = ""
+            continue
+        # A chunk can end in the middle of an escape sequence
+        raw = re.sub(r"\\(u[0-9a-fA-F]{0,3})?$", "", match.group(1))
+        try:
+            values[key] = json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            values[key] = raw
+    return values
+
+
+@frappe.whitelist()
+def get_gemini_breaker_state():
+    """Circuit breaker state of the Gemini dependency, for monitoring/alerting"""
+    frappe.only_for("System Manager")
+    return get_breaker_state(BREAKER_NAME)
@@ -5,9 +5,36 @@ import json
 import os
 import base64
 import logging
+from elearning.elearning.utils.gemini_client import GeminiError, GeminiSchemaError, GeminiUnavailableError
+from elearning.elearning.utils.prompt_templates import generate_json_with_template
 
 logger = frappe.logger("gemini_essay_grader") # Giữ nguyên logger name từ code bạn cung cấp
 
+ESSAY_GRADE_TIMEOUT = 180
+# Gemini JSON-mode schema of an essay grade
+ESSAY_GRADE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "total_score_awarded": {"type": "NUMBER"},
+        "overall_feedback": {"type": "STRING"},
+        "rubric_scores": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "rubric_item_id": {"type": "STRING"},
+                    "description": {"type": "STRING"},
+                    "max_score": {"type": "NUMBER"},
+                    "points_awarded": {"type": "NUMBER"},
+                    "comment": {"type": "STRING"},
+                },
+                "required": ["rubric_item_id", "points_awarded"],
+            },
+        },
+    },
+    "required": ["total_score_awarded", "overall_feedback", "rubric_scores"],
+}
+
 def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_items, file_doc_names, student_answer_text=None):
     GEMINI_API_KEY = frappe.conf.get("gemini_api_key") or os.environ.get("GEMINI_API_KEY")
 
@@ -20,8 +47,8 @@ def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_
             "error": True
         }
 
+    # Vai trò và yêu cầu chấm điểm là prompt template "essay_grading", ở đây chỉ có đề bài và bài làm
     prompt_parts_text = [
-        f"Bạn là một trợ lý chấm điểm AI chuyên nghiệp cho các bài thi học thuật. Hãy chấm điểm câu trả lời cho câu hỏi tự luận sau đây một cách cẩn thận dựa trên thang điểm (rubric) được cung cấp. Nếu học sinh trả lời hoặc trình bày thừa, hoặc viết lại một bước nào đó mà không ảnh hưởng đến bài toán, thì không trừ điểm.",
         f"Câu hỏi: {question_doc_content}",
     ]
 
@@ -129,31 +156,6 @@ def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_
             "error": False 
         }
 
-    prompt_parts_text.append("\nYêu cầu cụ thể cho AI:")
-    prompt_parts_text.append("1. Phân tích kỹ lưỡng nội dung bài làm của học sinh (cả phần văn bản và hình ảnh nếu có).")
-    prompt_parts_text.append("2. Đối chiếu với TỪNG TIÊU CHÍ trong thang điểm đã cung cấp.")
-    prompt_parts_text.append("3. Cho điểm cụ thể cho mỗi tiêu chí (từ 0 đến điểm tối đa của tiêu chí đó). Điểm phải là số. Nếu chỉ đưa đáp án mà không có lời giải thích thì không cho điểm.")
-    prompt_parts_text.append("4. Viết nhận xét ngắn gọn, giải thích lý do cho điểm số của từng tiêu chí.")
-    prompt_parts_text.append("5. Tính tổng điểm đạt được của học sinh cho câu hỏi này.")
-    prompt_parts_text.append("6. Viết một nhận xét tổng quan, mang tính xây dựng về toàn bộ bài làm của học sinh cho câu hỏi này.")
-    prompt_parts_text.append("\nĐỊNH DẠNG TRẢ VỀ (QUAN TRỌNG):")
-    prompt_parts_text.append("Hãy trả lời bằng một đối tượng JSON duy nhất, không có ký tự ```json hoặc markdown nào bao quanh. JSON phải có cấu trúc chính xác như sau (sử dụng tiếng Việt có dấu):")
-    prompt_parts_text.append("""
-{
-  "total_score_awarded": 0.0,
-  "overall_feedback": "string",
-  "rubric_scores": [
-    {
-      "rubric_item_id": "string",
-      "description": "string",
-      "max_score": 0.0,
-      "points_awarded": 0.0,
-      "comment": "string"
-    }
-  ]
-}
-""")
-
     gemini_request_parts = [{"text": "\n".join(prompt_parts_text)}]
     if has_valid_image_content:
         gemini_request_parts.extend(image_data_parts_for_gemini)
@@ -163,9 +165,8 @@ def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_
     payload = {
         "contents": [{"parts": gemini_request_parts}],
         "generationConfig": {
-            "response_mime_type": "application/json",
             "temperature": 0.3,
-            "max_output_tokens": 8192,
+            "maxOutputTokens": 8192,
         },
          "safetySettings": [
             {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
@@ -180,8 +181,6 @@ def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_
         "generationConfig": payload["generationConfig"],"safetySettings": payload["safetySettings"]
     }
     logger.debug(f"Gemini Payload Summary for Q {question_name_for_log}: {json.dumps(payload_summary_for_log, indent=2)}")
-    api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-
 
     default_error_response = {
         "total_score_awarded": 0,
@@ -191,50 +190,14 @@ def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_
     }
 
     try:
-        print(f"Sending request to Gemini for Q {question_name_for_log}...")
-        response = requests.post(api_url, json=payload, headers={"Content-Type": "application/json"}, timeout=180)
-        print(f"Gemini API response status for Q {question_name_for_log}: {response.status_code}")
-        
-        if not response.ok:
-            error_body = response.text
-            logger.error(f"Gemini API request failed for Q {question_name_for_log}. Status: {response.status_code}, Body: {error_body}")
-            try:
-                error_json = response.json()
-                error_message_detail = error_json.get("error", {}).get("message", error_body)
-            except json.JSONDecodeError:
-                error_message_detail = error_body
-            default_error_response["overall_feedback"] = f"Lỗi API Gemini ({response.status_code}): {error_message_detail}"
-            return default_error_response
-
-        api_response_json = response.json()
-
-        if not api_response_json.get("candidates") or \
-           not api_response_json["candidates"][0].get("content") or \
-           not api_response_json["candidates"][0]["content"].get("parts") or \
-           not api_response_json["candidates"][0]["content"]["parts"][0].get("text"):
-            logger.error(f"Gemini API response for Q {question_name_for_log} missing expected structure. Response: {json.dumps(api_response_json)}")
-            error_message_detail = "Phản hồi không hợp lệ từ API Gemini (thiếu cấu trúc nội dung)."
-            if api_response_json.get("promptFeedback"):
-                prompt_feedback_info = api_response_json.get("promptFeedback")
-                logger.error(f"  Prompt Feedback from Gemini: {prompt_feedback_info}")
-                error_message_detail += f" Lý do từ Gemini: {prompt_feedback_info.get('blockReason', 'Không rõ') if prompt_feedback_info else 'Không rõ'}."
-            default_error_response["overall_feedback"] = error_message_detail
-            return default_error_response
-
-        generated_text_json_string = api_response_json["candidates"][0]["content"]["parts"][0]["text"]
-        print(f"Generated text (JSON string) from Gemini for Q {question_name_for_log}: {generated_text_json_string[:500]}...")
-        parsed_result = json.loads(generated_text_json_string)
-
-        if not isinstance(parsed_result, dict) or \
-           not all(k in parsed_result for k in ["total_score_awarded", "overall_feedback", "rubric_scores"]) or \
-           not isinstance(parsed_result["rubric_scores"], list):
-            logger.error(f"Gemini API response JSON for Q {question_name_for_log} is not in the expected format. Raw: {generated_text_json_string}")
-            default_error_response["overall_feedback"] = f"Lỗi định dạng JSON phản hồi từ AI: {generated_text_json_string}"
-            return default_error_response
-
-        print(f"Successfully graded essay {question_name_for_log} with Gemini. Score: {parsed_result.get('total_score_awarded')}")
-        return parsed_result
-
+        parsed_result = generate_json_with_template(payload, ESSAY_GRADE_SCHEMA, "essay_grading", api_key=GEMINI_API_KEY, timeout=ESSAY_GRADE_TIMEOUT)
+    except GeminiUnavailableError:
+        # Không gọi Gemini khi circuit đang mở: bài luận chuyển sang chờ chấm, không bắt học sinh đợi timeout
+        logger.warning(f"Gemini circuit open, essay Q {question_name_for_log} is queued for grading.")
+        default_error_response["overall_feedback"] = "Dịch vụ chấm điểm AI đang quá tải, bài làm đã được đưa vào hàng chờ chấm."
+        # test_attempt.grade_deferred_essays chấm lại khi circuit đóng
+        default_error_response["deferred"] = True
+        return default_error_response
     except requests.exceptions.Timeout:
         logger.error(f"Gemini API request timed out for Q {question_name_for_log}.", exc_info=True)
         default_error_response["overall_feedback"] = "Lỗi: Yêu cầu chấm điểm tới AI bị quá thời gian."
@@ -243,16 +206,42 @@ def grade_essay_with_gemini(question_doc_content, question_name_for_log, rubric_
         logger.error(f"Gemini API request (RequestException) failed for Q {question_name_for_log}: {e_req}", exc_info=True)
         default_error_response["overall_feedback"] = f"Lỗi kết nối tới dịch vụ chấm điểm AI: {e_req}"
         return default_error_response
-    except json.JSONDecodeError as e_json_dec:
-        raw_resp_text_for_log = "N/A"
-        if 'response' in locals() and hasattr(response, 'text'):
-            raw_resp_text_for_log = response.text[:1000] + "..." if len(response.text) > 1000 else response.text
-        elif 'generated_text_json_string' in locals():
-             raw_resp_text_for_log = generated_text_json_string[:1000] + "..." if len(generated_text_json_string) > 1000 else generated_text_json_string
-        logger.error(f"Failed to parse JSON response from Gemini for Q {question_name_for_log}: {e_json_dec}. Response text sample: {raw_resp_text_for_log}", exc_info=True)
-        default_error_response["overall_feedback"] = f"Lỗi đọc/phân tích phản hồi JSON từ AI. Vui lòng kiểm tra log để xem nội dung thô."
+    except GeminiSchemaError as e_schema:
+        logger.error(f"Gemini response for Q {question_name_for_log} doesn't match the grading schema: {e_schema}. Raw: {e_schema.body}")
+        default_error_response["overall_feedback"] = f"Lỗi định dạng JSON phản hồi từ AI: {e_schema}"
+        return default_error_response
+    except GeminiError as e_api:
+        logger.error(f"Gemini API request failed for Q {question_name_for_log}. Status: {e_api.status_code}, Body: {e_api.body}")
+        default_error_response["overall_feedback"] = f"Lỗi API Gemini ({e_api.status_code}): {get_error_message(e_api)}"
         return default_error_response
     except Exception as e_unexpected:
         logger.error(f"Unexpected error during Gemini grading for Q {question_name_for_log}: {e_unexpected}", exc_info=True)
         default_error_response["overall_feedback"] = f"Lỗi không xác định trong quá trình chấm điểm AI: {e_unexpected}"
-        return default_error_response
\ No newline at end of file
+        return default_error_response
+
+    return clamp_rubric_scores(parsed_result, rubric_items)
+
+
+def get_error_message(gemini_error):
+    """Gemini puts a readable message in {"error": {"message"}}, fall back to the raw body"""
+    try:
+        return json.loads(gemini_error.body).get("error", {}).get("message", gemini_error.body)
+    except (TypeError, ValueError, AttributeError):
+        return gemini_error.body or str(gemini_error)
+
+
+def clamp_rubric_scores(parsed_result, rubric_items):
+    """
+    Keep each rubric score within [0, max_score] of its rubric item and
+    recompute the total from the rubric scores when there are any.
+    """
+    max_by_id = {item.get("id"): item.get("max_score") for item in rubric_items or []}
+    for score in parsed_result["rubric_scores"]:
+        max_score = max_by_id.get(score["rubric_item_id"])
+        points = max(score["points_awarded"], 0.0)
+        if max_score is not None:
+            points = min(points, float(max_score))
+        score["points_awarded"] = points
+    if parsed_result["rubric_scores"]:
+        parsed_result["total_score_awarded"] = sum(score["points_awarded"] for score in parsed_result["rubric_scores"])
+    return parsed_result
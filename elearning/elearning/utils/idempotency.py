@@ -0,0 +1,107 @@
+# elearning/elearning/utils/idempotency.py
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, get_datetime, add_to_date, cint
+
+logger = frappe.logger("idempotency")
+
+# A submission still "Processing" after this long is assumed dead (worker killed) and can be retried
+DEFAULT_STALE_SUBMISSION_SECONDS = 15 * 60
+
+
+def get_idempotency_key(idempotency_key=None):
+    """Key from the whitelisted argument, falling back to the Idempotency-Key header"""
+    key = idempotency_key or frappe.get_request_header("Idempotency-Key")
+    key = (key or "").strip()
+    if len(key) > 140:
+        frappe.throw(_("Idempotency key is too long."), frappe.ValidationError)
+    return key or None
+
+
+def _is_stale(started_at):
+    stale_after = cint(frappe.conf.get("submission_stale_seconds") or DEFAULT_STALE_SUBMISSION_SECONDS)
+    return not started_at or get_datetime(started_at) < add_to_date(now_datetime(), seconds=-stale_after)
+
+
+def run_idempotent_submission(attempt_id, idempotency_key, submit, in_flight_response):
+    """
+    Run `submit()` at most once per (attempt, key).
+
+    The key is claimed on the Test Attempt row under SELECT ... FOR UPDATE and
+    committed before any work starts, so a retry arriving while the first
+    request is still grading sees "Processing" and gets `in_flight_response`
+    (HTTP 202) instead of decoding images, inserting Files and calling the LLM
+    again. Once done the result is stored on the attempt and replayed for every
+    retry with the same key; a different key on a submitted attempt gets HTTP
+    409. A failed submission restores the previous claim so the client can
+    retry it. Callers check ownership of the attempt before calling this.
+
+    Args:
+        attempt_id (str): Test Attempt name
+        idempotency_key (str): Client generated key; None runs `submit()` unguarded
+        submit (callable): Does the submission and returns a JSON-serializable result
+        in_flight_response (dict): Returned while another request holds the key
+    """
+    if not idempotency_key:
+        return submit()
+
+    claim = frappe.db.get_value(
+        "Test Attempt",
+        attempt_id,
+        ["submission_key", "submission_status", "submission_started_at", "submission_result"],
+        as_dict=True,
+        for_update=True,
+    )
+    if not claim:
+        frappe.throw(_("Test Attempt {0} not found.").format(attempt_id), frappe.DoesNotExistError)
+
+    if claim.submission_status == "Done":
+        frappe.db.rollback()
+        if claim.submission_key != idempotency_key:
+            logger.info(f"Rejected a new submission key for already submitted attempt {attempt_id}.")
+            frappe.local.response["http_status_code"] = 409
+            return {"status": "Done", "attemptId": attempt_id, "message": _("This attempt has already been submitted.")}
+        logger.info(f"Replaying stored submission result of attempt {attempt_id}.")
+        return json.loads(claim.submission_result) if isinstance(claim.submission_result, str) else claim.submission_result
+
+    if claim.submission_status == "Processing" and not _is_stale(claim.submission_started_at):
+        frappe.db.rollback()
+        frappe.local.response["http_status_code"] = 202
+        return in_flight_response
+
+    # Claim the key (or take over a dead claim) and release the row lock right away
+    frappe.db.set_value(
+        "Test Attempt",
+        attempt_id,
+        {"submission_key": idempotency_key, "submission_status": "Processing", "submission_started_at": now_datetime()},
+        update_modified=False,
+    )
+    frappe.db.commit()
+
+    try:
+        result = submit()
+    except Exception:
+        frappe.db.rollback()
+        frappe.db.set_value(
+            "Test Attempt",
+            attempt_id,
+            {
+                "submission_key": claim.submission_key,
+                "submission_status": claim.submission_status,
+                "submission_started_at": claim.submission_started_at,
+            },
+            update_modified=False,
+        )
+        frappe.db.commit()
+        raise
+
+    frappe.db.set_value(
+        "Test Attempt",
+        attempt_id,
+        {"submission_status": "Done", "submission_result": json.dumps(result, default=str)},
+        update_modified=False,
+    )
+    frappe.db.commit()
+    return result
@@ -0,0 +1,348 @@
+# elearning/elearning/utils/local_grader.py
+import cmath
+import re
+import unicodedata
+
+import frappe
+from frappe.utils import strip_html_tags, flt
+
+from elearning.elearning.utils.math_answer import canonicalize, parse_math_number
+
+try:
+    import sympy
+    from sympy.parsing.sympy_parser import (
+        parse_expr, standard_transformations, implicit_multiplication_application, convert_xor
+    )
+except ImportError:  # declared in pyproject.toml; without it formula answers only get string/numeric matching
+    sympy = None
+
+# Deterministic grading tier that runs before Gemini for flashcard answers.
+# Each matcher returns a LocalGrade dict or None; a grade whose confidence
+# reaches get_confidence_threshold() is final and needs no network call.
+DEFAULT_CONFIDENCE_THRESHOLD = 0.85
+DEFAULT_NUMERIC_TOLERANCE = 1e-6
+# Longer answers are rarely a single formula, they go to the LLM
+MAX_SYMBOLIC_LENGTH = 120
+# "9^9^9^9" would never finish: exponents must be short numbers or one flat group, not nested
+MAX_EXPONENT_DIGITS = 2
+MAX_POWERS = 3
+# Equivalence is checked numerically at these points instead of with simplify(),
+# whose run time has no bound (and no timeout works in threaded workers).
+# Irregular values, so different formulas rarely agree on all of them
+SYMBOLIC_SAMPLE_POINTS = (0.37, -1.29, 2.71, -0.58, 1.83)
+SYMBOLIC_TOLERANCE = 1e-9
+MIN_SYMBOLIC_SAMPLES = 3
+# parse_expr evaluates its input: only arithmetic, single-letter variables and these names reach it
+SYMBOLIC_NAMES = {"sqrt", "pi", "sin", "cos", "tan", "cot", "log", "ln", "exp", "abs"}
+SYMBOLIC_TYPES = ("Concept/Theorem/Formula", "Fill in the Blank", "What's the Next Step?")
+
+SYMPY_TRANSFORMATIONS = (
+    standard_transformations + (implicit_multiplication_application, convert_xor) if sympy else None
+)
+LATEX_REPLACEMENTS = (
+    (r"\\[dt]?frac\{([^{}]*)\}\{([^{}]*)\}", r"((\1)/(\2))"),
+    (r"\\sqrt\{([^{}]*)\}", r"sqrt(\1)"),
+    (r"\\(cdot|times)", "*"),
+    (r"\\div", "/"),
+    (r"\\left|\\right", ""),
+    (r"\\pi", "pi"),
+)
+
+
+def get_confidence_threshold():
+    return flt(frappe.conf.get("flashcard_local_grade_threshold") or DEFAULT_CONFIDENCE_THRESHOLD)
+
+
+def _grade(is_correct, confidence, method, score=None):
+    return {
+        "is_correct": is_correct,
+        "confidence": confidence,
+        "method": method,
+        "score": (1.0 if is_correct else 0.0) if score is None else score,
+    }
+
+
+def to_plain_text(value):
+    """Flashcard answers are Text Editor HTML, possibly with \\( \\) / \\[ \\] math delimiters"""
+    text = strip_html_tags(value or "")
+    text = text.replace("&nbsp;", " ").replace("&lt;", "<").replace("&gt;", ">").replace("&amp;", "&")
+    text = re.sub(r"\\[()\[\]]|\$", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_text(value, strip_diacritics=False):
+    text = to_plain_text(value).lower()
+    if strip_diacritics:
+        # "đ" is a separate letter, not a combining mark
+        text = unicodedata.normalize("NFD", text.replace("đ", "d"))
+        text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    else:
+        text = unicodedata.normalize("NFC", text)
+    text = re.sub(r"\s*([=+\-*/^(),;:])\s*", r"\1", text)
+    return text.strip(" .;,!")
+
+
+def match_text(user_answer, correct_answer):
+    if not correct_answer or not user_answer:
+        return None
+    if normalize_text(user_answer) == normalize_text(correct_answer):
+        return _grade(True, 1.0, "exact")
+    if normalize_text(user_answer, True) == normalize_text(correct_answer, True):
+        # Gõ thiếu dấu tiếng Việt: gần như chắc chắn cùng một đáp án
+        return _grade(True, 0.9, "diacritics")
+    return None
+
+
+def parse_number(value):
+    """"3,5" / "3.5" / "1/2" / "\\frac{1}{2}" / "50%" -> Fraction, None if it isn't a single number"""
+    return parse_math_number(canonicalize(to_plain_text(value)))
+
+
+def match_number(user_answer, correct_answer):
+    expected = parse_number(correct_answer)
+    if expected is None:
+        return None
+    actual = parse_number(user_answer)
+    if actual is None:
+        return None
+    tolerance = flt(frappe.conf.get("flashcard_numeric_tolerance") or DEFAULT_NUMERIC_TOLERANCE)
+    if abs(actual - expected) <= tolerance * max(1, abs(expected)):
+        return _grade(True, 1.0, "numeric")
+    return _grade(False, 0.95, "numeric")
+
+
+def _check_exponents(text):
+    """Reject power towers and huge exponents before SymPy gets to evaluate them"""
+    text = text.replace("**", "^")
+    if text.count("^") > MAX_POWERS:
+        raise ValueError("Too many powers in formula")
+    for match in re.finditer(r"\^", text):
+        rest = text[match.end():].lstrip()
+        if rest.startswith("("):
+            depth = 0
+            for end, char in enumerate(rest):
+                depth += {"(": 1, ")": -1}.get(char, 0)
+                if depth == 0:
+                    break
+            exponent, after = rest[:end + 1], rest[end + 1:]
+        else:
+            token = re.match(r"[-+]?[\w.]*", rest).group()
+            exponent, after = token, rest[len(token):]
+        if "^" in exponent or after.lstrip().startswith("^"):
+            raise ValueError("Nested powers in formula")
+        if any(len(digits) > MAX_EXPONENT_DIGITS for digits in re.findall(r"\d+", exponent)):
+            raise ValueError("Exponent too large in formula")
+
+
+def _parse(text):
+    return parse_expr(text, transformations=SYMPY_TRANSFORMATIONS, evaluate=False)
+
+
+def _formula_text(value):
+    """Plain text with the LaTeX commands SymPy understands rewritten"""
+    text = to_plain_text(value)
+    for pattern, replacement in LATEX_REPLACEMENTS:
+        text = re.sub(pattern, replacement, text)
+    return text.replace("{", "(").replace("}", ")").replace("−", "-").replace("×", "*").replace("÷", "/")
+
+
+def _to_sympy(text):
+    if not re.fullmatch(r"[0-9a-zA-Z\s+\-*/^().,=]*", text):
+        raise ValueError("Unsupported characters in formula")
+    _check_exponents(text)
+    # "2ab" -> "2a*b": every name reaching parse_expr is one letter or in SYMBOLIC_NAMES
+    text = re.sub(r"[a-zA-Z]+", lambda m: m.group() if m.group() in SYMBOLIC_NAMES else "*".join(m.group()), text)
+    text = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    if "=" in text:
+        left, _sep, right = text.partition("=")
+        return sympy.Add(_parse(left), sympy.Mul(-1, _parse(right), evaluate=False), evaluate=False)
+    return _parse(text)
+
+
+def looks_like_formula(text):
+    """
+    Words would parse as products of letters ("tam giac" == "giac tam", "tam-giac" == "mat-giac"),
+    so a formula needs a digit or operator, and every run of letters must be one variable,
+    a known function name or a product after a coefficient ("2ab").
+    """
+    if len(text) > MAX_SYMBOLIC_LENGTH or not re.search(r"[\d=+\-*/^]", text):
+        return False
+    return all(
+        len(match.group()) == 1 or match.group() in SYMBOLIC_NAMES or text[:match.start()].rstrip()[-1:].isdigit()
+        for match in re.finditer(r"[a-zA-Z]+", text)
+    )
+
+
+COMPLEX_FUNCTIONS = {
+    "sin": cmath.sin, "cos": cmath.cos, "tan": cmath.tan, "cot": lambda z: 1 / cmath.tan(z),
+    "exp": cmath.exp, "log": cmath.log, "Abs": abs,
+}
+
+
+def _evaluate(expr, values):
+    """
+    Complex value of an unevaluated SymPy tree, walked by hand in floats: SymPy's
+    own evalf/printing works out exact digits first, which never ends for
+    something like exp(exp(exp(99))). Too large values raise OverflowError.
+    """
+    if expr.is_Symbol:
+        return values[expr]
+    if expr.is_Integer or expr.is_Rational:
+        return complex(expr.p / expr.q)
+    if expr.is_Number or expr.is_NumberSymbol:
+        return complex(float(expr))
+    args = [_evaluate(arg, values) for arg in expr.args]
+    if expr.is_Add:
+        return sum(args)
+    if expr.is_Mul:
+        product = 1
+        for arg in args:
+            product *= arg
+        return product
+    if expr.is_Pow:
+        return args[0] ** args[1]
+    function = COMPLEX_FUNCTIONS.get(type(expr).__name__)
+    if not function:
+        raise ValueError(f"Unsupported function {type(expr).__name__}")
+    if type(expr).__name__ == "log" and len(args) == 2:
+        return cmath.log(args[0]) / cmath.log(args[1])
+    return function(*args)
+
+
+def _sample_values(expr, symbols):
+    """expr at SYMBOLIC_SAMPLE_POINTS, None where it's undefined or overflows"""
+    values = []
+    for point in SYMBOLIC_SAMPLE_POINTS:
+        # A different value per variable, so "a-b" and "b-a" don't agree
+        try:
+            value = _evaluate(expr, {symbol: complex(point + 0.61 * index) for index, symbol in enumerate(symbols)})
+        except (ArithmeticError, ValueError, TypeError):
+            value = None
+        values.append(value if value is not None and cmath.isfinite(value) else None)
+    return values
+
+
+def _numerically_equal(actual_values, expected_values, sign=1):
+    pairs = [(a, sign * e) for a, e in zip(actual_values, expected_values) if a is not None and e is not None]
+    return len(pairs) >= MIN_SYMBOLIC_SAMPLES and all(
+        abs(a - e) <= SYMBOLIC_TOLERANCE * max(1, abs(e)) for a, e in pairs
+    )
+
+
+def match_symbolic(user_answer, correct_answer):
+    user_text, correct_text = _formula_text(user_answer), _formula_text(correct_answer)
+    if not sympy or not looks_like_formula(user_text) or not looks_like_formula(correct_text):
+        return None
+    try:
+        expected = _to_sympy(correct_text)
+        actual = _to_sympy(user_text)
+        symbols = sorted(actual.free_symbols | expected.free_symbols, key=str)
+        actual_values, expected_values = _sample_values(actual, symbols), _sample_values(expected, symbols)
+        # Same expression, or the same equation written with sides swapped
+        if _numerically_equal(actual_values, expected_values) or (
+            "=" in correct_text and _numerically_equal(actual_values, expected_values, sign=-1)
+        ):
+            return _grade(True, 0.95, "symbolic")
+    except Exception:
+        # Not a formula (prose answer) or something SymPy can't parse/evaluate
+        return None
+    return None
+
+
+def parse_step_order(user_answer, steps):
+    """
+    Read the student's ordering as a list of correct_order values. Accepts
+    step numbers ("2, 1, 3" / "2 -> 1 -> 3") or one step text per line.
+    Returns None unless every step is used exactly once.
+    """
+    expected_orders = sorted(step.correct_order for step in steps)
+    text = to_plain_text(user_answer)
+
+    numbers = [int(n) for n in re.findall(r"\d+", text)]
+    leftover = re.sub(r"bước|buoc|step|[\d\s,;.\->→()]", "", text.lower())
+    if sorted(numbers) == expected_orders and not leftover:
+        return numbers
+
+    by_text = {normalize_text(step.step_content, True): step.correct_order for step in steps}
+    lines = [normalize_text(re.sub(r"^\s*\d+[.)]\s*", "", line), True) for line in re.split(r"\n|;", strip_html_tags(user_answer or ""))]
+    orders = [by_text[line] for line in lines if line in by_text]
+    if sorted(orders) == expected_orders:
+        return orders
+    return None
+
+
+def spearman_rho(orders):
+    """Rank correlation between the student's sequence and the correct one (1 = identical)"""
+    n = len(orders)
+    if n < 2:
+        return 1.0
+    ranks = {order: rank for rank, order in enumerate(sorted(orders), start=1)}
+    d_squared = sum((position - ranks[order]) ** 2 for position, order in enumerate(orders, start=1))
+    return 1 - 6 * d_squared / (n * (n * n - 1))
+
+
+def match_ordering(user_answer, steps):
+    if not steps:
+        return None
+    orders = parse_step_order(user_answer, steps)
+    if orders is None:
+        return None
+    if orders == sorted(orders):
+        return _grade(True, 1.0, "ordering")
+    correct_sequence = sorted(orders)
+    grade = _grade(False, 0.95, "ordering", score=max(spearman_rho(orders), 0.0))
+    grade["misplaced"] = [position for position, order in enumerate(orders, start=1) if order != correct_sequence[position - 1]]
+    return grade
+
+
+def grade_flashcard_locally(flashcard, user_answer, steps=None):
+    """
+    Try to grade a flashcard answer without the LLM.
+
+    Args:
+        flashcard: Flashcard doc/dict (flashcard_type, answer)
+        user_answer (str): The student's answer
+        steps (list): Ordering Step Item rows (step_content, correct_order) for Ordering Steps
+
+    Returns:
+        dict | None: {"is_correct", "confidence", "method", "score"[, "misplaced"]}
+    """
+    if not (user_answer or "").strip():
+        return None
+    if flashcard.flashcard_type == "Ordering Steps":
+        return match_ordering(user_answer, steps)
+
+    grade = match_text(user_answer, flashcard.answer) or match_number(user_answer, flashcard.answer)
+    if not grade and flashcard.flashcard_type in SYMBOLIC_TYPES:
+        grade = match_symbolic(user_answer, flashcard.answer)
+    return grade
+
+
+def build_local_feedback(grade, flashcard, steps=None):
+    """Templated feedback in the three User Exam Attempt Detail fields"""
+    if grade["method"] == "ordering" and not grade["is_correct"]:
+        correct_steps = "; ".join(f"{step.correct_order}. {to_plain_text(step.step_content)}" for step in sorted(steps, key=lambda s: s.correct_order))
+        positions = ", ".join(str(p) for p in grade["misplaced"])
+        return {
+            "ai_feedback_what_was_correct": f"Bạn đã dùng đủ tất cả các bước, mức độ đúng thứ tự đạt {round(grade['score'] * 100)}%.",
+            "ai_feedback_what_was_incorrect": f"Các vị trí {positions} chưa đúng thứ tự.",
+            "ai_feedback_what_to_include": f"Thứ tự đúng: {correct_steps}"
+        }
+    if not grade["is_correct"]:
+        return {
+            "ai_feedback_what_was_correct": "Bạn đã đưa ra một đáp số cụ thể.",
+            "ai_feedback_what_was_incorrect": f"Đáp số chưa chính xác, đáp án đúng là {to_plain_text(flashcard.answer)}.",
+            "ai_feedback_what_to_include": "Hãy kiểm tra lại từng bước tính toán."
+        }
+    what_was_correct = {
+        "exact": "Câu trả lời của bạn trùng khớp với đáp án.",
+        "diacritics": "Câu trả lời của bạn trùng khớp với đáp án (chỉ khác dấu tiếng Việt).",
+        "numeric": "Đáp số của bạn chính xác.",
+        "symbolic": "Biểu thức của bạn tương đương với đáp án.",
+        "ordering": "Bạn đã sắp xếp các bước đúng thứ tự.",
+    }[grade["method"]]
+    return {
+        "ai_feedback_what_was_correct": what_was_correct,
+        "ai_feedback_what_was_incorrect": "Không có phần nào chưa đúng.",
+        "ai_feedback_what_to_include": "Không cần bổ sung thêm."
+    }
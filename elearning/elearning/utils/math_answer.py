@@ -0,0 +1,95 @@
+# elearning/elearning/utils/math_answer.py
+import re
+from fractions import Fraction
+
+from frappe.utils import flt
+
+# Canonical form of short math answers, so "1/2", "0,5", "\frac{1}{2}" and
+# "x = 0.5" grade the same. Compiling the accepted answers happens once when
+# a Question is saved; matching is string/Fraction comparison only.
+LATEX_REPLACEMENTS = (
+    (r"\\[dt]?frac\{([^{}]*)\}\{([^{}]*)\}", r"(\1)/(\2)"),
+    (r"\\sqrt\{([^{}]*)\}", r"sqrt(\1)"),
+    (r"√\(?([\w.]+)\)?", r"sqrt(\1)"),
+    (r"\\(cdot|times)|[×·]", "*"),
+    (r"\\div|÷", "/"),
+    (r"\\left|\\right|\\[,;!]|\\[()\[\]]|\$", ""),
+    (r"\\pi", "pi"),
+    (r"\\(le|leq)|≤", "<="),
+    (r"\\(ge|geq)|≥", ">="),
+    (r"[−–]", "-"),
+)
+NUMBER_IN_PARENS = re.compile(r"\((-?\d+(?:\.\d+)?)\)")
+VARIABLE_PREFIX = re.compile(r"^[a-z]=(.+)$")
+
+
+def canonicalize(value):
+    """Lowercase, LaTeX stripped to plain math, no whitespace, decimal comma as dot"""
+    text = str(value or "")
+    for pattern, replacement in LATEX_REPLACEMENTS:
+        text = re.sub(pattern, replacement, text)
+    text = text.replace("{", "(").replace("}", ")").lower()
+    text = re.sub(r"\s+", "", text)
+    text = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    return text.rstrip(".;")
+
+
+def parse_math_number(text):
+    """Canonical text -> Fraction for plain numbers, fractions and percents, else None"""
+    previous = None
+    while previous != text:
+        previous, text = text, NUMBER_IN_PARENS.sub(r"\1", text)
+    percent = text.endswith("%")
+    if percent:
+        text = text[:-1]
+    if not re.fullmatch(r"-?\d+(\.\d+)?(/-?\d+(\.\d+)?)?", text):
+        return None
+    try:
+        number = Fraction(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return number / 100 if percent else number
+
+
+def split_accepted_answers(answer_key, accepted_answers=None):
+    answers = [answer_key] + (accepted_answers or "").splitlines()
+    return [answer.strip() for answer in answers if answer and answer.strip()]
+
+
+def compile_answer_key(answers, tolerance=None):
+    """
+    Compile the accepted answers of a Self Write question:
+    {"texts": [canonical texts], "numbers": ["p/q", ...], "tolerance": float}
+    """
+    texts, numbers = set(), set()
+    for answer in answers:
+        canonical = canonicalize(answer)
+        texts.add(canonical)
+        number = parse_math_number(canonical)
+        if number is not None:
+            numbers.add(str(number))
+    return {"texts": sorted(texts), "numbers": sorted(numbers), "tolerance": abs(flt(tolerance))}
+
+
+def match_answer_key(user_answer, compiled):
+    """True if `user_answer` matches one of the compiled accepted answers"""
+    if user_answer is None or not compiled or not compiled.get("texts"):
+        return False
+
+    candidates = [canonicalize(user_answer)]
+    # "x=2" for a key of "2"
+    prefixed = VARIABLE_PREFIX.match(candidates[0])
+    if prefixed and not any("=" in text for text in compiled["texts"]):
+        candidates.append(prefixed.group(1))
+
+    for candidate in candidates:
+        if candidate in compiled["texts"]:
+            return True
+        number = parse_math_number(candidate) if compiled["numbers"] else None
+        if number is None:
+            continue
+        tolerance = compiled.get("tolerance") or 0
+        for expected in compiled["numbers"]:
+            if abs(number - Fraction(expected)) <= tolerance:
+                return True
+    return False
@@ -0,0 +1,58 @@
+# elearning/elearning/utils/pagination.py
+import base64
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+# Keyset (cursor) pagination for history lists ordered by (<timestamp>, name) DESC.
+# The cursor is the sort key of the last row returned, so page N costs the same
+# as page 1 instead of scanning and discarding N * limit rows like OFFSET does.
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(sort_value, name):
+    raw = json.dumps([str(sort_value) if sort_value is not None else None, name])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        sort_value, name = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return sort_value, name
+    except Exception:
+        frappe.throw(_("Invalid cursor."), frappe.ValidationError)
+
+
+def get_page_size(limit, default=DEFAULT_PAGE_SIZE):
+    return min(cint(limit) or default, MAX_PAGE_SIZE)
+
+
+def keyset_condition(sort_column, name_column, cursor, params):
+    """
+    SQL condition selecting rows after `cursor` in (sort_column DESC, name_column DESC)
+    order; adds its values to `params`. Returns "" for the first page.
+    """
+    if not cursor:
+        return ""
+    sort_value, name = decode_cursor(cursor)
+    params["cursor_name"] = name
+    if sort_value is None:
+        # NULL timestamps sort last in DESC order: only NULL rows with a smaller name remain
+        return f"AND {sort_column} IS NULL AND {name_column} < %(cursor_name)s"
+    params["cursor_value"] = sort_value
+    return (
+        f"AND ({sort_column} < %(cursor_value)s"
+        f" OR ({sort_column} = %(cursor_value)s AND {name_column} < %(cursor_name)s)"
+        f" OR {sort_column} IS NULL)"
+    )
+
+
+def get_next_cursor(rows, page_size, sort_field, name_field="name"):
+    """Cursor for the page after `rows` (fetched with page_size + 1), or None on the last page"""
+    if len(rows) <= page_size:
+        return None
+    last = rows[page_size - 1]
+    return encode_cursor(last.get(sort_field), last.get(name_field))
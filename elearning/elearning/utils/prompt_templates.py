@@ -0,0 +1,197 @@
+# elearning/elearning/utils/prompt_templates.py
+import hashlib
+import time
+
+import frappe
+from frappe.utils import cint
+from redis.exceptions import LockError
+
+from elearning.elearning.utils.gemini_client import (
+    DEFAULT_MODEL, DEFAULT_TIMEOUT, GeminiError, create_cached_content, update_cached_content_ttl,
+    delete_cached_content, generate_json, stream_generate_content
+)
+
+logger = frappe.logger("gemini_prompt_cache")
+
+# The fixed instructions of every Gemini prompt live here. Each one is
+# registered once as a Gemini cached context (cachedContents) and calls only
+# send the variable part plus `cachedContent`. Entries are versioned by the
+# hash of model + text, so editing a template creates a fresh context, and
+# are extended before they expire. When caching is unavailable (prefix below
+# the model's minimum cache size, API error) the template goes inline as
+# systemInstruction.
+#
+# Redis: elearning:gemini_prompt_cache  template name -> {"version", "name", "expires_at"}
+#                                                      or {"version", "failed_until"}
+PROMPT_CACHE_KEY = "elearning:gemini_prompt_cache"
+DEFAULT_CACHE_TTL = 60 * 60
+# Extend the context when less than this is left, so no call races the expiry
+REFRESH_MARGIN = 5 * 60
+# A rejected template (4xx) won't be accepted until it changes, transient errors retry sooner
+REJECTED_BACKOFF = 24 * 60 * 60
+FAILURE_BACKOFF = 10 * 60
+CACHE_LOCK_TIMEOUT = 30
+
+PROMPT_TEMPLATES = {
+    "flashcard_feedback": """Bạn là trợ lý AI giáo dục phân tích câu trả lời của học sinh.
+Hãy cung cấp phản hồi cụ thể, mang tính xây dựng về câu trả lời của học sinh so với câu trả lời đúng.
+
+Phản hồi của bạn gồm ba trường JSON:
+1. what_was_correct (Phần đúng): Nêu bật những khía cạnh cụ thể mà học sinh đã làm đúng
+2. what_was_incorrect (Phần chưa đúng): Xác định những lỗi cụ thể hoặc hiểu sai
+3. what_to_include (Phần nên bổ sung): Đề xuất cải tiến cụ thể hoặc thông tin bổ sung
+
+Mỗi phần nên ngắn gọn (2-4 câu). Hãy cụ thể và mang tính giáo dục thay vì chỉ đơn thuần nêu đúng/sai.
+Phản hồi nên giúp học sinh hiểu khái niệm tốt hơn.
+
+Khi cần sử dụng công thức toán học, hãy sử dụng cú pháp LaTeX với \\( \\) cho công thức inline và \\[ \\] cho công thức standalone.
+Ví dụ: "Để tính đạo hàm, ta áp dụng công thức \\( f'(x) = \\lim_{h \\to 0} \\frac{f(x+h) - f(x)}{h} \\)"
+
+Nếu không thể tạo phản hồi do lỗi, hãy cung cấp thông báo lỗi đơn giản.
+
+QUAN TRỌNG: Phản hồi của bạn PHẢI bằng tiếng Việt.""",
+
+    "attempt_summary": (
+        "Dựa trên chi tiết bài làm kiểm tra của học sinh được gửi kèm, bao gồm nội dung câu hỏi, câu trả lời của học sinh, "
+        "kết quả đúng/sai, điểm số đạt được, và đặc biệt là các 'nhan_xet_ai_cho_bai_luan' (nếu có) đối với các câu hỏi tự luận. "
+        "Hãy thực hiện những yêu cầu sau:\n"
+        "1. Phân tích tổng quan về hiệu suất của học sinh. Chú ý đến các chủ đề kiến thức hoặc dạng câu hỏi mà học sinh làm tốt hoặc chưa tốt "
+        "(ví dụ: giải phương trình, đọc hiểu, trắc nghiệm lý thuyết, bài luận về chủ đề X,...). "
+        "Bỏ qua những câu hỏi không được trả lời (có 'cau_tra_loi_hoc_sinh' là null hoặc rỗng) khi đánh giá điểm yếu.\n"
+        "2. Xác định những điểm mạnh và những lĩnh vực kiến thức hoặc kỹ năng còn yếu mà học sinh cần cải thiện.\n"
+        "3. Đưa ra một 'nhận xét tổng quát' (feedback) mang tính xây dựng, tập trung vào những điểm yếu chính.\n"
+        "4. Đề xuất một 'kế hoạch cải thiện' (recommendation) cụ thể, bao gồm các gợi ý về cách học tập hoặc ôn luyện để cải thiện những điểm yếu đó.\n"
+        "Vui lòng trả lời bằng tiếng Việt, 'feedback' và 'recommendation' là hai trường của JSON trả về."
+    ),
+
+    "essay_grading": "\n".join([
+        "Bạn là một trợ lý chấm điểm AI chuyên nghiệp cho các bài thi học thuật. Hãy chấm điểm câu trả lời cho câu hỏi tự luận được gửi kèm một cách cẩn thận dựa trên thang điểm (rubric) được cung cấp. Nếu học sinh trả lời hoặc trình bày thừa, hoặc viết lại một bước nào đó mà không ảnh hưởng đến bài toán, thì không trừ điểm.",
+        "\nYêu cầu cụ thể cho AI:",
+        "1. Phân tích kỹ lưỡng nội dung bài làm của học sinh (cả phần văn bản và hình ảnh nếu có).",
+        "2. Đối chiếu với TỪNG TIÊU CHÍ trong thang điểm đã cung cấp.",
+        "3. Cho điểm cụ thể cho mỗi tiêu chí (từ 0 đến điểm tối đa của tiêu chí đó). Điểm phải là số. Nếu chỉ đưa đáp án mà không có lời giải thích thì không cho điểm.",
+        "4. Viết nhận xét ngắn gọn, giải thích lý do cho điểm số của từng tiêu chí.",
+        "5. Tính tổng điểm đạt được của học sinh cho câu hỏi này.",
+        "6. Viết một nhận xét tổng quan, mang tính xây dựng về toàn bộ bài làm của học sinh cho câu hỏi này.",
+        "\nTrả lời bằng tiếng Việt có dấu, mỗi tiêu chí của thang điểm là một phần tử của 'rubric_scores' với 'rubric_item_id' đúng như ID Tiêu chí trong đề bài.",
+    ]),
+}
+
+
+def get_cache_ttl():
+    return cint(frappe.conf.get("gemini_prompt_cache_ttl")) or DEFAULT_CACHE_TTL
+
+
+def template_version(template_name, model=DEFAULT_MODEL):
+    return hashlib.sha256(f"{model}\n{PROMPT_TEMPLATES[template_name]}".encode()).hexdigest()[:16]
+
+
+def _register(template_name, model, version, api_key):
+    """Create (or extend) the cached context of a template, returns its entry"""
+    cache = frappe.cache()
+    entry = cache.hget(PROMPT_CACHE_KEY, template_name)
+    ttl = get_cache_ttl()
+    now = time.time()
+
+    if entry and entry.get("version") == version and entry.get("name"):
+        try:
+            update_cached_content_ttl(entry["name"], ttl, api_key)
+            entry = dict(entry, expires_at=now + ttl)
+            cache.hset(PROMPT_CACHE_KEY, template_name, entry)
+            return entry
+        except GeminiError as e:
+            # Already expired or deleted on Gemini's side: register a new one
+            logger.info(f"Could not extend cached prompt {template_name}: {e.status_code}")
+
+    if entry and entry.get("name") and entry.get("version") != version:
+        try:
+            delete_cached_content(entry["name"], api_key)
+        except GeminiError:
+            pass  # expires on its own
+
+    try:
+        name = create_cached_content(PROMPT_TEMPLATES[template_name], ttl, model, api_key, display_name=f"elearning-{template_name}-{version}")
+        entry = {"version": version, "name": name, "expires_at": now + ttl}
+    except GeminiError as e:
+        backoff = REJECTED_BACKOFF if e.status_code and 400 <= e.status_code < 500 else FAILURE_BACKOFF
+        logger.info(f"Prompt {template_name} not cached ({e.status_code}), sending it inline for {backoff}s: {e.body}")
+        entry = {"version": version, "failed_until": now + backoff}
+    cache.hset(PROMPT_CACHE_KEY, template_name, entry)
+    return entry
+
+
+def get_cached_content_name(template_name, model=DEFAULT_MODEL, api_key=None):
+    """Name of the live cached context of `template_name`, or None to send it inline"""
+    if not frappe.conf.get("gemini_prompt_cache", 1):
+        return None
+
+    cache = frappe.cache()
+    version = template_version(template_name, model)
+    entry = cache.hget(PROMPT_CACHE_KEY, template_name) or {}
+    now = time.time()
+    if entry.get("version") == version:
+        if entry.get("failed_until", 0) > now:
+            return None
+        if entry.get("name") and entry.get("expires_at", 0) - now > REFRESH_MARGIN:
+            return entry["name"]
+
+    # One worker registers/extends, the others send the template inline meanwhile
+    lock = cache.lock(cache.make_key(f"{PROMPT_CACHE_KEY}:lock:{template_name}"), timeout=CACHE_LOCK_TIMEOUT, blocking_timeout=0)
+    try:
+        with lock:
+            entry = _register(template_name, model, version, api_key)
+    except LockError:
+        # Still valid for a few minutes while the other worker extends it
+        return entry["name"] if entry.get("version") == version and entry.get("name") and entry.get("expires_at", 0) > now else None
+    return entry.get("name")
+
+
+def invalidate_cached_prompt(template_name):
+    frappe.cache().hdel(PROMPT_CACHE_KEY, template_name)
+
+
+def with_prompt_template(payload, template_name, model=DEFAULT_MODEL, api_key=None, use_cache=True):
+    """
+    Copy of `payload` (the variable part of a request) with the fixed
+    instructions of `template_name` attached: as `cachedContent` when a cached
+    context is live, otherwise inline as `systemInstruction`.
+    """
+    cached_name = get_cached_content_name(template_name, model, api_key) if use_cache else None
+    if cached_name:
+        return dict(payload, cachedContent=cached_name)
+    return dict(payload, systemInstruction={"parts": [{"text": PROMPT_TEMPLATES[template_name]}]})
+
+
+def _is_stale_cache_error(error, payload):
+    # A context deleted/expired early is a 403/404 (sometimes 400) on the call that references it
+    return payload.get("cachedContent") and error.status_code in (400, 403, 404)
+
+
+def generate_json_with_template(payload, schema, template_name, model=DEFAULT_MODEL, api_key=None, timeout=DEFAULT_TIMEOUT):
+    """generate_json with the template attached; retries inline once if the cached context is gone"""
+    full_payload = with_prompt_template(payload, template_name, model, api_key)
+    try:
+        return generate_json(full_payload, schema, model, api_key, timeout)
+    except GeminiError as e:
+        if not _is_stale_cache_error(e, full_payload):
+            raise
+        invalidate_cached_prompt(template_name)
+        return generate_json(with_prompt_template(payload, template_name, model, api_key, use_cache=False), schema, model, api_key, timeout)
+
+
+def stream_with_template(payload, template_name, model=DEFAULT_MODEL, api_key=None, timeout=DEFAULT_TIMEOUT):
+    """stream_generate_content with the template attached, same inline retry as generate_json_with_template"""
+    full_payload = with_prompt_template(payload, template_name, model, api_key)
+    try:
+        # The status is checked before the first chunk, so nothing was yielded when this fails
+        stream = stream_generate_content(full_payload, model, api_key, timeout)
+        first = next(stream, None)
+    except GeminiError as e:
+        if not _is_stale_cache_error(e, full_payload):
+            raise
+        invalidate_cached_prompt(template_name)
+        yield from stream_generate_content(with_prompt_template(payload, template_name, model, api_key, use_cache=False), model, api_key, timeout)
+        return
+    if first is not None:
+        yield first
+    yield from stream
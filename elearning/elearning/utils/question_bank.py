@@ -0,0 +1,236 @@
+# elearning/elearning/utils/question_bank.py
+import json
+
+import frappe
+from frappe import _
+from redis.exceptions import LockError
+
+from elearning.elearning.utils.math_answer import compile_answer_key, split_accepted_answers
+
+logger = frappe.logger("question_bank")
+
+# One redis hash for every test payload, field = "{test}:{modified}".
+# A Test save bumps `modified` so old fields are never read again; a Question
+# save doesn't touch the Test, so Question/Test edits clear the whole hash.
+TEST_DATA_CACHE_KEY = "elearning:test_data"
+# Compiled answer keys for grading, same field layout as TEST_DATA_CACHE_KEY
+ANSWER_KEY_CACHE_KEY = "elearning:answer_key"
+TEST_DATA_LOCK_TIMEOUT = 30
+TEST_DATA_LOCK_WAIT = 10
+
+
+def get_questions_by_name(question_names):
+    """Load Question rows (without child tables) in one query, keyed by name"""
+    if not question_names:
+        return {}
+    rows = frappe.get_all(
+        "Question",
+        filters={"name": ["in", list(set(question_names))]},
+        fields=["name", "content", "question_type", "marks", "hint", "image_url", "answer_key", "explanation",
+                "accepted_answers", "answer_tolerance", "compiled_answer_key"],
+    )
+    return {row.name: row for row in rows}
+
+
+def get_options_by_question(question_names):
+    """Load Question Option Item rows for many questions in one query, grouped by question in idx order"""
+    if not question_names:
+        return {}
+    rows = frappe.get_all(
+        "Question Option Item",
+        filters={"parent": ["in", list(set(question_names))], "parenttype": "Question"},
+        fields=["name", "parent", "option_text", "is_correct", "idx"],
+        order_by="parent asc, idx asc",
+    )
+    options = {}
+    for row in rows:
+        options.setdefault(row.parent, []).append(row)
+    return options
+
+
+def get_rubric_items_by_question(question_names):
+    """Load Rubric Item rows for many questions in one query, grouped by question in step order"""
+    if not question_names:
+        return {}
+    rows = frappe.get_all(
+        "Rubric Item",
+        filters={"parent": ["in", list(set(question_names))], "parenttype": "Question"},
+        fields=["name", "parent", "description", "max_score", "step_order"],
+        order_by="parent asc, step_order asc",
+    )
+    rubric = {}
+    for row in rows:
+        rubric.setdefault(row.parent, []).append({
+            "id": row.name,
+            "description": row.description,
+            "max_score": row.max_score,
+            "step_order": row.step_order
+        })
+    return rubric
+
+
+def get_compiled_answer_key(question):
+    """Compiled Self Write key of a Question row (see math_answer.compile_answer_key)"""
+    if question.question_type != "Self Write" or not question.answer_key:
+        return None
+    if question.compiled_answer_key:
+        return json.loads(question.compiled_answer_key)
+    # Saved before keys were compiled
+    return compile_answer_key(split_accepted_answers(question.answer_key, question.accepted_answers), question.answer_tolerance)
+
+
+def get_test_question_items(test_id):
+    return frappe.get_all(
+        "Test Question Item",
+        filters={"parent": test_id, "parenttype": "Test"},
+        fields=["name", "question", "points", "idx"],
+        order_by="idx asc",
+    )
+
+
+def build_test_payload(test_meta):
+    """
+    Build the sanitized test payload (no answers, no rubric) with three bulk
+    queries: Test Question Item, Question and Question Option Item.
+    """
+    items = get_test_question_items(test_meta.name)
+    question_names = [item.question for item in items if item.question]
+    questions = get_questions_by_name(question_names)
+    options_by_question = get_options_by_question(
+        [name for name, q in questions.items() if q.question_type == "Multiple Choice"]
+    )
+
+    sanitized_questions = []
+    for item in items:
+        q = questions.get(item.question)
+        if not q:
+            frappe.log_error(f"Question {item.question} linked in Test {test_meta.name} (Test Question Item: {item.name}) not found.", "TestDataError")
+            continue
+
+        formatted_options = None
+        if q.question_type == "Multiple Choice":
+            formatted_options = [
+                {"id": option.name, "text": option.option_text, "label": chr(65 + idx)}
+                for idx, option in enumerate(options_by_question.get(q.name, []))
+            ]
+
+        sanitized_questions.append({
+            "test_question_detail_id": item.name,  # ID of the Test Question Item row
+            "question_id": q.name,                 # ID of the base Question doc
+            "content": q.content,
+            "image": q.image_url,
+            "question_type": q.question_type,
+            "options": formatted_options,
+            "hint": q.hint,
+            "point_value": item.points,
+            "question_order": item.idx
+        })
+
+    return {
+        "id": test_meta.name,
+        "title": test_meta.title,
+        "time_limit_minutes": test_meta.time_limit_minutes,
+        "instructions": test_meta.instructions,
+        "questions": sanitized_questions
+    }
+
+
+def build_answer_key(test_meta):
+    """
+    Compile the grading data of a test, keyed by Test Question Item name:
+    {"question", "question_type", "points", "content", "correct_option",
+    "answer_key", "answer_key_text", "explanation", "rubric"}. A TQI whose
+    Question no longer exists is kept with question_type None so the grader
+    can report it. Also stored with every published snapshot.
+    """
+    items = get_test_question_items(test_meta.name)
+    question_names = [item.question for item in items if item.question]
+    questions = get_questions_by_name(question_names)
+    options_by_question = get_options_by_question(
+        [name for name, q in questions.items() if q.question_type == "Multiple Choice"]
+    )
+    rubric_by_question = get_rubric_items_by_question(
+        [name for name, q in questions.items() if q.question_type == "Essay"]
+    )
+
+    key = {}
+    for item in items:
+        q = questions.get(item.question)
+        if not q:
+            key[item.name] = {"question": item.question, "question_type": None, "points": 0}
+            continue
+
+        correct_option = next((o.name for o in options_by_question.get(q.name, []) if o.is_correct), None)
+        key[item.name] = {
+            "question": q.name,
+            "question_type": q.question_type,
+            # Chấm theo marks của Question (mặc định 1), giống logic cũ
+            "points": q.marks or 1,
+            "content": q.content,
+            "correct_option": correct_option,
+            "answer_key": get_compiled_answer_key(q),
+            # Shown on the result page
+            "answer_key_text": q.answer_key,
+            "explanation": q.explanation,
+            "rubric": rubric_by_question.get(q.name, [])
+        }
+
+    return {"test": test_meta.name, "passing_score": test_meta.passing_score, "items": key}
+
+
+def _get_or_build(cache_key, field, lock_name, builder):
+    cache = frappe.cache()
+    value = cache.hget(cache_key, field)
+    if value:
+        return value
+
+    # Chỉ một worker build, các worker khác chờ rồi đọc lại cache
+    lock = cache.lock(
+        cache.make_key(f"{cache_key}:lock:{field}"),
+        timeout=TEST_DATA_LOCK_TIMEOUT,
+        blocking_timeout=TEST_DATA_LOCK_WAIT,
+    )
+    try:
+        with lock:
+            value = cache.hget(cache_key, field)
+            if value:
+                return value
+            value = builder()
+            cache.hset(cache_key, field, value)
+            return value
+    except LockError:
+        logger.warning(f"Timed out waiting for {lock_name} lock, building without cache.")
+        return builder()
+
+
+def get_cached_test_payload(test_meta):
+    """
+    Return the sanitized payload for `test_meta` (needs name, modified, title,
+    time_limit_minutes, instructions), building it at most once per
+    (test, modified) even when many students start the exam at the same time.
+    """
+    return _get_or_build(
+        TEST_DATA_CACHE_KEY,
+        f"{test_meta.name}:{test_meta.modified}",
+        f"test payload of {test_meta.name}",
+        lambda: build_test_payload(test_meta),
+    )
+
+
+def get_cached_answer_key(test_id):
+    """Return the compiled answer key of a test (see build_answer_key), cached per (test, modified)"""
+    test_meta = frappe.db.get_value("Test", test_id, ["name", "modified", "passing_score"], as_dict=True)
+    if not test_meta:
+        frappe.throw(_("Test {0} not found").format(test_id), frappe.DoesNotExistError)
+
+    return _get_or_build(
+        ANSWER_KEY_CACHE_KEY,
+        f"{test_meta.name}:{test_meta.modified}",
+        f"answer key of {test_meta.name}",
+        lambda: build_answer_key(test_meta),
+    )
+
+
+def clear_test_data_cache(doc=None, method=None):
+    """doc_events hook for Test and Question: drops payloads and answer keys"""
+    frappe.cache().delete_value([TEST_DATA_CACHE_KEY, ANSWER_KEY_CACHE_KEY])
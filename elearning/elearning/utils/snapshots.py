@@ -0,0 +1,136 @@
+# elearning/elearning/utils/snapshots.py
+import gzip
+import json
+import os
+
+import frappe
+from frappe import _
+from frappe.utils import cint
+
+from elearning.elearning.utils.question_bank import build_test_payload, build_answer_key, get_cached_answer_key
+
+logger = frappe.logger("snapshots")
+
+# Snapshots are immutable once written: the gzipped file under private/ is the
+# source of truth, redis only keeps the decoded payload hot for exam start storms.
+# The answer key of each version is a separate file (never sent to students),
+# so attempts are graded and shown against the version they were started on.
+SNAPSHOT_CACHE_KEY = "elearning:test_snapshot"
+SNAPSHOT_ANSWER_KEY_CACHE_KEY = "elearning:test_snapshot_answer_key"
+SNAPSHOT_CACHE_TTL = 24 * 60 * 60
+SNAPSHOT_FOLDER = "test_snapshots"
+
+
+def get_snapshot_path(test_id, version, kind=None):
+    folder = frappe.get_site_path("private", "files", SNAPSHOT_FOLDER)
+    suffix = f".{kind}" if kind else ""
+    return os.path.join(folder, f"{frappe.scrub(test_id)}-v{cint(version)}{suffix}.json.gz")
+
+
+def write_snapshot_file(test_id, version, payload, kind=None):
+    path = get_snapshot_path(test_id, version, kind)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, default=str)
+    # rename is atomic, readers never see a half-written snapshot
+    os.replace(tmp_path, path)
+
+
+def read_snapshot_file(test_id, version, kind=None):
+    path = get_snapshot_path(test_id, version, kind)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _get_cached_snapshot(cache_key, test_id, version, kind=None):
+    cache_key = f"{cache_key}:{test_id}"
+    field = str(cint(version))
+    payload = frappe.cache().hget(cache_key, field)
+    if payload:
+        return payload
+
+    payload = read_snapshot_file(test_id, version, kind)
+    if payload is None:
+        return None
+
+    frappe.cache().hset(cache_key, field, payload)
+    frappe.cache().expire(frappe.cache().make_key(cache_key), SNAPSHOT_CACHE_TTL)
+    return payload
+
+
+def get_test_snapshot(test_id, version):
+    """Return the published payload of `test_id` at `version`, or None if it doesn't exist"""
+    if not cint(version):
+        return None
+
+    payload = _get_cached_snapshot(SNAPSHOT_CACHE_KEY, test_id, version)
+    if payload is None:
+        logger.warning(f"Snapshot v{version} of Test {test_id} is missing on disk.")
+    return payload
+
+
+def get_snapshot_answer_key(test_id, version):
+    """Answer key (see build_answer_key) published with snapshot `version`, or None"""
+    if not cint(version):
+        return None
+    return _get_cached_snapshot(SNAPSHOT_ANSWER_KEY_CACHE_KEY, test_id, version, "answer_key")
+
+
+def get_attempt_answer_key(attempt):
+    """
+    Answer key an attempt is graded and shown with: the one of its pinned
+    snapshot, else (unpublished test, or published before answer keys were
+    snapshotted) the live one.
+    """
+    answer_key = get_snapshot_answer_key(attempt.test, attempt.get("snapshot_version"))
+    if answer_key is None:
+        answer_key = get_cached_answer_key(attempt.test)
+    return answer_key
+
+
+@frappe.whitelist(methods=["POST"])
+def publish_test(test_id):
+    """
+    Render the sanitized question payload of a Test once into a new immutable
+    snapshot version. Attempts started afterwards pin this version, so later
+    edits to the Test or its Questions don't change questions mid-attempt.
+    """
+    if not frappe.has_permission("Test", "write", test_id):
+        frappe.throw(_("You do not have permission to publish this test."), frappe.PermissionError)
+
+    # Khóa dòng Test để hai lần publish đồng thời không ghi cùng một version
+    test_meta = frappe.db.get_value(
+        "Test",
+        test_id,
+        ["name", "modified", "title", "time_limit_minutes", "instructions", "passing_score", "published_snapshot_version"],
+        as_dict=True,
+        for_update=True,
+    )
+    if not test_meta:
+        frappe.throw(_("Test {0} not found").format(test_id), frappe.DoesNotExistError)
+
+    payload = build_test_payload(test_meta)
+    if not payload["questions"]:
+        frappe.throw(_("Test {0} has no questions to publish.").format(test_id), frappe.ValidationError)
+
+    version = cint(test_meta.published_snapshot_version) + 1
+    payload["snapshot_version"] = version
+    answer_key = build_answer_key(test_meta)
+    # Answer key first: a version whose payload exists always has its key
+    write_snapshot_file(test_id, version, answer_key, "answer_key")
+    write_snapshot_file(test_id, version, payload)
+
+    # update_modified=False: publishing doesn't change the Test content itself
+    frappe.db.set_value("Test", test_id, "published_snapshot_version", version, update_modified=False)
+    frappe.clear_document_cache("Test", test_id)
+    frappe.db.commit()
+
+    for cache_key, value in ((SNAPSHOT_CACHE_KEY, payload), (SNAPSHOT_ANSWER_KEY_CACHE_KEY, answer_key)):
+        frappe.cache().hset(f"{cache_key}:{test_id}", str(version), value)
+        frappe.cache().expire(frappe.cache().make_key(f"{cache_key}:{test_id}"), SNAPSHOT_CACHE_TTL)
+
+    logger.info(f"Published snapshot v{version} of Test {test_id} with {len(payload['questions'])} questions.")
+    return {"test_id": test_id, "snapshot_version": version, "question_count": len(payload["questions"])}
@@ -0,0 +1,136 @@
+# elearning/elearning/utils/study_analytics.py
+import frappe
+from frappe import _
+from frappe.utils import getdate, cint
+
+logger = frappe.logger("study_analytics")
+
+# One redis hash per user, one field per year -> clearing the hash drops every year at once
+STUDY_TIME_CACHE_PREFIX = "elearning:study_time_by_month"
+STUDY_TIME_CACHE_TTL = 6 * 60 * 60
+
+FLASHCARD_MODES = ("Basic", "Exam", "SRS")
+
+
+def get_current_user():
+    user = frappe.session.user
+    if user == "Guest":
+        frappe.throw(_("Authentication required."), frappe.AuthenticationError)
+    return user
+
+
+def get_year_range(year):
+    """
+    Return the half-open [start, end) datetime range for a year.
+    Filtering with `ts >= start AND ts < end` lets MariaDB use an index on ts,
+    which YEAR(ts) = %s can't.
+    """
+    year = cint(year) or getdate().year
+    return f"{year}-01-01 00:00:00", f"{year + 1}-01-01 00:00:00"
+
+
+def get_study_time_cache_key(user):
+    return f"{STUDY_TIME_CACHE_PREFIX}:{user}"
+
+
+def clear_study_time_cache(doc, method=None):
+    """doc_events hook: drop the cached dashboard of the user who owns `doc`"""
+    user = doc.get("user")
+    if user:
+        frappe.cache().delete_value(get_study_time_cache_key(user))
+
+
+@frappe.whitelist()
+def get_study_time_by_month(year=None):
+    """
+    Dashboard aggregate for the study-time chart.
+
+    Returns the three monthly series that used to come from
+    `get_flashcard_time_by_month`, `get_exam_attempt_time_by_month` and
+    `get_srs_time_by_month` in one response (same item shapes), built from a
+    single UNION ALL query and cached per user/year.
+    """
+    user = get_current_user()
+    year = cint(year) or getdate().year
+
+    cache_key = get_study_time_cache_key(user)
+    cached = frappe.cache().hget(cache_key, str(year))
+    if cached:
+        return cached
+
+    start, end = get_year_range(year)
+    rows = frappe.db.sql(
+        """
+        SELECT 'flashcard' AS source, mode, MONTH(start_time) AS month,
+               SUM(time_spent_seconds) AS time_spent
+        FROM `tabFlashcard Session`
+        WHERE user = %(user)s AND start_time >= %(start)s AND start_time < %(end)s
+        GROUP BY mode, MONTH(start_time)
+
+        UNION ALL
+
+        SELECT 'exam' AS source, NULL AS mode, MONTH(creation) AS month,
+               SUM(time_spent_seconds) AS time_spent
+        FROM `tabUser Exam Attempt`
+        WHERE user = %(user)s AND creation >= %(start)s AND creation < %(end)s
+        AND completion_timestamp IS NOT NULL
+        GROUP BY MONTH(creation)
+
+        UNION ALL
+
+        SELECT 'srs' AS source, NULL AS mode, MONTH(last_review_timestamp) AS month,
+               SUM(total_time_spent_seconds) AS time_spent
+        FROM `tabUser SRS Progress`
+        WHERE user = %(user)s AND last_review_timestamp >= %(start)s AND last_review_timestamp < %(end)s
+        GROUP BY MONTH(last_review_timestamp)
+        """,
+        {"user": user, "start": start, "end": end},
+        as_dict=True,
+    )
+
+    flashcard_by_month = {}
+    exam_by_month = {}
+    srs_by_month = {}
+    for row in rows:
+        time_spent = row.time_spent or 0
+        if row.source == "flashcard":
+            if row.mode in FLASHCARD_MODES:
+                flashcard_by_month.setdefault(row.month, {}).setdefault(row.mode, 0)
+                flashcard_by_month[row.month][row.mode] += time_spent
+        elif row.source == "exam":
+            exam_by_month[row.month] = time_spent
+        else:
+            srs_by_month[row.month] = time_spent
+
+    flashcard_series = []
+    exam_series = []
+    srs_series = []
+    for month in range(1, 13):
+        month_name = frappe.utils.formatdate(f"{year}-{month:02d}-01", "MMM")
+        modes = flashcard_by_month.get(month, {})
+        basic_time = modes.get("Basic", 0)
+        exam_time = modes.get("Exam", 0)
+        srs_time = modes.get("SRS", 0)
+
+        flashcard_series.append({
+            "month": month,
+            "month_name": month_name,
+            "basic_time": basic_time,
+            "exam_time": exam_time,
+            "srs_time": srs_time,
+            "study_time": basic_time + srs_time,
+            "test_time": exam_time
+        })
+        exam_series.append({"month": month, "month_name": month_name, "time_spent": exam_by_month.get(month, 0)})
+        srs_series.append({"month": month, "month_name": month_name, "time_spent": srs_by_month.get(month, 0)})
+
+    result = {
+        "year": year,
+        "flashcard": flashcard_series,
+        "exam_attempts": exam_series,
+        "srs_progress": srs_series
+    }
+
+    frappe.cache().hset(cache_key, str(year), result)
+    frappe.cache().expire(frappe.cache().make_key(cache_key), STUDY_TIME_CACHE_TTL)
+    return result
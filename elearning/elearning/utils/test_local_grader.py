@@ -0,0 +1,83 @@
+# Copyright (c) 2026, Minh Quy and Contributors
+# See license.txt
+
+import time
+import unittest
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from elearning.elearning.utils.local_grader import (
+    looks_like_formula, match_number, match_ordering, match_symbolic, match_text, parse_step_order, spearman_rho, sympy
+)
+
+
+def make_steps(*contents):
+    return [frappe._dict(step_content=content, correct_order=order) for order, content in enumerate(contents, start=1)]
+
+
+class TestLocalGrader(FrappeTestCase):
+    def test_match_text(self):
+        self.assertEqual(match_text("<p>Tam giác đều</p>", "tam giác đều")["method"], "exact")
+        self.assertEqual(match_text("tam giac deu", "Tam giác đều")["method"], "diacritics")
+        self.assertIsNone(match_text("tam giác vuông", "tam giác đều"))
+
+    def test_match_number(self):
+        for answer in ("1/2", "0,5", "\\dfrac{1}{2}", "50%"):
+            self.assertTrue(match_number(answer, "0.5")["is_correct"], answer)
+        self.assertFalse(match_number("0.6", "1/2")["is_correct"])
+        # Within the default relative tolerance
+        self.assertTrue(match_number("1000000.0000001", "1000000")["is_correct"])
+        self.assertIsNone(match_number("x = 0.5", "tam giác"))
+
+
+class TestOrdering(FrappeTestCase):
+    def setUp(self):
+        self.steps = make_steps("Chuyển vế", "Rút gọn", "Chia hai vế cho 2", "Kết luận")
+
+    def test_spearman_rho(self):
+        self.assertEqual(spearman_rho([1, 2, 3, 4]), 1)
+        self.assertEqual(spearman_rho([4, 3, 2, 1]), -1)
+        self.assertEqual(spearman_rho([2, 1, 3, 4]), 0.8)
+
+    def test_parse_step_order(self):
+        self.assertEqual(parse_step_order("2, 1, 3, 4", self.steps), [2, 1, 3, 4])
+        self.assertEqual(parse_step_order("Bước 2 -> bước 1 -> bước 3 -> bước 4", self.steps), [2, 1, 3, 4])
+        self.assertEqual(parse_step_order("rut gon\nchuyen ve\nchia hai ve cho 2\nket luan", self.steps), [2, 1, 3, 4])
+        # A step missing or used twice
+        self.assertIsNone(parse_step_order("1, 2, 3", self.steps))
+        self.assertIsNone(parse_step_order("1, 1, 3, 4", self.steps))
+
+    def test_misordered_steps_get_partial_score(self):
+        self.assertTrue(match_ordering("1, 2, 3, 4", self.steps)["is_correct"])
+        grade = match_ordering("2, 1, 3, 4", self.steps)
+        self.assertFalse(grade["is_correct"])
+        self.assertEqual(grade["score"], 0.8)
+        self.assertEqual(grade["misplaced"], [1, 2])
+        # Negative correlation scores 0, not below
+        self.assertEqual(match_ordering("4, 3, 2, 1", self.steps)["score"], 0)
+
+
+@unittest.skipUnless(sympy, "sympy is not installed")
+class TestSymbolicMatch(FrappeTestCase):
+    def test_equivalent_formulas_match(self):
+        self.assertTrue(match_symbolic("x^2+2xy+y^2", "(x+y)^2")["is_correct"])
+        self.assertTrue(match_symbolic("\\frac{1}{2}x", "x/2")["is_correct"])
+        # Same equation with the sides swapped
+        self.assertTrue(match_symbolic("2x+1=y", "y=2x+1")["is_correct"])
+
+    def test_different_formulas_dont_match(self):
+        self.assertIsNone(match_symbolic("a-b", "b-a"))
+        self.assertIsNone(match_symbolic("x+1", "x+2"))
+
+    def test_hyphenated_words_are_not_formulas(self):
+        # Both would parse as t*a*m - g*i*a*c
+        self.assertFalse(looks_like_formula("tam-giac"))
+        self.assertIsNone(match_symbolic("tam-giac", "mat-giac"))
+        self.assertTrue(looks_like_formula("2ab+c"))
+
+    def test_huge_values_are_bounded(self):
+        started = time.monotonic()
+        self.assertIsNone(match_symbolic("exp(exp(exp(99)))+x", "x+1"))
+        self.assertIsNone(match_symbolic("9^9^9^9", "1"))
+        self.assertLess(time.monotonic() - started, 1)
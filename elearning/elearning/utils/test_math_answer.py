@@ -0,0 +1,45 @@
+# Copyright (c) 2026, Minh Quy and Contributors
+# See license.txt
+
+from fractions import Fraction
+
+from frappe.tests.utils import FrappeTestCase
+
+from elearning.elearning.utils.math_answer import (
+    canonicalize, compile_answer_key, match_answer_key, parse_math_number, split_accepted_answers
+)
+
+
+class TestMathAnswer(FrappeTestCase):
+    def test_canonicalize(self):
+        self.assertEqual(canonicalize("\\dfrac{1}{2}"), "(1)/(2)")
+        self.assertEqual(canonicalize(" X = 0,5 "), "x=0.5")
+        self.assertEqual(canonicalize("2 \\cdot 3"), "2*3")
+
+    def test_parse_math_number(self):
+        for text in ("1/2", "0,5", "\\dfrac{1}{2}", "50%", "(1)/(2)"):
+            self.assertEqual(parse_math_number(canonicalize(text)), Fraction(1, 2), text)
+        self.assertIsNone(parse_math_number(canonicalize("x+1")))
+        self.assertIsNone(parse_math_number("1/0"))
+
+    def test_equivalent_forms_match(self):
+        compiled = compile_answer_key(["1/2"])
+        for answer in ("1/2", "0,5", "0.5", "\\dfrac{1}{2}", "\\frac{1}{2}", "50%", "x = 0.5"):
+            self.assertTrue(match_answer_key(answer, compiled), answer)
+        self.assertFalse(match_answer_key("0.51", compiled))
+        self.assertFalse(match_answer_key(None, compiled))
+
+    def test_tolerance(self):
+        compiled = compile_answer_key(["3.14"], tolerance=0.01)
+        self.assertTrue(match_answer_key("3,141", compiled))
+        self.assertFalse(match_answer_key("3.2", compiled))
+
+    def test_variable_prefix_only_without_equation_keys(self):
+        self.assertTrue(match_answer_key("x=2", compile_answer_key(["2"])))
+        # The key is an equation: "y=2" has to match it as text
+        self.assertFalse(match_answer_key("y=2", compile_answer_key(["x=2"])))
+
+    def test_accepted_answers(self):
+        answers = split_accepted_answers("2", "hai\n\n 2.0 ")
+        self.assertEqual(answers, ["2", "hai", "2.0"])
+        self.assertTrue(match_answer_key("Hai", compile_answer_key(answers)))
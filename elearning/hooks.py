@@ -133,6 +133,46 @@ app_license = "mit"
 # ---------------
 # Hook on document methods and events
 
+doc_events = {
+    "Flashcard Session": {
+        "on_update": "elearning.elearning.utils.study_analytics.clear_study_time_cache",
+        "on_trash": "elearning.elearning.utils.study_analytics.clear_study_time_cache"
+    },
+    "User Exam Attempt": {
+        "on_update": "elearning.elearning.utils.study_analytics.clear_study_time_cache",
+        "on_trash": "elearning.elearning.utils.study_analytics.clear_study_time_cache"
+    },
+    "User SRS Progress": {
+        "on_update": "elearning.elearning.utils.study_analytics.clear_study_time_cache",
+        "on_trash": "elearning.elearning.utils.study_analytics.clear_study_time_cache"
+    },
+    "Test": {
+        "on_update": [
+            "elearning.elearning.utils.catalog_cache.clear_catalog_cache",
+            "elearning.elearning.utils.question_bank.clear_test_data_cache"
+        ],
+        "on_trash": [
+            "elearning.elearning.utils.catalog_cache.clear_catalog_cache",
+            "elearning.elearning.utils.question_bank.clear_test_data_cache"
+        ]
+    },
+    "Question": {
+        "on_update": "elearning.elearning.utils.question_bank.clear_test_data_cache",
+        "on_trash": "elearning.elearning.utils.question_bank.clear_test_data_cache"
+    },
+    "Flashcard": {
+        "on_update": "elearning.elearning.utils.answer_clusters.clear_flashcard_clusters",
+        "on_trash": "elearning.elearning.utils.answer_clusters.clear_flashcard_clusters"
+    },
+    "Rubric Score Item": {
+        "on_update": "elearning.elearning.doctype.test_attempt.test_attempt.clear_attempt_result_cache",
+        "on_trash": "elearning.elearning.doctype.test_attempt.test_attempt.clear_attempt_result_cache"
+    },
+    "Topics": {
+        "on_update": "elearning.elearning.utils.catalog_cache.clear_catalog_cache",
+        "on_trash": "elearning.elearning.utils.catalog_cache.clear_catalog_cache"
+    }
+}
 
 # Fixtures
 # ---------------
@@ -230,6 +270,23 @@ fixtures = [
 # 	],
 # }
 
+scheduler_events = {
+    "daily": [
+        "elearning.elearning.doctype.user_exam_attempt.user_exam_attempt.repair_exam_attempt_counters"
+    ],
+    "cron": {
+        "* * * * *": [
+            "elearning.elearning.utils.attempt_buffer.flush_attempt_buffers",
+            "elearning.elearning.doctype.test_attempt.test_attempt.auto_submit_expired_attempts",
+            "elearning.elearning.doctype.test_attempt.test_attempt.grade_deferred_essays"
+        ],
+        "*/15 * * * *": [
+            "elearning.elearning.doctype.daily_study_rollup.daily_study_rollup.refresh_daily_study_rollups",
+            "elearning.elearning.doctype.test_attempt.test_attempt.retry_failed_attempt_summaries"
+        ]
+    }
+}
+
 # Testing
 # -------
 
@@ -261,7 +318,7 @@ cors_headers = [
 # Response Hooks
 # -------------------------
 # Xử lý trước khi trả về response
-after_request = ["elearning.api.api.handle_cors"]
+after_request = ["elearning.api.api.handle_cors", "elearning.api.api.apply_response_headers"]
 
 # exempt linked doctypes from being automatically cancelled
 #
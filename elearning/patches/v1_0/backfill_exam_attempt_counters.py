@@ -0,0 +1,6 @@
+from elearning.elearning.doctype.user_exam_attempt.user_exam_attempt import repair_exam_attempt_counters
+
+
+def execute():
+    """Fill the new User Exam Attempt counters from existing details"""
+    repair_exam_attempt_counters()
@@ -0,0 +1,26 @@
+import json
+
+import frappe
+
+from elearning.elearning.utils.math_answer import compile_answer_key, split_accepted_answers
+from elearning.elearning.utils.question_bank import clear_test_data_cache
+
+
+def execute():
+    """Compile the answer keys of existing Self Write questions and drop answer keys cached in the old format"""
+    questions = frappe.get_all(
+        "Question",
+        filters={"question_type": "Self Write"},
+        fields=["name", "answer_key", "accepted_answers", "answer_tolerance"],
+    )
+    for question in questions:
+        if not question.answer_key:
+            continue
+        compiled = compile_answer_key(
+            split_accepted_answers(question.answer_key, question.accepted_answers), question.answer_tolerance
+        )
+        frappe.db.set_value(
+            "Question", question.name, "compiled_answer_key", json.dumps(compiled, ensure_ascii=False), update_modified=False
+        )
+
+    clear_test_data_cache()
@@ -0,0 +1,17 @@
+import frappe
+
+
+def execute():
+    """Backfill the denormalized Test.question_count from Test Question Item rows"""
+    frappe.db.sql(
+        """
+        UPDATE `tabTest` t
+        LEFT JOIN (
+            SELECT parent, COUNT(*) AS question_count
+            FROM `tabTest Question Item`
+            WHERE parenttype = 'Test'
+            GROUP BY parent
+        ) items ON items.parent = t.name
+        SET t.question_count = COALESCE(items.question_count, 0)
+        """
+    )
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useDebouncedCallback } from "use-debounce";
 import { fetchWithAuth } from "@/pages/api/helper";
 
@@ -16,6 +16,11 @@ export function useAutoSave({
   isSubmitting, // To prevent saving during submission
 }) {
   const [isSaving, setIsSaving] = useState(false);
+  // Last userAnswer acknowledged by the server, per test_question_detail_id
+  const lastSavedAnswersRef = useRef({});
+  const lastSavedViewedRef = useRef(null);
+  // Highest seq the server has seen for this attempt (ours or another tab's)
+  const lastSeqRef = useRef(0);
 
   const debouncedSaveProgress = useDebouncedCallback(
     async (reason = "auto") => {
@@ -45,24 +50,72 @@ export function useAutoSave({
         currentSessionQuestionFiles
       );
 
-      const progressPayloadForBackend = {
-        answers: currentAnswersForSave,
-        remainingTimeSeconds: countdown,
-        lastViewedTestQuestionId: currentQuestionData?.question_id, // Use question_id for backend reference
-      };
+      // Only send answers that changed since the last acknowledged save
+      const changedAnswers = {};
+      Object.entries(currentAnswersForSave || {}).forEach(([detailId, answer]) => {
+        const serialized = JSON.stringify(answer?.userAnswer ?? null);
+        if (lastSavedAnswersRef.current[detailId] !== serialized) {
+          changedAnswers[detailId] = { userAnswer: answer?.userAnswer ?? null };
+        }
+      });
 
-      const payload = {
-        attempt_id: testAttemptId,
-        progress_data: JSON.stringify(progressPayloadForBackend),
+      // The timer is server-side now: nothing changed means nothing to send
+      if (
+        Object.keys(changedAnswers).length === 0 &&
+        lastSavedViewedRef.current === currentTestQuestionDetailId
+      ) {
+        setSavedStatus("saved");
+        setIsSaving(false);
+        return;
+      }
+
+      const deltaPayloadForBackend = {
+        // Timestamps are strictly increasing across reloads, the backend rejects older ones
+        seq: Math.max(Date.now(), lastSeqRef.current + 1),
+        answers: changedAnswers,
+        remainingTimeSeconds: countdown,
+        lastViewedTestQuestionId: currentTestQuestionDetailId,
       };
-      console.log(`Saving progress (${reason}):`, payload);
 
-      try {
-        await fetchWithAuth(`test_attempt.test_attempt.save_attempt_progress`, {
+      const sendDelta = (delta) => {
+        const payload = {
+          attempt_id: testAttemptId,
+          delta_data: JSON.stringify(delta),
+        };
+        console.log(`Saving progress (${reason}):`, payload);
+        return fetchWithAuth(`test_attempt.test_attempt.autosave_attempt_delta`, {
           method: "PATCH",
           body: payload,
           // Removed Content-Type, fetchWithAuth handles it
         });
+      };
+
+      try {
+        let sentAnswers = changedAnswers;
+        let result = (await sendDelta(deltaPayloadForBackend))?.message;
+        if (result?.stale) {
+          // Another tab (or a clock that went backwards) saved with a higher seq:
+          // this tab's answers are the newest, resend all of them above that seq
+          sentAnswers = {};
+          Object.entries(currentAnswersForSave || {}).forEach(([detailId, answer]) => {
+            sentAnswers[detailId] = { userAnswer: answer?.userAnswer ?? null };
+          });
+          lastSeqRef.current = Math.max(lastSeqRef.current, result.seq || 0);
+          deltaPayloadForBackend.seq = Math.max(Date.now(), lastSeqRef.current + 1);
+          deltaPayloadForBackend.answers = sentAnswers;
+          result = (await sendDelta(deltaPayloadForBackend))?.message;
+        }
+        if (!result?.success) {
+          // Still rejected: leave the answers unsaved so the next save retries them
+          lastSeqRef.current = Math.max(lastSeqRef.current, result?.seq || 0);
+          setSavedStatus("unsaved");
+          return;
+        }
+        lastSeqRef.current = deltaPayloadForBackend.seq;
+        Object.entries(sentAnswers).forEach(([detailId, answer]) => {
+          lastSavedAnswersRef.current[detailId] = JSON.stringify(answer.userAnswer);
+        });
+        lastSavedViewedRef.current = currentTestQuestionDetailId;
         setSavedStatus("saved");
       } catch (error) {
         console.error(`Error saving progress (${reason}):`, error);
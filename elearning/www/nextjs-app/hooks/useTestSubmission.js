@@ -1,4 +1,4 @@
-import { useState, useCallback } from "react";
+import { useState, useCallback, useRef } from "react";
 import { useRouter } from "next/router";
 import { fetchWithAuth } from "@/pages/api/helper";
 
@@ -24,6 +24,8 @@ export function useTestSubmission({
   const [showErrorDialog, setShowErrorDialog] = useState(false);
   const [errorDialogTitle, setErrorDialogTitle] = useState("Thông báo lỗi");
   const [errorDialogMessage, setErrorDialogMessage] = useState("");
+  // One key per attempt: retries after a timeout reuse it so the backend doesn't grade twice
+  const submissionKeyRef = useRef(null);
 
   const executeSubmit = useCallback(async () => {
     setShowSubmitConfirmDialog(false);
@@ -42,8 +44,13 @@ export function useTestSubmission({
       currentSessionQuestionFiles
     );
 
+    if (!submissionKeyRef.current?.startsWith(`${testAttemptId}:`)) {
+      submissionKeyRef.current = `${testAttemptId}:${crypto.randomUUID()}`;
+    }
+
     const submissionPayload = {
       attempt_id: testAttemptId,
+      idempotency_key: submissionKeyRef.current,
       submission_data: JSON.stringify({
         answers: answersDataForSubmit,
         timeLeft: countdown,